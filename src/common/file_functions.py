@@ -1,8 +1,38 @@
 import sys
+import io
+import json
+import gzip
+import time
+import collections
+import threading
+import concurrent.futures
+import multiprocessing
 from pathlib import Path
 import csv
+import numpy as np
 import pandas as pd
-from astropy.table import Table
+from astropy.table import Table, Column
+
+
+
+# rows formatted and written at a time by write_speck_rows
+SPECK_CHUNK_ROWS = 100000
+
+# decimals of the float columns in speck files ('%.8f')
+SPECK_DECIMALS = 8
+
+# binary column files: magic bytes, format version, and the alignment of the header and every column
+BINARY_MAGIC = b'DUCOLBIN'
+BINARY_VERSION = 1
+BINARY_ALIGN = 64
+
+# compressed outputs: file suffixes, default levels, and the bytes of text compressed per block by each thread
+COMPRESSION_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+COMPRESSION_LEVELS = {'gzip': 6, 'zstd': 3}
+COMPRESSION_BLOCK_BYTES = 4 * 2**20
+
+# byte padding speck fields to a fixed width while formatting (it never appears in UTF-8 text)
+PAD = 255
 
 
 
@@ -54,6 +84,123 @@ def test_path(path):
 
 
 
+# -----------------------------------------------------------------------------
+def open_output(filename, compression=None, threads=None, level=None):
+    """
+    Open a text output file, optionally compressed on the fly.
+
+    Without ``compression`` this is ``open(filename, 'w', encoding='UTF-8')``. With 'gzip' or 'zstd', the
+    text is cut into blocks that are compressed in parallel threads and written in order, as independent
+    gzip members or zstd frames (which gunzip, zstd and Python's gzip module read as one stream), to
+    ``filename`` plus '.gz' or '.zst'. Closing the file writes the last block, closes it, and prints the
+    compression ratio and throughput. Use it in a ``with`` block so it is closed even on errors.
+
+    :param filename: The output file name (without the compression suffix).
+    :type filename: str
+    :param compression: None, 'gzip' or 'zstd' (zstd needs the zstandard package).
+    :type compression: str
+    :param threads: Number of compression threads. Defaults to the number of cores.
+    :type threads: int
+    :param level: Compression level. Defaults to 6 for gzip and 3 for zstd.
+    :type level: int
+    :raises Exception: Raised if ``compression`` is not gzip or zstd, or zstandard is not installed for zstd.
+    :return: A writable text file object.
+    :rtype: file
+    """
+    if(compression is None):
+        return open(filename, 'w', encoding='UTF-8')
+    if(compression not in COMPRESSION_SUFFIXES):
+        raise Exception('file_functions.open_output: compression must be gzip or zstd, not \'' + str(compression) + '\'')
+    return _CompressedOutput(filename + COMPRESSION_SUFFIXES[compression], compression, threads, level)
+
+
+
+class _CompressedOutput:
+    # a text file whose blocks are compressed by a thread pool (zlib and zstd release the GIL while
+    # compressing) and written in order; at most two blocks per thread are held in memory
+
+    def __init__(self, filename, compression, threads, level):
+        if(compression == 'zstd'):
+            try:
+                import zstandard
+            except ImportError:
+                raise Exception('file_functions.open_output: zstd compression needs the zstandard package')
+            level = COMPRESSION_LEVELS['zstd'] if level is None else level
+            self.compress = lambda block: zstandard.ZstdCompressor(level=level).compress(block)
+        else:
+            level = COMPRESSION_LEVELS['gzip'] if level is None else level
+            self.compress = lambda block: gzip.compress(block, compresslevel=level, mtime=0)
+
+        self.name = filename
+        self.threads = threads if threads is not None else (multiprocessing.cpu_count() or 1)
+        self.file = open(filename, 'wb')
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.threads)
+        self.pending = collections.deque()
+        self.buffer = []
+        self.buffered = 0
+        self.raw_bytes = 0
+        self.blocks = 0
+        self.compress_seconds = 0.0
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def write(self, text):
+        data = text.encode('UTF-8')
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if(self.buffered >= COMPRESSION_BLOCK_BYTES):
+            self._submit()
+        return len(text)
+
+    def _submit(self):
+        block = b''.join(self.buffer)
+        self.buffer = []
+        self.buffered = 0
+        self.raw_bytes += len(block)
+        self.blocks += 1
+        self.pending.append(self.executor.submit(self._timed_compress, block))
+        # write the finished blocks in order, waiting for the oldest if too many are in flight
+        while(self.pending and (self.pending[0].done() or len(self.pending) > 2 * self.threads)):
+            self.file.write(self.pending.popleft().result())
+
+    def _timed_compress(self, block):
+        start = time.perf_counter()
+        compressed = self.compress(block)
+        with self.lock:
+            self.compress_seconds += time.perf_counter() - start
+        return compressed
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if(self.closed):
+            return
+        self.closed = True
+        try:
+            if(self.buffer or self.blocks == 0):
+                self._submit()
+            while(self.pending):
+                self.file.write(self.pending.popleft().result())
+        finally:
+            self.executor.shutdown(wait=True)
+            self.file.close()
+
+        # throughput per compression thread, so it doesn't include the time spent formatting the text
+        compressed_bytes = Path(self.name).stat().st_size
+        print('file_functions: ' + self.name + ': ' + format(self.raw_bytes / 2**20, '.1f') + ' MB -> ' + format(compressed_bytes / 2**20, '.1f') + ' MB'
+              + ' (ratio ' + format(self.raw_bytes / max(compressed_bytes, 1), '.2f') + ', ' + format(self.raw_bytes / 2**20 / max(self.compress_seconds, 1e-9), '.1f') + ' MB/s per thread)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+
+
+
 # -----------------------------------------------------------------------------
 def write_header(metadata, out):
     """
@@ -78,8 +225,8 @@ def write_header(metadata, out):
 
 
 
- # -----------------------------------------------------------------------------
-def to_csv(metadata, df, columns):
+# -----------------------------------------------------------------------------
+def to_csv(metadata, df, columns, compression=None):
     """
     Write dataframe to a comma separated-formatted file.
 
@@ -91,36 +238,74 @@ def to_csv(metadata, df, columns):
     :type df: DataFrame
     :param columns: A dataframe which contains the columns of ``df`` to be included in the necessary order. It also contains a 'description' column which contains descriptions that are attached to each column in the csv file.
     :type columns: DataFrame
+    :param compression: Optionally compress the file on the fly: 'gzip' or 'zstd' (see ``open_output``).
+    :type compression: str
     """
-
-    #set our dataframe with our desired columns and rename speck_label column
-    df_csv = df[columns['name']].rename(columns={'speck_label':'identifiers'}, inplace=False)
-    
     filename = metadata['fileroot'] + '.csv'
-    out = open(filename, 'w', encoding='UTF-8')
-    
+    with open_output(filename, compression) as out:
+        write_csv_header(metadata, columns, out)
+        write_csv_rows(df, columns, out)
+        # Trailing newline, as print() of the data block would add
+        out.write('\n')
+
+
+
+
+
+# -----------------------------------------------------------------------------
+def write_csv_header(metadata, columns, out):
+    """
+    Write the header and column lines of a csv file.
+
+    :param metadata: A dataframe with metadata about the data set.
+    :type metadata: DataFrame
+    :param columns: A dataframe which contains the columns to be included in the necessary order and their 'description'.
+    :type columns: DataFrame
+    :param out: A file to print out to (needs to be opened before function call)
+    :type out: file
+    """
     # Print the metadata defined in the main function
     write_header(metadata, out)
 
     # Print the column lines.
-    # We look at the columns after the x,y,z (start range at 3), 
-    # and up until "speck_label" column, which must appear in 
-    # every speck file as named.
+    # The speck_label column is renamed to identifiers in the csv file.
+    names = ['identifiers' if name == 'speck_label' else name for name in columns['name']]
     column_lines = ''
-    for i in range(len(df_csv.columns)):
-        column_lines += '# COLUMN ' + ' ' + df_csv.columns[i] + '  ' + columns['description'][i] + '\n'
+    for i in range(len(names)):
+        column_lines += '# COLUMN ' + ' ' + names[i] + '  ' + columns['description'][i] + '\n'
     # names
     print(column_lines+'#', file=out)
 
+
+
+
+
+# -----------------------------------------------------------------------------
+def write_csv_rows(df, columns, out):
+    """
+    Write the data rows of ``df`` to an open csv file.
+
+    Can be called repeatedly on consecutive chunks of a data set to append to the same file.
+
+    :param df: A dataframe of (a chunk of) the main data set.
+    :type df: DataFrame
+    :param columns: A dataframe which contains the columns of ``df`` to be included in the necessary order.
+    :type columns: DataFrame
+    :param out: A file to print out to (needs to be opened before function call)
+    :type out: file
+    """
+    #set our dataframe with our desired columns and rename speck_label column
+    df_csv = df[columns['name']].rename(columns={'speck_label':'identifiers'}, inplace=False)
+
     # Print the data
-    print(df_csv.to_csv(path_or_buf=None, header=False, lineterminator='\n', index=False), file=out)
+    out.write(df_csv.to_csv(path_or_buf=None, header=False, lineterminator='\n', index=False))
 
 
 
 
 
- # -----------------------------------------------------------------------------
-def to_speck(metadata, df, columns):
+# -----------------------------------------------------------------------------
+def to_speck(metadata, df, columns, compression=None):
     """
     Write dataframe to a speck-formatted file.
 
@@ -132,49 +317,207 @@ def to_speck(metadata, df, columns):
     :type df: DataFrame
     :param columns: A dataframe which contains the columns of ``df`` to be included in the necessary order. It also contains a 'description' column which contains descriptions that are attached to each column in the speck file.
     :type columns: DataFrame
+    :param compression: Optionally compress the file on the fly: 'gzip' or 'zstd' (see ``open_output``).
+    :type compression: str
     """
     # 'columns' argument is a dataframe containing metadata on the columns we want to print to the speck file
-
-    df_speck = df[columns['name']]
-    
     filename = metadata['fileroot'] + '.speck'
-    out = open(filename, 'w', encoding='UTF-8')
-    
-    #replace any spaces in label column with double underscores for speck file formatting
-    df_speck.loc[0:len(df_speck),'speck_label'].replace(' ', '__', regex=True, inplace=True)
+    with open_output(filename, compression) as out:
+        write_speck_header(metadata, columns, out)
+        write_speck_rows(df, columns, out)
+        # Trailing newline, as print() of the data block would add
+        out.write('\n')
+
+
+
 
 
+# -----------------------------------------------------------------------------
+def write_speck_header(metadata, columns, out):
+    """
+    Write the header and datavar lines of a speck file.
+
+    :param metadata: A dataframe with metadata about the data set.
+    :type metadata: DataFrame
+    :param columns: A dataframe which contains the columns to be included in the necessary order and their 'description'.
+    :type columns: DataFrame
+    :param out: A file to print out to (needs to be opened before function call)
+    :type out: file
+    """
     # Print the metadata defined in the main function
     write_header(metadata, out)
-#     print('# ' + metadata['project'] + ': ' + metadata['sub_project'], file=out)
-#     print('# ' + metadata['catalog'] + ', ' + metadata['catalog_author'] + ', ' + metadata['catalog_year'], file=out)
-#     print('# Prepared by: ' + metadata['prepared_by'], file=out)
-#     print('# Version ' + metadata['version'], file=out)
-#     print('# ' + metadata['data_group_desc'], file=out)
-#     print(file=out)
-
 
     # Print the datavar lines.
     # We look at the columns after the x,y,z (start range at 3), 
     # and up until "speck_label" column, which must appear in 
     # every speck file as named.
+    names = list(columns['name'])
     datavar_lines = ''
-    for i in range(3, list(df_speck.columns).index('speck_label')):
-        datavar_lines += 'datavar ' + str(i-3) + ' ' + df_speck.columns[i] + '   # ' + columns['description'][i] + '\n'
+    for i in range(3, names.index('speck_label')):
+        datavar_lines += 'datavar ' + str(i-3) + ' ' + names[i] + '   # ' + columns['description'][i] + '\n'
     # names
     print(datavar_lines, file=out)
 
-    # Print the data
-    # We replace the '__' with a space because we add the '__' for spaces in the names and 
-    # speck comment so that 
-    print(df_speck.to_csv(path_or_buf=None, sep=' ', na_rep='0', header=False, index=False, quoting=csv.QUOTE_NONE, quotechar="",  escapechar=" ", lineterminator='\n', float_format='%.8f').replace('__', ' '), file=out)
+
+
+
+
+# -----------------------------------------------------------------------------
+def write_speck_rows(df, columns, out, chunk_rows=SPECK_CHUNK_ROWS):
+    """
+    Write the data rows of ``df`` to an open speck file.
+
+    Can be called repeatedly on consecutive chunks of a data set to append to the same file. The rows are
+    formatted and written ``chunk_rows`` at a time, with float columns formatted with vectorized
+    fixed-precision arithmetic, so only one chunk of text is held in memory. The output is the same as
+    writing ``df`` with ``DataFrame.to_csv`` (space separated, floats as '%.8f', missing values as 0).
+
+    :param df: A dataframe of (a chunk of) the main data set.
+    :type df: DataFrame
+    :param columns: A dataframe which contains the columns of ``df`` to be included in the necessary order.
+    :type columns: DataFrame
+    :param out: A file to print out to (needs to be opened before function call)
+    :type out: file
+    :param chunk_rows: Number of rows formatted at a time.
+    :type chunk_rows: int
+    """
+    names = list(columns['name'])
+    label_rows = _speck_label_rows(df)
+
+    for start in range(0, len(df), chunk_rows):
+        stop = min(start + chunk_rows, len(df))
+        fields = _speck_fields(df, names, start, stop, label_rows)
+        out.write(_speck_lines([fields[name] for name in names]))
+
+
+
+
+
+def _speck_label_rows(df):
+    # spaces in the label column are replaced with double underscores for speck file formatting
+    # (for the rows df.loc[0:len(df)] selects), and turned back into spaces after the csv escaping
+    return range(len(df))[df.index.slice_indexer(0, len(df))]
+
+
+
+def _speck_fields(df, names, start, stop, label_rows):
+    # byte matrices of the speck text of each column, for rows [start, stop)
+    # (the same csv writer settings DataFrame.to_csv uses, to escape non-numeric fields)
+    field_buffer = io.StringIO()
+    field_writer = csv.writer(field_buffer, delimiter=' ', quoting=csv.QUOTE_NONE, quotechar=None, escapechar=' ', lineterminator='\n')
+    fields = {}
+    for name in names:
+        if name == 'speck_label':
+            labels = max(label_rows.start, start) - start, min(label_rows.stop, stop) - start
+        else:
+            labels = None
+        fields[name] = _speck_bytes(df[name].iloc[start:stop], labels, field_buffer, field_writer)
+    return fields
+
+
+
+def _speck_lines(fields):
+    # join byte matrices of fields into space separated lines, then drop the padding
+    if not fields or not len(fields[0]):
+        return ''
+    separator = np.full((len(fields[0]), 1), ord(' '), dtype=np.uint8)
+    parts = []
+    for field in fields:
+        parts += [field, separator]
+    parts[-1] = np.full((len(fields[0]), 1), ord('\n'), dtype=np.uint8)
+    rows = np.hstack(parts)
+    return rows[rows != PAD].tobytes().replace(b'__', b' ').decode('UTF-8')
+
+
+
+def _speck_bytes(series, labels, field_buffer, field_writer):
+    # one column of a speck chunk as a PAD-padded byte matrix with a row per field, holding the
+    # text DataFrame.to_csv(float_format='%.8f', na_rep='0') would write
+    if isinstance(series.dtype, np.dtype) and series.dtype.kind in 'iu':
+        values = series.to_numpy()
+        if values.dtype.kind == 'u':
+            return _digit_bytes(values.astype(np.uint64), np.zeros(len(values), dtype=bool))
+        values = values.astype(np.int64)
+        # -(v+1)+1 avoids overflowing on the smallest int64
+        return _digit_bytes(np.where(values < 0, (-(values + 1)).astype(np.uint64) + 1, values.astype(np.uint64)), values < 0)
+    if isinstance(series.dtype, np.dtype) and series.dtype.kind == 'f':
+        return _fixed_bytes(series.to_numpy(dtype=np.float64), SPECK_DECIMALS)
+
+    values = series.to_numpy(dtype=object)
+    missing = series.isna().to_numpy()
+    if labels is not None:
+        for i in range(*labels):
+            if isinstance(values[i], str):
+                values[i] = values[i].replace(' ', '__')
+
+    fields = []
+    for value, is_missing in zip(values, missing):
+        if is_missing:
+            fields.append('0')
+        elif type(value) is str and value and not (' ' in value or '\n' in value or '\r' in value):
+            # nothing to escape
+            fields.append(value)
+        else:
+            # the same csv escaping as DataFrame.to_csv; a trailing empty field keeps the
+            # writer from quoting a lone empty string
+            field_buffer.seek(0)
+            field_buffer.truncate()
+            field_writer.writerow([value, ''])
+            fields.append(field_buffer.getvalue()[:-2])
+    return _text_bytes(fields)
+
+
+
+def _text_bytes(fields):
+    # strings as a PAD-padded byte matrix
+    encoded = [field.encode('UTF-8') for field in fields]
+    lengths = np.array([len(field) for field in encoded], dtype=np.int64)
+    width = max(int(lengths.max()) if len(lengths) else 0, 1)
+    matrix = np.array(encoded, dtype='S' + str(width)).view(np.uint8).reshape(len(encoded), width)
+    return np.where(np.arange(width) < lengths[:, None], matrix, PAD).astype(np.uint8)
+
+
+
+def _digit_bytes(magnitudes, negative):
+    # decimal digits of unsigned integers (with a '-' where negative) as a PAD-padded byte matrix
+    width = len(str(int(magnitudes.max()))) if len(magnitudes) else 1
+    digits = (magnitudes[:, None] // (np.uint64(10) ** np.arange(width - 1, -1, -1, dtype=np.uint64))) % np.uint64(10)
+    leading = np.cumsum(digits, axis=1) == 0
+    leading[:, -1] = False
+    matrix = np.where(leading, PAD, digits + ord('0')).astype(np.uint8)
+    return np.hstack([np.where(negative, ord('-'), PAD).astype(np.uint8)[:, None], matrix])
+
+
+
+def _fixed_bytes(values, decimals):
+    # '%.<decimals>f' % value for every value, vectorized: the values are scaled and rounded to integers,
+    # whose digits are then split at the decimal point. Values whose scaled fraction is too close to .5 to
+    # round reliably in floating point (or that are too large, or not finite) are formatted one by one.
+    scaled = values * 10.0**decimals
+    with np.errstate(invalid='ignore'):
+        exact = (np.abs(scaled) < 2.0**52) & (np.abs(np.abs(scaled - np.floor(scaled)) - 0.5) > 2 * np.spacing(np.abs(scaled)))
+
+    digits = np.abs(np.rint(np.where(exact, scaled, 0))).astype(np.uint64)
+    integer_part = _digit_bytes(digits // np.uint64(10**decimals), np.signbit(values))
+    fraction = (digits % np.uint64(10**decimals))[:, None] // (np.uint64(10) ** np.arange(decimals - 1, -1, -1, dtype=np.uint64)) % np.uint64(10)
+    point = np.full((len(values), 1), ord('.'), dtype=np.uint8)
+    matrix = np.hstack([integer_part, point, (fraction + ord('0')).astype(np.uint8)])
+
+    fallback = np.flatnonzero(~exact)
+    if len(fallback):
+        text = _text_bytes(['0' if np.isnan(values[i]) else '%.*f' % (decimals, values[i]) for i in fallback])
+        width = max(matrix.shape[1], text.shape[1])
+        matrix = np.hstack([matrix, np.full((len(values), width - matrix.shape[1]), PAD, dtype=np.uint8)])
+        matrix[fallback] = PAD
+        matrix[fallback, :text.shape[1]] = text
+    return matrix
 
 
 
 
 
 # -----------------------------------------------------------------------------
-def to_label(metadata, df):
+def to_label(metadata, df, compression=None):
     """
     Write to a label formatted file.
 
@@ -184,37 +527,315 @@ def to_label(metadata, df):
     :type metadata: DataFrame
     :param df: A dataframe of the main data set.
     :type df: DataFrame
+    :param compression: Optionally compress the file on the fly: 'gzip' or 'zstd' (see ``open_output``).
+    :type compression: str
     """    
+    filename = metadata['fileroot'] + '.label'
+    with open_output(filename, compression) as out:
+        # Print the metadata defined in the main function
+        write_header(metadata, out)
+        write_label_rows(df, out)
+        # Trailing newline, as print() of the data block would add
+        out.write('\n')
+
+
+
+
+
+# -----------------------------------------------------------------------------
+def write_label_rows(df, out):
+    """
+    Write the label rows of ``df`` to an open label file.
+
+    Can be called repeatedly on consecutive chunks of a data set to append to the same file.
+
+    :param df: A dataframe of (a chunk of) the main data set. Must have a column called 'label'.
+    :type df: DataFrame
+    :param out: A file to print out to (needs to be opened before function call)
+    :type out: file
+    :raises Exception: Raised if ``df`` has no 'label' column.
+    """
     # df must have a column called 'label' containing the primary label
-    # should probably test for the existence of a label column and throw exception if doesn't exist.
-    
     if('label' not in df.columns):
         raise Exception('DataFrame must have a label column called \'label\'')
 
     df['text'] = ['text']*len(df)
 
     df_label = df.loc[[i for i in range(len(df)) if len(df['label'][i])>0], ['x', 'y', 'z', 'text', 'label']]
-    
-    # #replace any spaces in label column with double underscores for label file formatting
-    # df_label.loc[0:len(df_label), 'label'].replace(' ', '__', regex=True, inplace=True)
 
     df_label['label'] = ['__'.join(i.split()) for i in df_label['label']]
-    # df_label.loc[0:len(df_label), 'label'] = ['__'.join(i.split()) for i in df_label['label']]
 
-    filename = metadata['fileroot'] + '.label'
-    out = open(filename, 'w', encoding='UTF-8')
+    # Print the data
+    out.write(df_label.to_csv(path_or_buf=None, sep=' ', na_rep='0', header=False, index=False, quoting=csv.QUOTE_NONE, quotechar="",  escapechar=" ", lineterminator='\n', float_format='%.8f').replace('__', ' '))
 
-    # Print the metadata defined in the main function
-    write_header(metadata, out)
-#     print('# ' + metadata['project'] + ': ' + metadata['sub_project'], file=out)
-#     print('# ' + metadata['catalog'] + ', ' + metadata['catalog_author'] + ', ' + metadata['catalog_year'], file=out)
-#     print('# Prepared by: ' + metadata['prepared_by'], file=out)
-#     print('# Version ' + metadata['version'], file=out)
-#     print('# ' + metadata['data_group_desc'], file=out)
-#     print(file=out)
 
-    # Print the data
-    print(df_label.to_csv(path_or_buf=None, sep=' ', na_rep='0', header=False, index=False, quoting=csv.QUOTE_NONE, quotechar="",  escapechar=" ", lineterminator='\n', float_format='%.8f').replace('__', ' '), file=out)
+
+
+
+# -----------------------------------------------------------------------------
+def export(metadata, data, columns, formats=('csv', 'speck', 'label'), asset=True, license=True, RenderableType='RenderableStars', path='/Milky Way/Stars', n_workers=None, chunk_rows=SPECK_CHUNK_ROWS, compression=None):
+    """
+    Write the csv, speck and label files (and the asset and license files) of a data set in one pass.
+
+    Produces the same files as calling ``to_csv``, ``to_speck``, ``to_label``, ``generate_asset_file`` and
+    ``generate_license_file``, but converts ``data`` to pandas once and goes through the rows once, a chunk
+    at a time: each chunk's x, y, z text is formatted once and shared by the speck and label files. For example::
+
+        file_functions.export(metadata, data, columns)
+
+    With ``n_workers`` set, the chunks are formatted in that many worker processes (each gets a copy of the
+    data) and written in order by the main process.
+
+    :param metadata: A dataframe with metadata about the data set.
+    :type metadata: DataFrame
+    :param data: The main data set. Must have a 'label' column if a label file is written.
+    :type data: Table or DataFrame
+    :param columns: A dataframe which contains the columns to be included in the necessary order and their 'description' (from ``get_metadata``).
+    :type columns: DataFrame
+    :param formats: Which of 'csv', 'speck' and 'label' to write.
+    :type formats: tuple of str
+    :param asset: Write the .asset file.
+    :type asset: bool
+    :param license: Write the license file.
+    :type license: bool
+    :param RenderableType: Renderable of the asset file, as for ``generate_asset_file``.
+    :type RenderableType: str
+    :param path: GUI path of the asset, as for ``generate_asset_file``.
+    :type path: str
+    :param n_workers: Number of worker processes formatting chunks. Formats in this process if not given.
+    :type n_workers: int
+    :param chunk_rows: Number of rows formatted at a time.
+    :type chunk_rows: int
+    :param compression: Optionally compress the csv, speck and label files on the fly: 'gzip' or 'zstd' (see ``open_output``).
+    :type compression: str
+    :raises Exception: Raised if a format is not csv, speck or label, or a label file is asked for without a 'label' column.
+    """
+    for fmt in formats:
+        if(fmt not in ('csv', 'speck', 'label')):
+            raise Exception('file_functions.export: format must be csv, speck or label, not \'' + fmt + '\'')
+
+    df = Table.to_pandas(data) if isinstance(data, Table) else data
+    if(('label' in formats) and ('label' not in df.columns)):
+        raise Exception('DataFrame must have a label column called \'label\'')
+
+    outs = {}
+    try:
+        for fmt in formats:
+            outs[fmt] = open_output(metadata['fileroot'] + '.' + fmt, compression)
+        if('csv' in outs):
+            write_csv_header(metadata, columns, outs['csv'])
+        if('speck' in outs):
+            write_speck_header(metadata, columns, outs['speck'])
+        if('label' in outs):
+            write_header(metadata, outs['label'])
+
+        bounds = [(start, min(start + chunk_rows, len(df))) for start in range(0, len(df), chunk_rows)]
+        state = (df, list(columns['name']), tuple(formats))
+        if(n_workers is None):
+            _set_export_state(*state)
+            for start, stop in bounds:
+                for fmt, text in _export_chunk(start, stop).items():
+                    outs[fmt].write(text)
+        else:
+            with multiprocessing.Pool(n_workers, initializer=_set_export_state, initargs=state) as pool:
+                for texts in pool.imap(_export_chunk_bounds, bounds):
+                    for fmt, text in texts.items():
+                        outs[fmt].write(text)
+
+        # Trailing newline, as in the single-format writers
+        for out in outs.values():
+            out.write('\n')
+    finally:
+        _export_state.clear()
+        for out in outs.values():
+            out.close()
+
+    if(asset):
+        generate_asset_file(metadata, RenderableType=RenderableType, path=path)
+    if(license):
+        generate_license_file(metadata)
+
+
+
+# data frame, column names and formats of the export being written, set in each worker by _set_export_state
+_export_state = {}
+
+
+
+def _set_export_state(df, names, formats):
+    _export_state['df'] = df
+    _export_state['names'] = names
+    _export_state['formats'] = formats
+    _export_state['label_rows'] = _speck_label_rows(df)
+
+
+
+def _export_chunk_bounds(bounds):
+    return _export_chunk(*bounds)
+
+
+
+def _export_chunk(start, stop):
+    # text of rows [start, stop) for each format
+    df = _export_state['df']
+    names = _export_state['names']
+    formats = _export_state['formats']
+    texts = {}
+
+    if('csv' in formats):
+        df_csv = df[names].iloc[start:stop].rename(columns={'speck_label':'identifiers'}, inplace=False)
+        texts['csv'] = df_csv.to_csv(path_or_buf=None, header=False, lineterminator='\n', index=False)
+
+    speck_names = names if 'speck' in formats else []
+    label_names = ['x', 'y', 'z'] if 'label' in formats else []
+    fields = _speck_fields(df, list(dict.fromkeys(speck_names + label_names)), start, stop, _export_state['label_rows'])
+    if('speck' in formats):
+        texts['speck'] = _speck_lines([fields[name] for name in names])
+    if('label' in formats):
+        texts['label'] = _label_lines(df['label'].iloc[start:stop], [fields[name] for name in label_names])
+    return texts
+
+
+
+def _label_lines(labels, xyz):
+    # label file lines from the x, y, z byte matrices, as write_label_rows writes them:
+    # rows with an empty label are skipped, and whitespace in labels becomes single spaces
+    keep = np.array([len(label) > 0 for label in labels], dtype=bool)
+    if not np.any(keep):
+        return ''
+    text = np.full((int(np.sum(keep)), 4), PAD, dtype=np.uint8)
+    text[:] = np.frombuffer(b'text', dtype=np.uint8)
+    label = _text_bytes(['__'.join(label.split()) for label in labels[keep]])
+    return _speck_lines([field[keep] for field in xyz] + [text, label])
+
+
+
+
+
+# -----------------------------------------------------------------------------
+def to_binary(metadata, data, columns, float_type='float32', filename=None):
+    """
+    Write columns to a little-endian binary column file.
+
+    A compact companion to the csv and speck files: each column is stored as one contiguous block
+    (floats as float32 or float64, integers as int64, strings as fixed-width UTF-8), preceded by a JSON
+    header with the data set metadata and each column's name, unit, UCD and description (from
+    ``get_metadata``). Columns that already have the stored type are written straight from their NumPy
+    buffers without a copy. Missing values are stored as NaN in float columns and 0 in the others.
+    Read the file back with :func:`read_binary`.
+
+    File layout: 8 magic bytes ``DUCOLBIN``, uint32 version, uint32 header length, the UTF-8 JSON header,
+    then the column blocks, each starting at the byte offset given in the header (64-byte aligned).
+
+    :param metadata: A dataframe with metadata about the data set.
+    :type metadata: DataFrame
+    :param data: The main data set.
+    :type data: Table or DataFrame
+    :param columns: A dataframe which contains the columns to be included in the necessary order with their 'unit', 'ucd' and 'description' (from ``get_metadata``).
+    :type columns: DataFrame
+    :param float_type: Type of the stored float columns, 'float32' or 'float64'.
+    :type float_type: str
+    :param filename: The output file. Defaults to fileroot_columns.bin.
+    :type filename: str
+    :raises Exception: Raised if ``float_type`` is not float32 or float64.
+    """
+    if(float_type not in ('float32', 'float64')):
+        raise Exception('file_functions.to_binary: float_type must be float32 or float64')
+    if(filename is None):
+        filename = metadata['fileroot'] + '_columns.bin'
+
+    arrays = [_binary_array(data, name, np.dtype(float_type).newbyteorder('<')) for name in columns['name']]
+
+    # the header, with the offset of every column block
+    header = {'metadata': {key: value for key, value in dict(metadata).items() if isinstance(value, str)},
+              'length': len(data), 'columns': []}
+    offset = 0
+    for i, array in enumerate(arrays):
+        header['columns'].append({'name': columns['name'][i], 'dtype': array.dtype.str, 'offset': offset,
+                                  'unit': str(columns['unit'][i]), 'ucd': str(columns['ucd'][i]), 'description': str(columns['description'][i])})
+        offset += -(-array.nbytes // BINARY_ALIGN) * BINARY_ALIGN
+
+    # column offsets are relative to the end of the header, so fix them up once the header size is known
+    start = _binary_header_size(header)
+    for column in header['columns']:
+        column['offset'] += start
+    header_bytes = json.dumps(header).encode('UTF-8')
+    header_bytes += b' ' * (start - 16 - len(header_bytes))
+
+    with open(filename, 'wb') as out:
+        out.write(BINARY_MAGIC)
+        out.write(np.array([BINARY_VERSION, len(header_bytes)], dtype='<u4').tobytes())
+        out.write(header_bytes)
+        for array, column in zip(arrays, header['columns']):
+            out.write(b'\0' * (column['offset'] - out.tell()))
+            out.write(memoryview(array).cast('B'))
+
+
+
+def _binary_header_size(header):
+    # bytes before the first column: magic, version, length and the JSON header, padded to BINARY_ALIGN.
+    # The offsets in the header grow when the start is added, so pad generously for their extra digits.
+    text_bytes = len(json.dumps(header).encode('UTF-8')) + 20 * (len(header['columns']) + 1)
+    return -(-(16 + text_bytes) // BINARY_ALIGN) * BINARY_ALIGN
+
+
+
+def _binary_array(data, name, float_type):
+    # a contiguous little-endian array of one column, copied only if its type or missing values need it
+    if isinstance(data, Table):
+        column = data[name]
+        values = np.ma.getdata(column)
+        mask = np.ma.getmaskarray(column) if hasattr(column, 'mask') else None
+    else:
+        values = data[name].to_numpy()
+        mask = data[name].isna().to_numpy() if values.dtype.kind == 'O' else None
+
+    if values.dtype.kind == 'f':
+        values = values.astype(float_type, copy=False)
+        fill = np.nan
+    elif values.dtype.kind in 'iub':
+        values = values.astype('<i8' if values.dtype.kind != 'b' else '|u1', copy=False)
+        fill = 0
+    else:
+        # strings (or objects) as fixed-width UTF-8
+        values = np.char.encode(np.asarray(values, dtype=str), 'UTF-8')
+        fill = b''
+
+    if mask is not None and np.any(mask):
+        values = values.copy()
+        values[mask] = fill
+    return np.ascontiguousarray(values)
+
+
+
+# -----------------------------------------------------------------------------
+def read_binary(filename, columns=None):
+    """
+    Read a binary column file written by :func:`to_binary`.
+
+    The columns are memory-mapped, so only the parts of the file that are used are read.
+
+    :param filename: The binary column file.
+    :type filename: str
+    :param columns: Names of the columns to read. Defaults to all of them.
+    :type columns: list of str
+    :raises Exception: Raised if the file is not a binary column file.
+    :return: A table with the columns (with their unit, description and UCD in meta) and the data set metadata in its meta.
+    :rtype: Table
+    """
+    with open(filename, 'rb') as f:
+        if(f.read(len(BINARY_MAGIC)) != BINARY_MAGIC):
+            raise Exception('file_functions.read_binary: ' + str(filename) + ' is not a binary column file')
+        version, header_length = np.frombuffer(f.read(8), dtype='<u4')
+        header = json.loads(f.read(int(header_length)).decode('UTF-8'))
+
+    table = Table(meta=header['metadata'])
+    for column in header['columns']:
+        if(columns is not None and column['name'] not in columns):
+            continue
+        values = np.memmap(filename, dtype=column['dtype'], mode='r', offset=column['offset'], shape=(header['length'],)) if header['length'] else np.zeros(0, dtype=column['dtype'])
+        table.add_column(Column(values, name=column['name'], unit=column['unit'] or None, description=column['description'], meta={'ucd': column['ucd']}, copy=False), copy=False)
+    return table
 
 
 
@@ -263,7 +884,6 @@ def generate_license_file(metadata):
     """    
 
     filename = 'license_' + metadata['fileroot'] + '.lua'
-    out = open(filename, 'w')
 
 
     DU_license = r"""Copyright © American Museum of Natural History. All rights reserved. 
@@ -283,20 +903,21 @@ The Atlas is free but is offered WITHOUT ANY WARRANTY of any kind. We provide th
 
 For more information, please visit https://www.amnh.org/research/hayden-planetarium/digital-universe."""
 
-    # Print the metadata in the license formatted strings
-    print('return {', file=out)
-    print('    Name = "' + metadata['data_group_title'] + '",', file=out)
-    print('    Version = "' + metadata['version'] + '",', file=out)
-    print('    Description = "' + metadata['data_group_desc'] + '",', file=out)
-    print('    Reference = "' + metadata['catalog'] + ', ' + metadata['catalog_author'] + ', ' + metadata['catalog_year'] + '",', file=out)
-    print('    PreparedBy = "' + metadata['prepared_by'] + '",', file=out)
-    print('    License = [[' + DU_license + ']]', file=out)
-    print('}', file=out)
+    with open(filename, 'w') as out:
+        # Print the metadata in the license formatted strings
+        print('return {', file=out)
+        print('    Name = "' + metadata['data_group_title'] + '",', file=out)
+        print('    Version = "' + metadata['version'] + '",', file=out)
+        print('    Description = "' + metadata['data_group_desc'] + '",', file=out)
+        print('    Reference = "' + metadata['catalog'] + ', ' + metadata['catalog_author'] + ', ' + metadata['catalog_year'] + '",', file=out)
+        print('    PreparedBy = "' + metadata['prepared_by'] + '",', file=out)
+        print('    License = [[' + DU_license + ']]', file=out)
+        print('}', file=out)
 
 
 
 # -----------------------------------------------------------------------------
-def generate_asset_file(metadata, RenderableType="RenderableStars", path = "/Milky Way/Stars"):
+def generate_asset_file(metadata, RenderableType="RenderableStars", path = "/Milky Way/Stars", FileReaderOption="Speck", data_file=None):
     """
     This function creates a new file called fileroot.asset and 
     creates the OpenSpace asset file for a particular dataset.
@@ -305,6 +926,10 @@ def generate_asset_file(metadata, RenderableType="RenderableStars", path = "/Mil
     :type metadata: DataFrame
     :param data_display_type: Indicates the renderable to use to display the data. Can be "RenderableStars" or "RenderableGaiaStars"; may eventually support point cloud as well
     :type data_display_type: str
+    :param FileReaderOption: How RenderableGaiaStars reads ``data_file``: "Speck", or "BinaryOctree" for a file from ``octree.write_octree``
+    :type FileReaderOption: str
+    :param data_file: The data file of the asset. Defaults to the csv file, fileroot.csv
+    :type data_file: str
     """  
 
     #set fileroot and object_name variables
@@ -318,138 +943,140 @@ def generate_asset_file(metadata, RenderableType="RenderableStars", path = "/Mil
     else:
         raise Exception('RenderableType must be RenderableStars or RenderableGaiaStars')
     
-    out = open(asset_fileroot+'.asset', 'w')
-
-    #print colormap block
-    print('local colormaps = asset.resource({', file=out)
-    print('  Name = "Stars Color Table",', file=out)
-    print('  Type = "HttpSynchronization",', file=out)
-    print('  Identifier = "stars_colormap",', file=out)
-    print('  Version = 3', file=out)
-    print('})\n', file=out)
-
-    #print textures block
-    print('local textures = asset.resource({', file=out)
-    print('  Name = "Stars Textures",', file=out)
-    print('  Type = "HttpSynchronization",', file=out)
-    print('  Identifier = "stars_textures",', file=out)
-    print('  Version = 1', file=out)
-    print('})\n', file=out)
-
-    #print data file arguments
-    print('local data_file = asset.resource(\"'+fileroot+'.csv\")', file=out)
-#     print('local speck_file = asset.resource(\"'+fileroot+'.speck\")', file=out)
-#     print('local label_file = asset.resource(\"'+fileroot+'.label\")', file=out)
-
-    #print object block
-    #may want to modify to allow changes to datamapping
+    with open(asset_fileroot+'.asset', 'w') as out:
+
+        #print colormap block
+        print('local colormaps = asset.resource({', file=out)
+        print('  Name = "Stars Color Table",', file=out)
+        print('  Type = "HttpSynchronization",', file=out)
+        print('  Identifier = "stars_colormap",', file=out)
+        print('  Version = 3', file=out)
+        print('})\n', file=out)
+
+        #print textures block
+        print('local textures = asset.resource({', file=out)
+        print('  Name = "Stars Textures",', file=out)
+        print('  Type = "HttpSynchronization",', file=out)
+        print('  Identifier = "stars_textures",', file=out)
+        print('  Version = 1', file=out)
+        print('})\n', file=out)
+
+        #print data file arguments
+        if (data_file is None):
+            data_file = fileroot+'.csv'
+        print('local data_file = asset.resource(\"'+data_file+'\")', file=out)
+    #     print('local speck_file = asset.resource(\"'+fileroot+'.speck\")', file=out)
+    #     print('local label_file = asset.resource(\"'+fileroot+'.label\")', file=out)
+
+        #print object block
+        #may want to modify to allow changes to datamapping
     
-    if (RenderableType == 'RenderableStars'):
-        #start of Star Renderable block
-        print('local '+object_name+' = {', file=out)
-        print('  Identifier = \"'+object_name+'\",', file=out)
-        #Renderable
-        print('  Renderable = {', file=out)
-        print('    Type = \"RenderableStars\",', file=out) #this is where we can check for the Gaia Renderable when we get it from Jackie
-        print('    File = data_file,', file=out)
-        #Halo
-        print('    Halo = {', file=out)
-        print('      Texture = textures .. \"halo.png\",', file=out)
-        print('      Multiplier = 0.65', file=out)
-        print('    },', file=out) #end of Halo
-        #Glare
-        print('    Glare = {', file=out)
-        print('      Texture = textures .. \"glare.png\",', file=out)
-        print('      Multiplier = 15.0,', file=out)
-        print('        Gamma = 1.66,', file=out)
-        print('        Scale = 0.18', file=out)
-        print('    },', file=out) #end of Glare
-        print('    MagnitudeExponent = 6.325,', file=out)
-        print('    ColorMap = colormaps .. \"colorbv.cmap\",', file=out)
-        print('    OtherDataColorMap = colormaps .. \"viridis.cmap\",', file=out)
-        print('    SizeComposition = \"Distance Modulus\",', file=out)
-        #Data Mapping
-        print('    DataMapping = {', file=out)  #This block is where we can add a potential for modification to the data mapping
-        print('      Bv = \"color\",', file=out)
-        print('      Luminance = \"lum\",', file=out)
-        print('      AbsoluteMagnitude = \"absmag\",', file=out)
-        print('      ApparentMagnitude = \"appmag\",', file=out)
-        print('      Vx = \"u\",', file=out)
-        print('      Vy = \"v\",', file=out)
-        print('      Vz = \"w\",', file=out)
-        print('      Speed = \"speed\"', file=out)
-        print('    },', file=out) #end of Data Mapping
-        print('    DimInAtmosphere = true', file=out)
-        print('  },', file=out) #end of Renderable
-        print('  Tag = { \"daytime_hidden\" },', file=out)
-        #GUI
-        print('  GUI = {', file=out)
-        print('    Name = \"'+object_name+'\",', file=out)
-        print('    Path = \"/Milky Way/Stars/'+object_name+'\",', file=out)
-        print('    Description = [['+metadata['data_group_desc_long']+']]', file=out) #include catalog title/authors/bibcode?
-        print('  }', file=out) #end of GUI
-        print('}', file=out) #end of object block
+        if (RenderableType == 'RenderableStars'):
+            #start of Star Renderable block
+            print('local '+object_name+' = {', file=out)
+            print('  Identifier = \"'+object_name+'\",', file=out)
+            #Renderable
+            print('  Renderable = {', file=out)
+            print('    Type = \"RenderableStars\",', file=out) #this is where we can check for the Gaia Renderable when we get it from Jackie
+            print('    File = data_file,', file=out)
+            #Halo
+            print('    Halo = {', file=out)
+            print('      Texture = textures .. \"halo.png\",', file=out)
+            print('      Multiplier = 0.65', file=out)
+            print('    },', file=out) #end of Halo
+            #Glare
+            print('    Glare = {', file=out)
+            print('      Texture = textures .. \"glare.png\",', file=out)
+            print('      Multiplier = 15.0,', file=out)
+            print('        Gamma = 1.66,', file=out)
+            print('        Scale = 0.18', file=out)
+            print('    },', file=out) #end of Glare
+            print('    MagnitudeExponent = 6.325,', file=out)
+            print('    ColorMap = colormaps .. \"colorbv.cmap\",', file=out)
+            print('    OtherDataColorMap = colormaps .. \"viridis.cmap\",', file=out)
+            print('    SizeComposition = \"Distance Modulus\",', file=out)
+            #Data Mapping
+            print('    DataMapping = {', file=out)  #This block is where we can add a potential for modification to the data mapping
+            print('      Bv = \"color\",', file=out)
+            print('      Luminance = \"lum\",', file=out)
+            print('      AbsoluteMagnitude = \"absmag\",', file=out)
+            print('      ApparentMagnitude = \"appmag\",', file=out)
+            print('      Vx = \"u\",', file=out)
+            print('      Vy = \"v\",', file=out)
+            print('      Vz = \"w\",', file=out)
+            print('      Speed = \"speed\"', file=out)
+            print('    },', file=out) #end of Data Mapping
+            print('    DimInAtmosphere = true', file=out)
+            print('  },', file=out) #end of Renderable
+            print('  Tag = { \"daytime_hidden\" },', file=out)
+            #GUI
+            print('  GUI = {', file=out)
+            print('    Name = \"'+object_name+'\",', file=out)
+            print('    Path = \"/Milky Way/Stars/'+object_name+'\",', file=out)
+            print('    Description = [['+metadata['data_group_desc_long']+']]', file=out) #include catalog title/authors/bibcode?
+            print('  }', file=out) #end of GUI
+            print('}', file=out) #end of object block
     
-    elif (RenderableType == 'RenderableGaiaStars'):
+        elif (RenderableType == 'RenderableGaiaStars'):
         
-        print('local '+object_name+' = {', file=out)
-        print('  Identifier = \"'+object_name+'\",', file=out)
-        print('  Renderable = {', file=out)
-        print('    Type = \"RenderableGaiaStars\",', file=out)
-        print('    File = data_file,', file=out)
-        print('    FileReaderOption = \"Speck\",', file=out)
-        print('    RenderMode = \"Motion\",', file=out)
-        print('    ShaderOption = \"Point_SSBO\",', file=out)
-        print('    Texture = textures .. \"halo.png\",', file=out)
-        print('    ColorMap = colormaps .. \"colorbv.cmap\",', file=out)
-        print('    LuminosityMultiplier = 35,', file=out)
-        print('    MagnitudeBoost = 25,', file=out)
-        print('    CutOffThreshold = 38,', file=out)
-        print('    BillboardSize = 1,', file=out)
-        print('    CloseUpBoostDist = 250,', file=out)
-        print('    Sharpness = 1.45,', file=out)
-        print('    LodPixelThreshold = 0,', file=out)
-        print('    MaxGpuMemoryPercent = 0.24,', file=out)
-        print('    MaxCpuMemoryPercent = 0.4,', file=out)
-        print('    FilterSize = 5,', file=out)
-        print('    Sigma = 0.5,', file=out)
-        print('    AdditionalNodes = { 3.0, 2.0 },', file=out)
-        print('    FilterPosX = { 0.0, 0.0 },', file=out)
-        print('    FilterPosY = { 0.0, 0.0 },', file=out)
-        print('    FilterPosZ = { 0.0, 0.0 },', file=out)
-        print('    FilterGMag = { 20.0, 20.0 },', file=out)
-        print('    FilterBpRp = { 0.0, 0.0 },', file=out)
-        print('    FilterDist = { 9.0, 9.0 }', file=out)
-        print('  },', file=out)
-        print('  GUI = {', file=out)
-        print('    Name = \"'+metadata['data_group_title']+'\",', file=out)
-        print('    Path = \"'+path+'\",', file=out)
-        print('    Description = \"'+metadata['data_group_desc_long']+'\"', file=out)
-        print('  }', file=out)
-        print('}', file=out)
+            print('local '+object_name+' = {', file=out)
+            print('  Identifier = \"'+object_name+'\",', file=out)
+            print('  Renderable = {', file=out)
+            print('    Type = \"RenderableGaiaStars\",', file=out)
+            print('    File = data_file,', file=out)
+            print('    FileReaderOption = \"'+FileReaderOption+'\",', file=out)
+            print('    RenderMode = \"Motion\",', file=out)
+            print('    ShaderOption = \"Point_SSBO\",', file=out)
+            print('    Texture = textures .. \"halo.png\",', file=out)
+            print('    ColorMap = colormaps .. \"colorbv.cmap\",', file=out)
+            print('    LuminosityMultiplier = 35,', file=out)
+            print('    MagnitudeBoost = 25,', file=out)
+            print('    CutOffThreshold = 38,', file=out)
+            print('    BillboardSize = 1,', file=out)
+            print('    CloseUpBoostDist = 250,', file=out)
+            print('    Sharpness = 1.45,', file=out)
+            print('    LodPixelThreshold = 0,', file=out)
+            print('    MaxGpuMemoryPercent = 0.24,', file=out)
+            print('    MaxCpuMemoryPercent = 0.4,', file=out)
+            print('    FilterSize = 5,', file=out)
+            print('    Sigma = 0.5,', file=out)
+            print('    AdditionalNodes = { 3.0, 2.0 },', file=out)
+            print('    FilterPosX = { 0.0, 0.0 },', file=out)
+            print('    FilterPosY = { 0.0, 0.0 },', file=out)
+            print('    FilterPosZ = { 0.0, 0.0 },', file=out)
+            print('    FilterGMag = { 20.0, 20.0 },', file=out)
+            print('    FilterBpRp = { 0.0, 0.0 },', file=out)
+            print('    FilterDist = { 9.0, 9.0 }', file=out)
+            print('  },', file=out)
+            print('  GUI = {', file=out)
+            print('    Name = \"'+metadata['data_group_title']+'\",', file=out)
+            print('    Path = \"'+path+'\",', file=out)
+            print('    Description = \"'+metadata['data_group_desc_long']+'\"', file=out)
+            print('  }', file=out)
+            print('}', file=out)
     
     
 
-    #print initialization and deinitialization blocks
-    print('asset.onInitialize(function()', file=out)
-    print('  openspace.addSceneGraphNode('+object_name+')', file=out)
-    print('end)\n', file=out)
+        #print initialization and deinitialization blocks
+        print('asset.onInitialize(function()', file=out)
+        print('  openspace.addSceneGraphNode('+object_name+')', file=out)
+        print('end)\n', file=out)
 
-    print('asset.onDeinitialize(function()', file=out)
-    print('  openspace.removeSceneGraphNode('+object_name+')', file=out)
-    print('end)\n', file=out)
+        print('asset.onDeinitialize(function()', file=out)
+        print('  openspace.removeSceneGraphNode('+object_name+')', file=out)
+        print('end)\n', file=out)
 
-    print('asset.export('+object_name+')', file=out)
+        print('asset.export('+object_name+')', file=out)
 
-    print('\n', file=out)
+        print('\n', file=out)
 
-    #print meta block
-    print('asset.meta = {', file=out)
-    print('  Name = \"'+object_name+'\",', file=out)
-    print('  Version = \"1.0\",', file=out)
-    print('  Description = \"'+metadata['data_group_desc']+'\",', file=out)
-    print('  Author = \"Brian Abbott (AMNH), Zack Reeves\",', file=out)
-    print('  URL = \"https://www.amnh.org/research/hayden-planetarium/digital-universe\",', file=out)
-    print('  License = \"AMNH Digital Universe\"', file=out)
-    print('}', file=out)
+        #print meta block
+        print('asset.meta = {', file=out)
+        print('  Name = \"'+object_name+'\",', file=out)
+        print('  Version = \"1.0\",', file=out)
+        print('  Description = \"'+metadata['data_group_desc']+'\",', file=out)
+        print('  Author = \"Brian Abbott (AMNH), Zack Reeves\",', file=out)
+        print('  URL = \"https://www.amnh.org/research/hayden-planetarium/digital-universe\",', file=out)
+        print('  License = \"AMNH Digital Universe\"', file=out)
+        print('}', file=out)
     
\ No newline at end of file
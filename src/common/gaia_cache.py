@@ -0,0 +1,265 @@
+# PY SCRIPT FOR A LOCAL CACHE OF GAIA ARCHIVE LOOKUPS
+#
+# Keeps the columns fetched from the ESA archive (Bailer-Jones distances,
+# gaia_source astrometry, ...) on disk, keyed by source_id and data release,
+# so a notebook that is rerun only has to ask the archive for stars it has not
+# fetched before.
+#
+# Each data release has its own directory in the cache holding one .npy file
+# per column (plus a null mask and a "fetched" flag per column), all in the
+# order of a sorted source_id index.  Lookups memory-map the index and find
+# every requested ID with one searchsorted call.  The cache is bounded in size:
+# the least recently used rows are evicted once it grows past max_bytes.
+#
+# VERSIONS:
+#  1.0  CACHE OF GAIA LOOKUPS
+
+
+import json
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+from astropy.table import Table, MaskedColumn, hstack, vstack
+
+
+
+CACHE_DIRECTORY = '../common/gaia_cache'
+
+# default size bound for one data release
+MAX_BYTES = 2 * 2**30
+
+INDEX_FILE = 'source_id.npy'
+LAST_USED_FILE = 'last_used.npy'
+COLUMNS_FILE = 'columns.json'
+
+
+
+# -----------------------------------------------------------------------------
+def lookup(ids, columns, release='DR3', cache_dir=CACHE_DIRECTORY):
+    """
+    Look up cached archive columns for a set of source IDs.
+
+    A star is a hit only if every requested column has been fetched for it before (a null value that
+    was fetched counts as a hit).
+
+    :param ids: Gaia source IDs to look up.
+    :type ids: array of int
+    :param columns: Names of the archive columns wanted.
+    :type columns: list of str
+    :param release: Data release the IDs and columns belong to (DR2, EDR3, DR3, ...).
+    :type release: str
+    :param cache_dir: Directory holding the cache.
+    :type cache_dir: str or pathlib.Path
+    :return: A Table of the hits (``source_id`` plus ``columns``) and a boolean array marking which ``ids`` were hits.
+    :rtype: (Table, numpy.ndarray)
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    directory = _release_dir(cache_dir, release)
+    hit = np.zeros(len(ids), dtype=bool)
+
+    if not (directory / INDEX_FILE).is_file():
+        return Table({'source_id': ids[hit]}), hit
+
+    column_info = _read_columns(directory)
+    if any(name not in column_info for name in columns):
+        return Table({'source_id': ids[hit]}), hit
+
+    # one vectorized search of the sorted index
+    index = np.load(directory / INDEX_FILE, mmap_mode='r')
+    position = np.minimum(np.searchsorted(index, ids), max(len(index) - 1, 0))
+    hit = (len(index) > 0) & (index[position] == ids)
+    for name in columns:
+        have = np.load(directory / (name + '.have.npy'), mmap_mode='r')
+        hit[hit] &= have[position[hit]]
+
+    rows = position[hit]
+    hits = Table({'source_id': ids[hit]})
+    for name in columns:
+        values = np.load(directory / (name + '.npy'), mmap_mode='r')[rows]
+        mask = np.load(directory / (name + '.mask.npy'), mmap_mode='r')[rows]
+        hits[name] = MaskedColumn(data=values, mask=mask, unit=column_info[name]['unit'], description=column_info[name]['description'])
+
+    # mark the rows as recently used for eviction
+    if len(rows):
+        last_used = np.load(directory / LAST_USED_FILE, mmap_mode='r+')
+        last_used[rows] = time.time_ns()
+        last_used.flush()
+        del last_used
+
+    return hits, hit
+
+
+
+# -----------------------------------------------------------------------------
+def store(table:Table, release='DR3', source_id='source_id', cache_dir=CACHE_DIRECTORY, max_bytes=MAX_BYTES):
+    """
+    Add fetched archive rows to the cache.
+
+    Rows for IDs already in the cache are replaced column by column. Once the release's cache is larger
+    than ``max_bytes``, the least recently used rows are evicted. The files are rewritten in a new
+    directory which then replaces the old one, so an interrupted store never leaves a broken cache.
+
+    :param table: Archive results with a source ID column and the fetched columns.
+    :type table: Table
+    :param release: Data release of the rows.
+    :type release: str
+    :param source_id: Name of the source ID column in ``table``.
+    :type source_id: str
+    :param cache_dir: Directory holding the cache.
+    :type cache_dir: str or pathlib.Path
+    :param max_bytes: Size bound for the release's cache in bytes.
+    :type max_bytes: int
+    """
+    directory = _release_dir(cache_dir, release)
+    new_ids = np.asarray(table[source_id], dtype=np.int64)
+    names = [name for name in table.colnames if name != source_id and table[name].dtype.kind in 'biuf']
+
+    # start from what is already cached
+    if (directory / INDEX_FILE).is_file():
+        column_info = _read_columns(directory)
+        ids = np.load(directory / INDEX_FILE)
+        last_used = np.load(directory / LAST_USED_FILE)
+        arrays = {name: [np.load(directory / (name + suffix)) for suffix in ('.npy', '.mask.npy', '.have.npy')] for name in column_info}
+    else:
+        column_info = {}
+        ids = np.zeros(0, dtype=np.int64)
+        last_used = np.zeros(0, dtype=np.int64)
+        arrays = {}
+
+    # one row per ID in the union of old and new IDs, in sorted order
+    all_ids = np.union1d(ids, new_ids)
+    old_rows = np.searchsorted(all_ids, ids)
+    new_rows = np.searchsorted(all_ids, new_ids)
+
+    merged_last_used = np.zeros(len(all_ids), dtype=np.int64)
+    merged_last_used[old_rows] = last_used
+    merged_last_used[new_rows] = time.time_ns()
+
+    merged = {}
+    for name in set(column_info) | set(names):
+        if name in table.colnames and name in names:
+            dtype = np.result_type(table[name].dtype, arrays[name][0].dtype) if name in arrays else table[name].dtype
+        else:
+            dtype = arrays[name][0].dtype
+        values = np.zeros(len(all_ids), dtype=dtype)
+        mask = np.zeros(len(all_ids), dtype=bool)
+        have = np.zeros(len(all_ids), dtype=bool)
+        if name in arrays:
+            values[old_rows], mask[old_rows], have[old_rows] = arrays[name]
+        if name in names:
+            values[new_rows] = np.ma.getdata(table[name])
+            mask[new_rows] = np.ma.getmaskarray(table[name])
+            have[new_rows] = True
+            column_info[name] = {'unit': None if table[name].unit is None else str(table[name].unit),
+                                 'description': table[name].description}
+        merged[name] = (values, mask, have)
+
+    # evict the least recently used rows if the cache is too big
+    row_bytes = 16 + sum(values.itemsize + 2 for values, mask, have in merged.values())
+    if len(all_ids) * row_bytes > max_bytes:
+        keep = np.sort(np.argsort(merged_last_used, kind='stable')[len(all_ids) - max_bytes // row_bytes:])
+        all_ids = all_ids[keep]
+        merged_last_used = merged_last_used[keep]
+        merged = {name: tuple(array[keep] for array in arrays_) for name, arrays_ in merged.items()}
+
+    # write everything to a new directory, then swap it in
+    new_directory = directory.with_name(directory.name + '.tmp-' + uuid.uuid4().hex[:8])
+    new_directory.mkdir(parents=True)
+    np.save(new_directory / INDEX_FILE, all_ids)
+    np.save(new_directory / LAST_USED_FILE, merged_last_used)
+    for name, (values, mask, have) in merged.items():
+        np.save(new_directory / (name + '.npy'), values)
+        np.save(new_directory / (name + '.mask.npy'), mask)
+        np.save(new_directory / (name + '.have.npy'), have)
+    with open(new_directory / COLUMNS_FILE, 'w') as out:
+        json.dump({'release': release, 'columns': column_info}, out, indent=1)
+
+    old_directory = directory.with_name(directory.name + '.old-' + uuid.uuid4().hex[:8])
+    if directory.exists():
+        os.replace(directory, old_directory)
+    os.replace(new_directory, directory)
+    shutil.rmtree(old_directory, ignore_errors=True)
+
+
+
+# -----------------------------------------------------------------------------
+def cached_fetch(id_table:Table, columns, fetch, release='DR3', source_id='source_id', cache_dir=CACHE_DIRECTORY, max_bytes=MAX_BYTES):
+    """
+    Get archive columns for the IDs in ``id_table``, asking the archive only for IDs that are not cached.
+
+    ``fetch`` is called with the rows of ``id_table`` that missed the cache and must return a Table with
+    ``id_table``'s columns (under their names or lowercased, as the archive returns uploaded columns) and the
+    archive columns (e.g. a call to ``get_bailer_jones.upload_and_join``).
+    Its results are stored in the cache and returned together with the hits, each row joined to its
+    ``id_table`` row. IDs the archive returns nothing for are asked for again on the next call.
+
+    :param id_table: A table with the source ID column (and any other uploaded columns).
+    :type id_table: Table
+    :param columns: Names of the archive columns wanted.
+    :type columns: list of str
+    :param fetch: Function fetching the missed rows from the archive.
+    :type fetch: callable
+    :param release: Data release of the IDs.
+    :type release: str
+    :param source_id: Name of the source ID column in ``id_table``.
+    :type source_id: str
+    :param cache_dir: Directory holding the cache.
+    :type cache_dir: str or pathlib.Path
+    :param max_bytes: Size bound for the release's cache in bytes.
+    :type max_bytes: int
+    :raises Exception: Raised if the fetched rows have no ``source_id`` column.
+    :return: The ``id_table`` rows found in the cache or the archive, with the archive columns added.
+    :rtype: Table
+    """
+    hits, hit = lookup(id_table[source_id], columns, release=release, cache_dir=cache_dir)
+    print('gaia_cache: '+str(np.sum(hit))+' of '+str(len(hit))+' IDs found in the cache')
+
+    parts = []
+    if np.any(hit):
+        hits.remove_column('source_id')
+        parts.append(hstack([id_table[hit], hits], join_type='exact'))
+
+    if not np.all(hit):
+        fetched = fetch(id_table[~hit])
+        # the archive lowercases the uploaded columns' names, so give them back id_table's names
+        for name in id_table.colnames:
+            if name not in fetched.colnames and name.lower() in fetched.colnames:
+                fetched.rename_column(name.lower(), name)
+        if source_id not in fetched.colnames:
+            raise Exception('gaia_cache.cached_fetch(): the fetched rows have no \'' + source_id + '\' column')
+        store(fetched[[source_id] + list(columns)], release=release, source_id=source_id, cache_dir=cache_dir, max_bytes=max_bytes)
+        parts.append(fetched)
+
+    return vstack(parts) if parts else id_table[:0]
+
+
+
+# -----------------------------------------------------------------------------
+def invalidate(release=None, cache_dir=CACHE_DIRECTORY):
+    """
+    Remove cached rows for one data release, or the whole cache.
+
+    :param release: Data release to remove. Removes every release if not given.
+    :type release: str
+    :param cache_dir: Directory holding the cache.
+    :type cache_dir: str or pathlib.Path
+    """
+    if release is None:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    else:
+        shutil.rmtree(_release_dir(cache_dir, release), ignore_errors=True)
+
+
+
+def _release_dir(cache_dir, release):
+    return Path(cache_dir) / release.lower()
+
+
+
+def _read_columns(directory):
+    with open(directory / COLUMNS_FILE, 'r') as file:
+        return json.load(file)['columns']
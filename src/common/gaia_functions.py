@@ -30,57 +30,184 @@ from common import file_functions, calculations
 #requires r_med_geo and r_med_photogeo
 def set_bj_distance(data:Table):
     #setting dcalc based on r_med_geo (if>500pc and photogeo exists, we choose photogeo and set dcalc to 1, else geo if it exists and dcalc is set to 2, else we calculate the parallax based distance ourselves and dcalc is set to 3)
-    data['dcalc'] = [1 if((not(np.ma.is_masked(data['r_med_photogeo'][i])))and(data['r_med_geo'][i]>500)) else 2 if (not(np.ma.is_masked(data['r_med_geo'][i]))) else 3 for i in range(len(data))]
+    resolve_bj_distance(data, parallax='parallax')
+
+
+
+#columnar Bailer-Jones distance resolver shared by set_bj_distance, get_bailer_jones.get_bj_distances and the notebooks
+#the choice is made from the mask arrays in one pass, so there is no per-row Python work:
+#  dcalc 1: r_med_photogeo exists and r_med_geo > photogeo_min_pc (500 pc)
+#  dcalc 2: otherwise, r_med_geo exists
+#  dcalc 3: otherwise, 1000/parallax (only if a parallax column is given; without one the row stays on the masked geometric distance)
+#adds dcalc, bj_distance, e_bj_dist and bj_error_over_distance (all distances in pc)
+#context='DR2' uses r_est, r_hi and r_lo from the DR2 geometric distance table and sets dcalc to 1
+def resolve_bj_distance(data:Table, context='DR3', parallax=None, photogeo_min_pc=500):
+    
+    def values(column):
+        return np.asarray(np.ma.getdata(data[column]), dtype=np.float64)
+    
+    def mask(column):
+        return np.ma.getmaskarray(data[column])
+    
+    if(context=='DR2'):
+        dcalc = np.ones(len(data), dtype=int)
+        distance = values('r_est')
+        distance_mask = mask('r_est')
+        error = (values('r_hi') - values('r_lo'))/2
+        error_mask = mask('r_hi') | mask('r_lo')
+        description = 'Distance Indicator: 1 indicates a Bailer-Jones DR2 geometric distance'
+    
+    elif((context=='DR3')or(context=='EDR3')):
+        geo_mask = mask('r_med_geo')
+        use_photogeo = ~mask('r_med_photogeo') & ~geo_mask & (values('r_med_geo') > photogeo_min_pc)
+        
+        dcalc = np.where(use_photogeo, 1, 2)
+        distance = np.where(use_photogeo, values('r_med_photogeo'), values('r_med_geo'))
+        distance_mask = np.where(use_photogeo, mask('r_med_photogeo'), geo_mask)
+        
+        #error is half the 16th-84th percentile range of whichever distance was chosen
+        error = np.where(use_photogeo, (values('r_hi_photogeo') - values('r_lo_photogeo'))/2, (values('r_hi_geo') - values('r_lo_geo'))/2)
+        error_mask = np.where(use_photogeo, mask('r_hi_photogeo') | mask('r_lo_photogeo'), mask('r_hi_geo') | mask('r_lo_geo'))
+        
+        description = 'Distance Indicator: 1 indicates a Bailer-Jones photogeometric distance; 2 indicates a Bailer-Jones geometric distance'
+        
+        #fall back on the parallax where there is no Bailer-Jones distance at all
+        if(parallax is not None):
+            use_parallax = geo_mask & ~use_photogeo
+            with np.errstate(divide='ignore'):
+                distance = np.where(use_parallax, 1000/values(parallax), distance)
+            distance_mask = np.where(use_parallax, mask(parallax), distance_mask)
+            dcalc = np.where(use_parallax, 3, dcalc)
+            description = description + '; 3 indicates a Gaia parallax based distance'
     
-    #setting metadata for dcalc
-    data['dcalc'] = data.Column(data['dcalc'],
+    else:
+        raise Exception('Context must be DR2, EDR3, or DR3')
+    
+    data['dcalc'] = data.Column(data=dcalc,
                                 meta=collections.OrderedDict([('ucd', 'meta.dcalc')]),
-                                description='Distance Indicator: 1 indicates a Bailer-Jones photogeometric distance; 2 indicates a Bailer-Jones geometric distance; 3 indicates a Gaia parallax based distance')
+                                description=description)
+    
+    data['bj_distance'] = data.MaskedColumn(data=distance, mask=distance_mask, unit=u.pc)
     
-    #Choosing distance based on dcalc
-    data['bj_distance'] = [data['r_med_photogeo'][i] if data['dcalc'][i]==1 else data['r_med_geo'][i] if data['dcalc'][i]==2 else 1000/data['parallax'][i] for i in range(len(data))]
-    data['bj_distance'].unit=u.pc
+    data['e_bj_dist'] = data.MaskedColumn(data=error, mask=error_mask, unit=u.pc)
     
-    #Choosing and calculating distance error based on the distance we chose
-    data['e_bj_dist'] = [((data['r_hi_photogeo'][i]-data['r_lo_photogeo'][i])/2)*u.pc if((not(np.ma.is_masked(data['r_med_photogeo'][i])))and(data['r_med_geo'][i]>500)) else ((data['r_hi_geo'][i]-data['r_lo_geo'][i])/2)*u.pc for i in range(len(data))]
+    #distance error percentage
+    with np.errstate(divide='ignore', invalid='ignore'):
+        data['bj_error_over_distance'] = data.MaskedColumn(data=error/distance, mask=error_mask | distance_mask)
 
 
 
-#calculating absolute magnitudes and setting a column for apparent magnitudes
-#currently uses Gaia green band magnitude
-#requires phot_g_mean_mag and dist_pc
-def get_magnitudes(data:Table, gmag='phot_g_mean_mag'):
-    data['appmag'] = data.MaskedColumn(data=data[gmag],
+#the photometry stages below work on plain float arrays plus a mask, so masked rows never get unmasked to Python objects
+def _values_and_mask(data:Table, column):
+    return np.asarray(np.ma.getdata(data[column]), dtype=np.float64), np.ma.getmaskarray(data[column])
+
+
+#absolute magnitude from apparent magnitude and distance in pc
+def _absolute_magnitude(appmag, dist_pc):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return appmag + 5 - 5*np.log10(dist_pc)
+
+
+#luminosity (solar) from absolute G magnitude, with anything below 0.001 raised to 0.001
+def _luminosity(absmag):
+    lum = 10**(1.89 - 0.4*absmag)
+    lum[(lum>0.0) & (lum<0.001)] = 0.001
+    return lum
+
+
+def _set_appmag(data:Table, appmag, mask):
+    data['appmag'] = data.MaskedColumn(data=appmag,
+                                       mask=mask,
                                        unit=u.mag,
                                        meta=collections.OrderedDict([('ucd', 'phot.mag;em.opt.G')]),
                                        format='{:.6f}',
                                        description='Apparent magnitude in Gaia G-band')
-    data['absmag'] = data.MaskedColumn(data=[data['appmag'][i]+5-5*np.log10(data['dist_pc'][i]) for i in range(len(data))],
+
+
+def _set_absmag(data:Table, absmag, mask):
+    data['absmag'] = data.MaskedColumn(data=absmag,
+                                 mask=mask,
                                  unit=u.mag,
                                  meta=collections.OrderedDict([('ucd', 'phot.magAbs;em.opt.G')]),
                                  format='{:.6f}',
                                  description='Absolute magnitude in Gaia G-band')
 
 
-
-#calculate luminosity based on absolute magnitude
-def get_luminosity(data:Table):
-    data['lum'] = [10**(1.89 - 0.4*data['absmag'][i]) for i in range(len(data))]
-    small_luminosities = np.where((data['lum']>0.0) & (data['lum']<0.001))[0]
-    data['lum'][small_luminosities] = [0.001]*len(small_luminosities)
-    
-    data['lum'] = data.MaskedColumn(data=data['lum'],
+def _set_lum(data:Table, lum, mask):
+    data['lum'] = data.MaskedColumn(data=lum,
+                                    mask=mask,
                                     unit=u.solLum,
                                     meta=collections.OrderedDict([('ucd', 'phys.luminosity')]),
                                     format='{:.6f}',
                                     description='Stellar Luminosity')
 
 
-
-#setting color
-def get_bp_g_color(data:Table, color='bp_g'):
-    data['color'] = data.MaskedColumn(data=data[color],
+def _set_color(data:Table, color, mask, description='Gaia BP-G color'):
+    data['color'] = data.MaskedColumn(data=color,
+                                      mask=mask,
                                       unit=u.solLum,
                                       meta=collections.OrderedDict([('ucd', 'phys.color')]),
                                       format='{:.2f}',
-                                      description='Gaia BP-G color')
\ No newline at end of file
+                                      description=description)
+
+
+
+#description of a color column named by its Gaia bands (e.g. bp_rp -> 'Gaia BP-RP color')
+def _color_description(color):
+    bands = color.lower().split('_')
+    if len(bands) == 2 and all(band in ('bp', 'rp', 'g') for band in bands):
+        return 'Gaia ' + '-'.join(band.upper() for band in bands) + ' color'
+    return 'Color (' + color + ')'
+
+
+
+#calculating absolute magnitudes and setting a column for apparent magnitudes
+#currently uses Gaia green band magnitude
+#requires phot_g_mean_mag and dist_pc
+def get_magnitudes(data:Table, gmag='phot_g_mean_mag', dist='dist_pc'):
+    appmag, appmag_mask = _values_and_mask(data, gmag)
+    dist_pc, dist_mask = _values_and_mask(data, dist)
+    
+    _set_appmag(data, appmag, appmag_mask)
+    _set_absmag(data, _absolute_magnitude(appmag, dist_pc), appmag_mask | dist_mask)
+
+
+
+#calculate luminosity based on absolute magnitude
+def get_luminosity(data:Table):
+    absmag, absmag_mask = _values_and_mask(data, 'absmag')
+    _set_lum(data, _luminosity(absmag), absmag_mask)
+
+
+
+#setting color
+def get_bp_g_color(data:Table, color='bp_g'):
+    color, color_mask = _values_and_mask(data, color)
+    _set_color(data, color, color_mask)
+
+
+
+#fused photometry stage: appmag, absmag, lum (with the 0.001 floor) and color in one pass over the arrays
+#same columns and metadata as get_magnitudes + get_luminosity + get_bp_g_color
+#color is taken from the color column, or computed as bp - rp if the bp and rp magnitude columns are given
+#requires the G magnitude column and dist_pc
+def get_photometry(data:Table, gmag='phot_g_mean_mag', dist='dist_pc', color='bp_g', bp=None, rp=None):
+    appmag, appmag_mask = _values_and_mask(data, gmag)
+    dist_pc, dist_mask = _values_and_mask(data, dist)
+    
+    absmag = _absolute_magnitude(appmag, dist_pc)
+    absmag_mask = appmag_mask | dist_mask
+    
+    if((bp is not None) and (rp is not None)):
+        bp_mag, bp_mask = _values_and_mask(data, bp)
+        rp_mag, rp_mask = _values_and_mask(data, rp)
+        color_values, color_mask = bp_mag - rp_mag, bp_mask | rp_mask
+        color_description = 'Gaia BP-RP color'
+    else:
+        color_values, color_mask = _values_and_mask(data, color)
+        color_description = _color_description(color)
+    
+    _set_appmag(data, appmag, appmag_mask)
+    _set_absmag(data, absmag, absmag_mask)
+    _set_lum(data, _luminosity(absmag), absmag_mask)
+    _set_color(data, color_values, color_mask, description=color_description)
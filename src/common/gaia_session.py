@@ -0,0 +1,258 @@
+# PY SCRIPT FOR SHARED, LOGGED-IN GAIA ARCHIVE SESSIONS
+#
+# Logging in to the ESA Gaia archive is a full round-trip, and the notebooks
+# and scripts used to log in, run one query and log out again each time.  This
+# module keeps a pool of logged-in connections per credentials file: a query
+# borrows one, and gives it back afterwards, so a session with several queries
+# or uploads only logs in once per connection it actually needs.  Independent
+# queries can run concurrently, each on its own pooled connection.
+#
+# User tables and jobs created through the module are remembered, and whatever
+# is left of them is removed from the archive (and every connection logged out)
+# when the Python process exits.
+#
+# VERSIONS:
+#  1.0  SHARED ARCHIVE SESSIONS
+#  1.1  FAILED CONNECTIONS DISCARDED INSTEAD OF POOLED
+
+
+import atexit
+import concurrent.futures
+import contextlib
+import threading
+
+from astroquery.gaia import GaiaClass
+
+
+
+CREDENTIALS_FILE = '../common/gaia_credentials.txt'
+
+# default number of queries run at the same time by run_queries
+N_WORKERS = 4
+
+_lock = threading.Lock()
+
+# idle logged-in connections and every connection made, per credentials file
+_idle = {}
+_connections = {}
+_usernames = {}
+
+# (credentials file, name) of user tables and jobs still on the archive
+_user_tables = set()
+_jobs = set()
+
+
+
+# -----------------------------------------------------------------------------
+def username(credentials_file=CREDENTIALS_FILE):
+    """
+    Get the archive user name (the first line of the credentials file), as needed for ``user_<name>`` tables.
+
+    :param credentials_file: Path of the credentials file.
+    :type credentials_file: str
+    :return: The user name.
+    :rtype: str
+    """
+    with _lock:
+        if credentials_file not in _usernames:
+            with open(credentials_file, 'r') as file:
+                _usernames[credentials_file] = file.readline().strip()
+        return _usernames[credentials_file]
+
+
+
+# -----------------------------------------------------------------------------
+def acquire(credentials_file=CREDENTIALS_FILE):
+    """
+    Borrow a logged-in archive connection from the pool, logging in a new one only if none is idle.
+
+    Give it back with :func:`release` (or use :func:`connection`).
+
+    :param credentials_file: Path of the credentials file.
+    :type credentials_file: str
+    :return: A logged-in connection.
+    :rtype: astroquery.gaia.GaiaClass
+    """
+    with _lock:
+        idle = _idle.setdefault(credentials_file, [])
+        if idle:
+            return idle.pop()
+
+    gaia = GaiaClass()
+    gaia.login(credentials_file=credentials_file)
+    with _lock:
+        _connections.setdefault(credentials_file, []).append(gaia)
+    return gaia
+
+
+
+# -----------------------------------------------------------------------------
+def release(gaia, credentials_file=CREDENTIALS_FILE):
+    """
+    Return a connection borrowed with :func:`acquire` to the pool.
+
+    :param gaia: The connection.
+    :type gaia: astroquery.gaia.GaiaClass
+    :param credentials_file: Path of the credentials file it was logged in with.
+    :type credentials_file: str
+    """
+    with _lock:
+        _idle.setdefault(credentials_file, []).append(gaia)
+
+
+
+def discard(gaia, credentials_file=CREDENTIALS_FILE):
+    """
+    Drop a connection borrowed with :func:`acquire` that failed, instead of returning it to the pool, and log it out.
+
+    The next :func:`acquire` then logs in a new connection rather than reusing a broken session.
+
+    :param gaia: The connection.
+    :type gaia: astroquery.gaia.GaiaClass
+    :param credentials_file: Path of the credentials file it was logged in with.
+    :type credentials_file: str
+    """
+    with _lock:
+        connections = _connections.get(credentials_file, [])
+        if gaia in connections:
+            connections.remove(gaia)
+    try:
+        gaia.logout()
+    except Exception:
+        pass
+
+
+
+@contextlib.contextmanager
+def connection(credentials_file=CREDENTIALS_FILE):
+    """
+    Borrow a logged-in connection for the duration of a ``with`` block. For example::
+
+        with gaia_session.connection() as gaia:
+            gaia_session.upload_table(gaia, data[['GaiaEDR3']], 'd_gal')
+            ...
+    """
+    gaia = acquire(credentials_file)
+    try:
+        yield gaia
+    finally:
+        release(gaia, credentials_file)
+
+
+
+# -----------------------------------------------------------------------------
+def upload_table(gaia, table, table_name, credentials_file=CREDENTIALS_FILE):
+    """
+    Upload a table as a user table, remembering it so it is deleted at exit if :func:`delete_user_table` isn't called.
+
+    :param gaia: A connection from the pool.
+    :type gaia: astroquery.gaia.GaiaClass
+    :param table: The table to upload.
+    :type table: Table
+    :param table_name: Name of the user table (the archive forces it to lower case).
+    :type table_name: str
+    :param credentials_file: Path of the credentials file the connection was logged in with.
+    :type credentials_file: str
+    """
+    gaia.upload_table(upload_resource=table, table_name=table_name, format='csv')
+    with _lock:
+        _user_tables.add((credentials_file, table_name.lower()))
+
+
+
+def delete_user_table(gaia, table_name, credentials_file=CREDENTIALS_FILE):
+    """
+    Delete a user table uploaded with :func:`upload_table`.
+    """
+    gaia.delete_user_table(table_name=table_name.lower())
+    with _lock:
+        _user_tables.discard((credentials_file, table_name.lower()))
+
+
+
+# -----------------------------------------------------------------------------
+def run_query(query, credentials_file=CREDENTIALS_FILE, keep_job=False):
+    """
+    Run an asynchronous ADQL query on a pooled connection and return its results.
+
+    The job is removed from the archive once the results are in, unless ``keep_job`` is set (the job is
+    then removed at exit).
+
+    :param query: The ADQL query.
+    :type query: str
+    :param credentials_file: Path of the credentials file.
+    :type credentials_file: str
+    :param keep_job: Leave the job on the archive until the process exits.
+    :type keep_job: bool
+    :return: The query results.
+    :rtype: Table
+    """
+    with connection(credentials_file) as gaia:
+        job = gaia.launch_job_async(query, dump_to_file=False)
+        with _lock:
+            _jobs.add((credentials_file, job.jobid))
+        results = job.get_results()
+        if not keep_job:
+            gaia.remove_jobs(job.jobid)
+            with _lock:
+                _jobs.discard((credentials_file, job.jobid))
+    return results
+
+
+
+# -----------------------------------------------------------------------------
+def run_queries(queries, credentials_file=CREDENTIALS_FILE, n_workers=N_WORKERS):
+    """
+    Run independent ADQL queries concurrently, each on its own pooled connection.
+
+    :param queries: The ADQL queries.
+    :type queries: list of str
+    :param credentials_file: Path of the credentials file.
+    :type credentials_file: str
+    :param n_workers: Number of queries running at the same time.
+    :type n_workers: int
+    :return: The results of each query, in the order of ``queries``.
+    :rtype: list of Table
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_workers) as executor:
+        return list(executor.map(lambda query: run_query(query, credentials_file), queries))
+
+
+
+# -----------------------------------------------------------------------------
+def close():
+    """
+    Remove the user tables and jobs still on the archive and log out every pooled connection.
+
+    Called automatically when the process exits; errors are printed, not raised.
+    """
+    with _lock:
+        user_tables = sorted(_user_tables)
+        jobs = sorted(_jobs)
+        connections = dict(_connections)
+        _user_tables.clear()
+        _jobs.clear()
+        _connections.clear()
+        _idle.clear()
+
+    for credentials_file, table_name in user_tables:
+        try:
+            connections[credentials_file][0].delete_user_table(table_name=table_name)
+        except Exception as error:
+            print('gaia_session: could not delete user table ' + table_name + ': ' + str(error))
+    for credentials_file, jobid in jobs:
+        try:
+            connections[credentials_file][0].remove_jobs(jobid)
+        except Exception as error:
+            print('gaia_session: could not remove job ' + str(jobid) + ': ' + str(error))
+
+    for gaias in connections.values():
+        for gaia in gaias:
+            try:
+                gaia.logout()
+            except Exception:
+                pass
+
+
+
+atexit.register(close)
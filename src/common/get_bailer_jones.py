@@ -1,24 +1,46 @@
 #function to upload a set of Gaia IDs to the gea archive and query the Gaia DR3 Bailer Jones Distances
 #created by Zack Reeves February 2024
 
+import concurrent.futures
+import threading
+import time
+import uuid
+
 import numpy as np
-from astropy.table import Table, join
+from astropy.table import Table, vstack
 from astroquery.gaia import Gaia
-from astroquery.utils.tap.core import TapPlus
 import astropy.units as u
 import collections
 
+from common import gaia_functions
+from common import gaia_cache
+from common import gaia_session
+
+# IDs are uploaded in batches of BATCH_SIZE rows, N_WORKERS batches at a time
+BATCH_SIZE = 500000
+N_WORKERS = 4
+
+# how many times a failed batch is retried, and the wait (seconds) before the first retry (doubles each time)
+RETRIES = 3
+RETRY_WAIT = 10
+
+CREDENTIALS_FILE = gaia_session.CREDENTIALS_FILE
+
 #when calling the function, source_id should be set as whatever the Gaia EDR3, DR3, or DR2 ID is called in the table
 #the IDs should be the raw id string, no prefix
 #context should be DR2, EDR3, or DR3
-def get_bj_distances(data:Table, source_id='source_id', columns=None, get_motion=False, context='DR3'):
-    
-    #log in to Gaia Server - Can change to different credentials file for a different user
-    Gaia.login(credentials_file='../common/gaia_credentials.txt')
+#the IDs are uploaded in batches of batch_size rows and n_workers batches are uploaded and joined at a time, each under its own
+#uniquely named user table; results are merged back in the original batch order
+#a failed batch is retried up to retries times, and every user table and job is removed from the archive even on failure
+#upload workers borrow logged-in connections from the shared gaia_session pool, so repeated calls don't log in again
+#connect is a function returning a logged-in Gaia connection used instead of the pool (logged out at the end) - it can point at a
+#stand-in TAP service for testing
+#with cache_dir set (e.g. gaia_cache.CACHE_DIRECTORY), results are kept on disk per data release and only IDs that are not
+#cached yet are uploaded; EDR3 and DR3 share one cache since they are queried from the same tables
+def get_bj_distances(data:Table, source_id='source_id', columns=None, get_motion=False, context='DR3', batch_size=BATCH_SIZE, n_workers=N_WORKERS, retries=RETRIES, credentials_file=CREDENTIALS_FILE, connect=None, cache_dir=None):
     
     #get username from credentials file for query
-    with open('../common/gaia_credentials.txt', 'r') as file:
-        username = file.readline().strip()
+    username = gaia_session.username(credentials_file)
         
     #set proper motion and radial velocity columns if needed
     if(get_motion):
@@ -41,8 +63,8 @@ def get_bj_distances(data:Table, source_id='source_id', columns=None, get_motion
     else:
         raise Exception('Context must be DR2, EDR3, or DR3')
         
-    #construct query
-    query = "select a.*, "+gaia_source_columns+bj_columns+" "+"from user_"+username+".gaia_ids a inner join "+gaia_source_table+" gs on a."+source_id+" = gs.source_id inner join "+bj_table+" bj on a."+source_id+" = bj.source_id"
+    #construct query - {table} is filled in with each batch's user table
+    query = "select a.*, "+gaia_source_columns+bj_columns+" "+"from user_"+username+".{table} a inner join "+gaia_source_table+" gs on a."+source_id+" = gs.source_id inner join "+bj_table+" bj on a."+source_id+" = bj.source_id"
 
     
     #create a table with the columns specified
@@ -52,47 +74,120 @@ def get_bj_distances(data:Table, source_id='source_id', columns=None, get_motion
     else:
         id_table=data[columns]
 
-    #Upload table (table name will be forced to lowercase)
-    job = Gaia.upload_table(upload_resource=id_table,
-                            table_name="gaia_ids", format="csv")
+    fetch = lambda ids: upload_and_join(ids, query, connect, batch_size=batch_size, n_workers=n_workers, retries=retries, credentials_file=credentials_file)
+    
+    if(cache_dir is None):
+        distances = fetch(id_table)
+    else:
+        #archive column names without their table alias
+        archive_columns = [name.strip()[3:] for name in (gaia_source_columns+bj_columns).split(',') if name.strip()]
+        release = 'DR2' if context=='DR2' else 'DR3'
+        distances = gaia_cache.cached_fetch(id_table, archive_columns, fetch, release=release, source_id=source_id, cache_dir=cache_dir)
+    
+    #Choose distance we want (for EDR3 and DR3: dist>500 -> use photogeo if it exists, otherwise, geo)
+    #also set dcalc (1 for photogeometric, 2 for geometric), the distance error and the error percentage
+    gaia_functions.resolve_bj_distance(distances, context=context)
+    
+    return distances
+    #return join(data, distances, keys=source_id, join_type='left')
 
-    #Query Gaia DR3 source for parallaxes
-    job = Gaia.launch_job_async(query, dump_to_file=False)
 
-    #Put the resulting table into a Table
-    distances = job.get_results()
+#uploads id_table in batches and runs query (with {table} replaced by each batch's user table name) against each one
+#batches run concurrently on n_workers threads, each with its own connection from connect(), or borrowed from the
+#gaia_session pool if connect is None
+#returns the results stacked in the original batch order
+def upload_and_join(id_table:Table, query, connect=None, batch_size=BATCH_SIZE, n_workers=N_WORKERS, retries=RETRIES, credentials_file=CREDENTIALS_FILE):
     
-    #dropping the original index (artifact from the query)
-    distances.remove_column('gaia_ids_oid')
+    #unique prefix so concurrent runs (or leftovers from a crashed one) never share a user table name
+    run_id = uuid.uuid4().hex[:8]
+    batches = [(i, id_table[start:start+batch_size]) for i, start in enumerate(range(0, max(len(id_table), 1), batch_size))]
     
-    #Deleting table and job from Gaia ESA server so we don't clog the memory
-    Gaia.delete_user_table(table_name = 'gaia_ids')
-    Gaia.remove_jobs(job.jobid)
-
-    Gaia.logout()
+    #one connection per worker thread, all given back to the pool (or logged out) at the end
+    connections = []
+    connections_lock = threading.Lock()
+    local = threading.local()
     
-    #Choose distance we want (for EDR3 and DR3: dist>500 -> use photogeo if it exists, otherwise, geo)
-    #also set dcalc: 1 for geometric distance, 2 for photogeometric
-    if(context=='DR2'):
-        distances['bj_distance'] = distances['r_est']
-        distances['dcalc'] = [1]*len(distances)
-    else:
-        distances['bj_distance'] = [distances['r_med_photogeo'][i]*u.pc if((not(np.ma.is_masked(distances['r_med_photogeo'][i])))and(distances['r_med_geo'][i]>500)) else distances['r_med_geo'][i]*u.pc for i in range(len(distances))]
-        distances['dcalc'] = [1 if((not(np.ma.is_masked(distances['r_med_photogeo'][i])))and(distances['r_med_geo'][i]>500)) else 2 for i in range(len(distances))]
+    def get_connection():
+        if(not hasattr(local, 'gaia')):
+            local.gaia = gaia_session.acquire(credentials_file) if connect is None else connect()
+            with connections_lock:
+                connections.append(local.gaia)
+        return local.gaia
     
-    #Calculate distance error, same criteria as distance
-    if(context=='DR2'):
-        distances['e_bj_dist'] = [(distances['r_hi'][i]-distances['r_lo'][i])/2 for i in range(len(distances))]
-    else:
-        distances['e_bj_dist'] = [((distances['r_hi_photogeo'][i]-distances['r_lo_photogeo'][i])/2)*u.pc if((not(np.ma.is_masked(distances['r_med_photogeo'][i])))and(distances['r_med_geo'][i]>500)) else ((distances['r_hi_geo'][i]-distances['r_lo_geo'][i])/2)*u.pc for i in range(len(distances))]
-
-    distances['dcalc'] = data.Column(data=distances['dcalc'], 
-                                     meta=collections.OrderedDict([('ucd', 'meta.dist')]),
-                                     description='Distance indicator: 1 indicates a Bailer-Jones geometric distance; 2 indicates a Bailer-Jones photogeometric distance')
+    #a failed attempt may have broken its connection's session, so it is dropped and the next attempt logs in fresh
+    def drop_connection():
+        gaia = local.gaia
+        del local.gaia
+        with connections_lock:
+            connections.remove(gaia)
+        if(connect is None):
+            gaia_session.discard(gaia, credentials_file)
+        else:
+            try:
+                gaia.logout()
+            except Exception:
+                pass
     
+    def run_batch(i, batch):
+        table_name = 'gaia_ids_'+run_id+'_'+str(i)
+        wait = RETRY_WAIT
+        for attempt in range(retries+1):
+            gaia = get_connection()
+            job = None
+            uploaded = False
+            try:
+                #Upload table (table name will be forced to lowercase)
+                gaia.upload_table(upload_resource=batch, table_name=table_name, format="csv")
+                uploaded = True
+                
+                job = gaia.launch_job_async(query.format(table=table_name), dump_to_file=False)
+                result = job.get_results()
+                
+                #dropping the original index (artifact from the query)
+                if(table_name+'_oid' in result.colnames):
+                    result.remove_column(table_name+'_oid')
+                return result
+            except Exception as error:
+                failure = error
+            finally:
+                #Deleting table and job from Gaia ESA server so we don't clog the memory
+                _cleanup(gaia, table_name if uploaded else None, job)
+            drop_connection()
+            if(attempt==retries):
+                raise Exception('get_bailer_jones.upload_and_join(): batch '+str(i)+' failed after '+str(retries+1)+' attempts') from failure
+            print('batch '+str(i)+' failed ('+str(failure)+'), retrying in '+str(wait)+' s')
+            time.sleep(wait)
+            wait *= 2
     
-    #Calculate distance error percentage
-    distances['bj_error_over_distance'] = [distances['e_bj_dist'][i]/distances['bj_distance'][i] for i in range(len(distances))]
+    results = {}
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=n_workers) as executor:
+            futures = {executor.submit(run_batch, i, batch): i for i, batch in batches}
+            for future in concurrent.futures.as_completed(futures):
+                results[futures[future]] = future.result()
+                print('finished batch '+str(len(results))+'/'+str(len(batches)))
+    finally:
+        for gaia in connections:
+            if(connect is None):
+                gaia_session.release(gaia, credentials_file)
+                continue
+            try:
+                gaia.logout()
+            except Exception:
+                pass
     
-    return distances
-    #return join(data, distances, keys=source_id, join_type='left')
\ No newline at end of file
+    return vstack([results[i] for i, batch in batches])
+
+
+#removes a batch's user table and job from the archive, ignoring errors so cleanup never hides the original failure
+def _cleanup(gaia, table_name, job):
+    if(table_name is not None):
+        try:
+            gaia.delete_user_table(table_name=table_name)
+        except Exception as error:
+            print('could not delete user table '+table_name+': '+str(error))
+    if(job is not None):
+        try:
+            gaia.remove_jobs(job.jobid)
+        except Exception as error:
+            print('could not remove job '+str(job.jobid)+': '+str(error))
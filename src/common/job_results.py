@@ -0,0 +1,380 @@
+# PY SCRIPT TO DOWNLOAD LARGE GAIA JOB RESULTS
+#
+# Big asynchronous queries (e.g. the 33M-star dr3rv query) can take over an
+# hour and job.get_results() then fails or has to be replaced by fetching the
+# -result.vot.gz file by hand and reading it into memory in one go.  This
+# module streams a job's result file to disk in chunks instead, resuming with
+# HTTP range requests after a dropped connection (or a restarted notebook), and
+# prints the progress and throughput as it goes.
+#
+# With columnar= set, a csv result (launch_job_async(..., output_format='csv'))
+# is also converted while it downloads into a directory of .npy files, one per
+# column plus a null mask, which later stages can memory-map with
+# read_columnar().  Other formats are converted once the download is complete.
+#
+# VERSIONS:
+#  1.0  RESUMABLE JOB RESULT DOWNLOAD
+
+
+import http.client
+import json
+import os
+import shutil
+import time
+import urllib.error
+import urllib.request
+import zlib
+from pathlib import Path
+
+import numpy as np
+from astropy.io import ascii
+from astropy.table import Table, MaskedColumn
+
+
+
+# bytes read from the server per request read
+CHUNK_BYTES = 8 * 2**20
+
+# rows parsed at a time when converting csv to columns
+CONVERT_ROWS = 500000
+
+# how many times a dropped download is resumed, and the wait (seconds) before the first retry (doubles each time)
+RETRIES = 5
+RETRY_WAIT = 5
+
+# seconds between progress lines
+PROGRESS_INTERVAL = 10
+
+COLUMNS_FILE = 'columns.json'
+
+
+
+# -----------------------------------------------------------------------------
+def job_result_url(gaia, jobid):
+    """
+    Get the result URL of an asynchronous job and the headers needed to download it as the logged-in user.
+
+    :param gaia: The (logged-in) connection the job was launched on.
+    :type gaia: astroquery.gaia.GaiaClass
+    :param jobid: The job ID (``job.jobid``).
+    :type jobid: str
+    :return: The URL and a dictionary of request headers.
+    :rtype: (str, dict)
+    """
+    # astroquery keeps the connection details and session cookie private, so read them from its handler
+    conn_handler = gaia._Tap__connHandler
+    url = 'https://' + conn_handler.get_host_url_secure() + 'async/' + str(jobid) + '/results/result'
+    cookie = getattr(conn_handler, '_TapConn__cookie', None)
+    headers = {} if cookie is None else {'Cookie': cookie}
+    return url, headers
+
+
+
+# -----------------------------------------------------------------------------
+def download(url, output, headers=None, columnar=None, chunk_bytes=CHUNK_BYTES, retries=RETRIES, timeout=60):
+    """
+    Stream a file (usually a job result) to disk, resuming where it stopped after an error.
+
+    The file is written to ``output + '.part'`` and renamed to ``output`` when complete, so a ``.part``
+    file left from an earlier call is resumed with a range request instead of being downloaded again
+    (if the server ignores the range, the download starts over). For example::
+
+        job = gaia.launch_job_async(query, output_format='csv')
+        url, headers = job_results.job_result_url(gaia, job.jobid)
+        job_results.download(url, 'raw_data/dr3rv.csv.gz', headers=headers, columnar='raw_data/dr3rv_columns')
+        data = job_results.read_columnar('raw_data/dr3rv_columns')
+
+    :param url: The URL to download.
+    :type url: str
+    :param output: Path of the downloaded file.
+    :type output: str or pathlib.Path
+    :param headers: Extra request headers (e.g. the session cookie from :func:`job_result_url`).
+    :type headers: dict
+    :param columnar: Optional directory to convert the result into, for :func:`read_columnar`. csv results (plain or gzipped) are converted while downloading.
+    :type columnar: str or pathlib.Path
+    :param chunk_bytes: Bytes read from the server at a time.
+    :type chunk_bytes: int
+    :param retries: Number of times a dropped download is resumed before giving up.
+    :type retries: int
+    :param timeout: Socket timeout in seconds.
+    :type timeout: float
+    :raises Exception: Raised if the download still fails after ``retries`` resumes.
+    :return: The path of the downloaded file.
+    :rtype: pathlib.Path
+    """
+    output = Path(output)
+    part = output.with_name(output.name + '.part')
+    headers = dict(headers or {})
+
+    converter = None
+    if columnar is not None:
+        converter = _CsvColumns(columnar)
+        # bytes already on disk from an earlier call go through the converter first
+        if part.exists():
+            with open(part, 'rb') as f:
+                for block in iter(lambda: f.read(chunk_bytes), b''):
+                    converter.feed(block)
+
+    progress = _Progress()
+    wait = RETRY_WAIT
+    attempt = 0
+    while True:
+        done = part.stat().st_size if part.exists() else 0
+        request = urllib.request.Request(url, headers=dict(headers, **({'Range': 'bytes=' + str(done) + '-'} if done else {})))
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                if done and response.status != 206:
+                    # the server sent the whole file again, so start over
+                    done = 0
+                    if converter is not None:
+                        converter.reset()
+                total = _total_size(response, done)
+                progress.start(done, total)
+
+                with open(part, 'ab' if done else 'wb') as out:
+                    for block in iter(lambda: response.read(chunk_bytes), b''):
+                        out.write(block)
+                        if converter is not None:
+                            converter.feed(block)
+                        done += len(block)
+                        progress.update(done)
+
+            if total is not None and done < total:
+                raise urllib.error.URLError('connection closed after ' + str(done) + ' of ' + str(total) + ' bytes')
+            break
+        except urllib.error.HTTPError as error:
+            if error.code == 416 and done:
+                # range not satisfiable: the .part file is already complete
+                break
+            if error.code < 500 or attempt == retries:
+                raise Exception('job_results.download(): ' + url + ' failed: ' + str(error)) from error
+        except (urllib.error.URLError, http.client.HTTPException, OSError) as error:
+            if attempt == retries:
+                raise Exception('job_results.download(): ' + url + ' failed after ' + str(retries + 1) + ' attempts') from error
+            print('job_results: download interrupted (' + str(error) + '), resuming in ' + str(wait) + ' s')
+        attempt += 1
+        time.sleep(wait)
+        wait *= 2
+
+    os.replace(part, output)
+    progress.finish(output.stat().st_size)
+
+    if converter is not None:
+        if converter.is_csv:
+            converter.close()
+        else:
+            converter.discard()
+            to_columnar(Table.read(output), columnar)
+
+    return output
+
+
+
+def _total_size(response, done):
+    # total file size from Content-Range (resumed) or Content-Length (whole file), if the server sent them
+    content_range = response.headers.get('Content-Range')
+    if content_range is not None and '/' in content_range and not content_range.endswith('*'):
+        return int(content_range.rsplit('/', 1)[1])
+    length = response.headers.get('Content-Length')
+    return None if length is None else done + int(length)
+
+
+
+class _Progress:
+    # prints bytes done, percentage (if the size is known) and throughput every PROGRESS_INTERVAL seconds
+
+    def start(self, done, total):
+        self.total = total
+        self.start_bytes = done
+        self.start_time = self.last_print = time.monotonic()
+
+    def update(self, done):
+        now = time.monotonic()
+        if now - self.last_print >= PROGRESS_INTERVAL:
+            self.last_print = now
+            rate = (done - self.start_bytes) / max(now - self.start_time, 1e-9) / 2**20
+            percent = '' if self.total is None else ' (' + format(100 * done / max(self.total, 1), '.1f') + '%)'
+            print('job_results: ' + format(done / 2**20, '.1f') + ' MB' + percent + ', ' + format(rate, '.1f') + ' MB/s')
+
+    def finish(self, size):
+        elapsed = time.monotonic() - getattr(self, 'start_time', time.monotonic())
+        print('job_results: downloaded ' + format(size / 2**20, '.1f') + ' MB in ' + format(elapsed, '.1f') + ' s')
+
+
+
+# -----------------------------------------------------------------------------
+def to_columnar(table:Table, directory):
+    """
+    Write a table as a directory of .npy column files for :func:`read_columnar`.
+
+    :param table: The table to write.
+    :type table: Table
+    :param directory: The output directory (replaced if it exists).
+    :type directory: str or pathlib.Path
+    """
+    directory = Path(directory)
+    shutil.rmtree(directory, ignore_errors=True)
+    directory.mkdir(parents=True)
+    columns = {}
+    for name in table.colnames:
+        column = table[name]
+        np.save(directory / (name + '.npy'), np.ma.getdata(column))
+        np.save(directory / (name + '.mask.npy'), np.ma.getmaskarray(column))
+        columns[name] = {'unit': None if column.unit is None else str(column.unit), 'description': column.description}
+    with open(directory / COLUMNS_FILE, 'w') as out:
+        json.dump({'columns': columns, 'length': len(table)}, out, indent=1)
+
+
+
+# -----------------------------------------------------------------------------
+def read_columnar(directory, columns=None):
+    """
+    Open a columnar result directory as a Table of memory-mapped columns.
+
+    :param directory: A directory written by :func:`download` (with ``columnar``) or :func:`to_columnar`.
+    :type directory: str or pathlib.Path
+    :param columns: Names of the columns to open. Defaults to all of them.
+    :type columns: list of str
+    :return: The table; values are read from disk only when used.
+    :rtype: Table
+    """
+    directory = Path(directory)
+    columns_file = directory / COLUMNS_FILE
+    if not columns_file.is_file():
+        raise Exception('job_results.read_columnar(): ' + str(directory) + ' is not a columnar result directory')
+    with open(columns_file, 'r') as file:
+        column_info = json.load(file)['columns']
+
+    table = Table()
+    for name in (column_info if columns is None else columns):
+        values = np.load(directory / (name + '.npy'), mmap_mode='r')
+        mask = np.load(directory / (name + '.mask.npy'), mmap_mode='r')
+        table[name] = MaskedColumn(data=values, mask=mask, copy=False, unit=column_info[name]['unit'], description=column_info[name]['description'])
+    return table
+
+
+
+class _CsvColumns:
+    # incremental csv -> .npy columns converter: decompresses gzip on the fly, cuts the text into
+    # complete lines, parses every CONVERT_ROWS lines with astropy and appends each column's raw bytes
+    # to a file; close() turns the raw files into .npy files
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.reset()
+
+    def reset(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.directory.mkdir(parents=True)
+        self.decompressor = None
+        self.checked = False
+        self.is_csv = True
+        self.header = None
+        self.pending = b''
+        self.lines = []
+        self.dtypes = {}
+        self.segments = {}
+        self.any_valid = {}
+        self.length = 0
+
+    def feed(self, block):
+        if not self.is_csv:
+            return
+        if not self.checked:
+            self.checked = True
+            if block[:2] == b'\x1f\x8b':
+                self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if self.decompressor is not None:
+            block = self.decompressor.decompress(block)
+        if self.header is None and not self.pending and block.lstrip()[:1] == b'<':
+            # VOTable (or other XML) result: converted after the download
+            self.is_csv = False
+            return
+        self._add_text(block)
+        if len(self.lines) >= CONVERT_ROWS:
+            self._flush()
+
+    def _add_text(self, text):
+        lines = (self.pending + text).split(b'\n')
+        self.pending = lines.pop()
+        if self.header is None and lines:
+            self.header = lines.pop(0)
+        self.lines.extend(lines)
+
+    def _flush(self):
+        lines = [line for line in self.lines if line.strip()]
+        self.lines = []
+        if not lines:
+            return
+        chunk = ascii.read(b'\n'.join([self.header] + lines).decode('UTF-8'), format='csv', guess=False, fast_reader=True)
+
+        for name in chunk.colnames:
+            values = np.ma.getdata(chunk[name])
+            mask = np.ma.getmaskarray(chunk[name])
+            if name not in self.dtypes:
+                self.dtypes[name] = values.dtype
+                self.segments[name] = []
+                self.any_valid[name] = False
+            elif values.dtype.kind != self.dtypes[name].kind and not (values.dtype.kind in 'iu' and self.dtypes[name].kind == 'f'):
+                if self.any_valid[name]:
+                    raise Exception('job_results.download(): column \'' + name + '\' changed type from ' + str(self.dtypes[name]) + ' to ' + str(values.dtype) + ' between chunks')
+                # only nulls so far, so their type was a guess: recast what is already written
+                raw = self.directory / (name + '.raw')
+                if values.dtype.kind in 'SU' or self.dtypes[name].kind in 'SU':
+                    # to or from strings the nulls are rewritten as empty values, one segment for close()
+                    np.zeros(self.length, dtype=values.dtype).tofile(raw)
+                    self.segments[name] = [(values.dtype.str, self.length)] if values.dtype.kind in 'SU' else []
+                else:
+                    np.fromfile(raw, dtype=self.dtypes[name]).astype(values.dtype).tofile(raw)
+                self.dtypes[name] = values.dtype
+            self.any_valid[name] |= not np.all(mask)
+
+            if values.dtype.kind in 'SU':
+                # string widths can differ between chunks; remember each chunk's width for close()
+                self.segments[name].append((values.dtype.str, len(values)))
+                if values.dtype.itemsize > self.dtypes[name].itemsize:
+                    self.dtypes[name] = values.dtype
+            else:
+                values = values.astype(self.dtypes[name], copy=False)
+            with open(self.directory / (name + '.raw'), 'ab') as out:
+                out.write(np.ascontiguousarray(values).tobytes())
+            with open(self.directory / (name + '.mask.raw'), 'ab') as out:
+                out.write(mask.tobytes())
+        self.length += len(chunk)
+
+    def close(self):
+        if self.decompressor is not None:
+            self._add_text(self.decompressor.flush())
+        if self.pending.strip():
+            self._add_text(b'\n')
+        self._flush()
+
+        columns = {}
+        for name, dtype in self.dtypes.items():
+            raw = self.directory / (name + '.raw')
+            output = np.lib.format.open_memmap(self.directory / (name + '.npy'), mode='w+', dtype=dtype, shape=(self.length,))
+            segments = self.segments[name] if dtype.kind in 'SU' else None
+            start = 0
+            with open(raw, 'rb') as f:
+                while start < self.length:
+                    if segments is not None:
+                        segment_dtype, count = segments.pop(0)
+                        segment_dtype = np.dtype(segment_dtype)
+                    else:
+                        segment_dtype, count = dtype, min(CONVERT_ROWS, self.length - start)
+                    output[start:start + count] = np.frombuffer(f.read(segment_dtype.itemsize * count), dtype=segment_dtype)
+                    start += count
+            output.flush()
+            del output
+            raw.unlink()
+
+            mask_raw = self.directory / (name + '.mask.raw')
+            np.save(self.directory / (name + '.mask.npy'), np.fromfile(mask_raw, dtype=bool))
+            mask_raw.unlink()
+            columns[name] = {'unit': None, 'description': None}
+
+        with open(self.directory / COLUMNS_FILE, 'w') as out:
+            json.dump({'columns': columns, 'length': self.length}, out, indent=1)
+
+    def discard(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,200 @@
+# PY SCRIPT TO BUILD A BINARY LOD OCTREE FOR RENDERABLEGAIASTARS
+#
+# RenderableGaiaStars can read its stars from a binary octree instead of a text
+# speck or csv file (FileReaderOption = "BinaryOctree"), which saves OpenSpace
+# from parsing millions of text rows at load time and lets it pick the nodes
+# to draw by level of detail.  This module builds that file offline from the
+# columns the `common` functions produce (x/y/z, u/v/w, absmag, color).
+#
+# The stars are read in chunks into a float32 scratch file, sorted by the
+# Morton (Z-order) code of their octree cell, and the tree is written in one
+# pre-order pass over the sorted stars, so memory use is a few arrays of one
+# number per star rather than the whole table.
+#
+# File layout (little-endian, as written by OpenSpace's OctreeManager):
+#   int32 values per star (8), int32 max stars per node, int32 max distance (kpc)
+#   then the 8 children of the root in pre-order, each node as
+#     bool is_leaf, int32 number of stars, int32 number of values,
+#     float32 positions (x y z per star, kpc), colors (absmag color per star),
+#     velocities (u v w per star)
+#   followed by the 8 children of every inner node.  Children are ordered by
+#   index = (x < center) + 2 (y < center) + 4 (z < center).  An inner node holds
+#   the brightest stars of its subtree as its level-of-detail sample.
+#
+# VERSIONS:
+#  1.0  BINARY OCTREE EXPORT
+
+
+import os
+import tempfile
+
+import numpy as np
+
+from common import file_functions
+from common import streaming
+
+
+
+# x, y, z (pc), absmag, color, u, v, w (km/s) - in the order of the values stored per star
+COLUMNS = ['x', 'y', 'z', 'absmag', 'color', 'u', 'v', 'w']
+VALUES_PER_STAR = 8
+
+MAX_STARS_PER_NODE = 2000
+
+# depth of the deepest nodes (the Morton codes have 3 bits per level)
+MAX_DEPTH = 16
+
+CHUNK_ROWS = 1000000
+
+
+
+# -----------------------------------------------------------------------------
+def write_octree(source, filename, columns=COLUMNS, max_stars_per_node=MAX_STARS_PER_NODE, max_dist=None, chunk_rows=CHUNK_ROWS, scratch_dir=None):
+    """
+    Build a level-of-detail octree of the stars in ``source`` and write it in the binary octree format
+    RenderableGaiaStars reads with ``FileReaderOption = "BinaryOctree"``.
+
+    Positions are converted from parsecs to kiloparsecs. Stars without a position are left out, and other
+    missing values are written as 0 (as in the speck files).
+
+    :param source: The data set: a Table, a FITS or csv file, or an iterable of Tables (see ``streaming.iter_table_chunks``).
+    :type source: Table, str, pathlib.Path or iterable
+    :param filename: Path of the octree file.
+    :type filename: str
+    :param columns: Names of the x, y, z (pc), absmag, color, u, v, w (km/s) columns, in that order.
+    :type columns: list of str
+    :param max_stars_per_node: Number of stars above which a node is split, and the size of the inner nodes' level-of-detail samples.
+    :type max_stars_per_node: int
+    :param max_dist: Half size of the root node in kpc. Defaults to the smallest whole number of kpc that holds every star.
+    :type max_dist: int
+    :param chunk_rows: Number of rows read at a time.
+    :type chunk_rows: int
+    :param scratch_dir: Directory for the scratch files (one float32 row and one Morton code per star). Defaults to the system temporary directory.
+    :type scratch_dir: str
+    :raises Exception: Raised if ``columns`` does not name eight columns.
+    :return: The number of stars written.
+    :rtype: int
+    """
+    if len(columns) != VALUES_PER_STAR:
+        raise Exception('octree.write_octree: columns must name x, y, z, absmag, color, u, v, w')
+
+    with tempfile.TemporaryDirectory(dir=scratch_dir) as scratch:
+        # pass 1: the stars as float32 rows in a scratch file
+        n_stars, extent = _write_stars(source, columns, chunk_rows, os.path.join(scratch, 'stars.bin'))
+        if max_dist is None:
+            max_dist = max(int(np.ceil(extent)), 1)
+        stars = _scratch_array(os.path.join(scratch, 'stars.bin'), 'r', n_stars)
+
+        # pass 2: Morton codes, and the stars in Morton order
+        codes = np.empty(n_stars, dtype=np.uint64)
+        for start in range(0, n_stars, chunk_rows):
+            codes[start:start + chunk_rows] = _morton_codes(stars[start:start + chunk_rows, :3], max_dist)
+        order = np.argsort(codes, kind='stable')
+        codes = codes[order]
+        sorted_stars = _scratch_array(os.path.join(scratch, 'sorted.bin'), 'w+', n_stars)
+        for start in range(0, n_stars, chunk_rows):
+            sorted_stars[start:start + chunk_rows] = stars[order[start:start + chunk_rows]]
+        del order, stars
+
+        # pass 3: write the tree
+        magnitudes = np.array(sorted_stars[:, 3])
+        with open(filename, 'wb') as out:
+            out.write(np.array([VALUES_PER_STAR, max_stars_per_node, max_dist], dtype='<i4').tobytes())
+            _write_children(out, sorted_stars, magnitudes, codes, 0, n_stars, 0, 0, max_stars_per_node)
+        del sorted_stars
+
+    return n_stars
+
+
+
+# -----------------------------------------------------------------------------
+def export_octree(metadata, source, columns=COLUMNS, path='/Milky Way/Stars', **kwargs):
+    """
+    Write ``fileroot.bin`` with :func:`write_octree` and a RenderableGaiaStars asset file that reads it.
+
+    :param metadata: A dataframe with metadata about the data set.
+    :type metadata: DataFrame
+    :param source: The data set, as for :func:`write_octree`.
+    :type source: Table, str, pathlib.Path or iterable
+    :param columns: Names of the x, y, z, absmag, color, u, v, w columns.
+    :type columns: list of str
+    :param path: GUI path of the asset.
+    :type path: str
+    :return: The number of stars written.
+    :rtype: int
+    """
+    n_stars = write_octree(source, metadata['fileroot'] + '.bin', columns=columns, **kwargs)
+    file_functions.generate_asset_file(metadata, RenderableType='RenderableGaiaStars', path=path, FileReaderOption='BinaryOctree', data_file=metadata['fileroot'] + '.bin')
+    return n_stars
+
+
+
+def _write_stars(source, columns, chunk_rows, filename):
+    # appends float32 rows (kpc positions, missing values as 0) to a scratch file; returns the number of
+    # stars and the largest absolute coordinate
+    n_stars = 0
+    extent = 0.0
+    with open(filename, 'wb') as out:
+        for chunk in streaming.iter_table_chunks(source, chunk_rows):
+            rows = np.empty((len(chunk), VALUES_PER_STAR), dtype='<f4')
+            for i, name in enumerate(columns):
+                values = np.ma.filled(np.ma.asarray(chunk[name], dtype=np.float64), np.nan)
+                if i < 3:
+                    values = values / 1000.0
+                else:
+                    values = np.where(np.isfinite(values), values, 0.0)
+                rows[:, i] = values
+            rows = rows[np.all(np.isfinite(rows[:, :3]), axis=1)]
+            if len(rows):
+                extent = max(extent, float(np.max(np.abs(rows[:, :3]))))
+            out.write(rows.tobytes())
+            n_stars += len(rows)
+    return n_stars, extent
+
+
+
+def _scratch_array(filename, mode, n_stars):
+    # float32 star rows memory-mapped from a scratch file (numpy can't map an empty file)
+    if n_stars == 0:
+        return np.zeros((0, VALUES_PER_STAR), dtype='<f4')
+    return np.memmap(filename, dtype='<f4', mode=mode, shape=(n_stars, VALUES_PER_STAR))
+
+
+
+def _morton_codes(positions, max_dist):
+    # Morton code of each star's cell at MAX_DEPTH; at every level the 3 bits are the child index,
+    # (x < center) + 2 (y < center) + 4 (z < center), so sorting by code gives the pre-order of the tree
+    cells = 2**MAX_DEPTH
+    codes = np.zeros(len(positions), dtype=np.uint64)
+    for axis in range(3):
+        cell = np.floor((positions[:, axis].astype(np.float64) + max_dist) / (2.0 * max_dist) * cells)
+        # flip so that a set bit means the lower half, as in the child index
+        cell = (cells - 1 - np.clip(cell, 0, cells - 1)).astype(np.uint64)
+        for level in range(MAX_DEPTH):
+            bit = (cell >> np.uint64(MAX_DEPTH - 1 - level)) & np.uint64(1)
+            codes |= bit << np.uint64(3 * (MAX_DEPTH - 1 - level) + axis)
+    return codes
+
+
+
+def _write_children(out, stars, magnitudes, codes, lo, hi, prefix, depth, max_stars_per_node):
+    # writes the 8 children of the node whose stars are stars[lo:hi] and whose code prefix is prefix at depth
+    shift = np.uint64(3 * (MAX_DEPTH - 1 - depth))
+    keys = codes[lo:hi] >> shift
+    bounds = lo + np.searchsorted(keys, np.uint64(prefix * 8) + np.arange(9, dtype=np.uint64))
+    for child in range(8):
+        start, stop = int(bounds[child]), int(bounds[child + 1])
+        n = stop - start
+        is_leaf = (n <= max_stars_per_node) or (depth + 1 == MAX_DEPTH)
+        if is_leaf:
+            node = np.asarray(stars[start:stop])
+        else:
+            # level-of-detail sample: the brightest stars of the subtree
+            brightest = start + np.argpartition(magnitudes[start:stop], max_stars_per_node)[:max_stars_per_node]
+            node = np.asarray(stars[brightest[np.argsort(magnitudes[brightest], kind='stable')]])
+        values = np.concatenate([node[:, :3].ravel(), node[:, 3:5].ravel(), node[:, 5:].ravel()])
+        out.write(np.array([is_leaf], dtype=np.bool_).tobytes())
+        out.write(np.array([len(node), len(values)], dtype='<i4').tobytes())
+        out.write(values.astype('<f4').tobytes())
+        if not is_leaf:
+            _write_children(out, stars, magnitudes, codes, start, stop, prefix * 8 + child, depth + 1, max_stars_per_node)
@@ -0,0 +1,177 @@
+# PY SCRIPT TO RUN ROW-WISE COMMON FUNCTIONS ON SEVERAL CORES
+#
+# calculations.get_distance, calculations.get_cartesian and the gaia_functions
+# column builders only ever look at one row at a time, so a table can be split
+# into row chunks and the chunks processed in parallel.  The input columns are
+# copied once into named shared memory, so the worker processes read them
+# without the table being pickled, and the new columns each worker builds are
+# reassembled in row order with their units and metadata.
+#
+# VERSIONS:
+#  1.0  PARALLEL CHUNK EXECUTOR
+
+
+import os
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+from astropy.table import Table, Column, MaskedColumn
+
+
+
+# column attributes carried over from the chunks to the reassembled columns
+COLUMN_ATTRIBUTES = ['unit', 'description', 'format', 'meta']
+
+# chunks per worker, so a slow chunk doesn't leave the other cores idle at the end
+CHUNKS_PER_WORKER = 4
+
+# shared input columns and their memory blocks, set in each worker by _attach_shared
+_shared = {}
+_shared_blocks = []
+
+
+
+# -----------------------------------------------------------------------------
+def run_parallel(data:Table, func, columns=None, n_workers=None, chunk_rows=None, **kwargs):
+    """
+    Run a row-wise ``common`` function on chunks of a table in parallel worker processes.
+
+    ``func`` is called as ``func(chunk, **kwargs)`` on row chunks of ``data`` and must add or replace
+    columns in place without adding or removing rows (e.g. ``calculations.get_cartesian``). The columns
+    it creates are concatenated in row order and added to ``data`` with the units, descriptions,
+    formats and meta of the chunk columns, so the result is the same as ``func(data, **kwargs)``.
+    For example::
+
+        parallel.run_parallel(data, calculations.get_cartesian, engine='numpy', radial_velocity='dr2_radial_velocity')
+
+    ``func`` and ``kwargs`` must be picklable (a module-level function, not a lambda).
+
+    :param data: An astropy table of the main data set.
+    :type data: Table
+    :param func: The function to run on each chunk.
+    :type func: callable
+    :param columns: Names of the input columns ``func`` needs. Defaults to every column of ``data``; listing only the needed ones saves shared memory.
+    :type columns: list of str
+    :param n_workers: Number of worker processes. Defaults to the number of cores.
+    :type n_workers: int
+    :param chunk_rows: Number of rows per chunk. Defaults to splitting the table into a few chunks per worker.
+    :type chunk_rows: int
+    :raises Exception: Raised if a column is not in ``data`` or cannot be placed in shared memory, or if ``func`` changes the number of rows.
+    """
+    if columns is None:
+        columns = data.colnames
+    for name in columns:
+        if name not in data.colnames:
+            raise Exception('parallel.run_parallel: \'' + name + '\' not found in table')
+        if data[name].dtype.kind == 'O':
+            raise Exception('parallel.run_parallel: object column \'' + name + '\' cannot be placed in shared memory')
+
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    if chunk_rows is None:
+        chunk_rows = max(-(-len(data) // (n_workers * CHUNKS_PER_WORKER)), 1)
+    bounds = [(start, min(start + chunk_rows, len(data))) for start in range(0, len(data), chunk_rows)]
+
+    blocks = []
+    try:
+        # copy each input column (and its mask) into a named shared memory block
+        layout = {}
+        for name in columns:
+            column = data[name]
+            values = to_shared(np.ma.getdata(column), blocks)
+            mask = to_shared(np.ma.getmaskarray(column), blocks) if isinstance(column, MaskedColumn) else None
+            attributes = {attribute: getattr(column, attribute) for attribute in COLUMN_ATTRIBUTES}
+            layout[name] = (values, mask, attributes)
+
+        with multiprocessing.Pool(n_workers, initializer=_attach_shared, initargs=(layout,)) as pool:
+            results = pool.starmap(_run_chunk, [(func, start, stop, kwargs) for start, stop in bounds])
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    # reassemble the new columns in row order, taking the metadata from the first chunk
+    if not results:
+        return
+    for name, (values, mask, attributes) in results[0].items():
+        values = np.concatenate([result[name][0] for result in results])
+        if all(result[name][1] is None for result in results):
+            data[name] = Column(data=values, **attributes)
+        else:
+            mask = np.concatenate([np.zeros(len(result[name][0]), dtype=bool) if result[name][1] is None else result[name][1] for result in results])
+            data[name] = MaskedColumn(data=values, mask=mask, **attributes)
+
+
+
+# -----------------------------------------------------------------------------
+def to_shared(array, blocks):
+    """
+    Copy an array into a new named shared memory block.
+
+    The block is appended to ``blocks``; the caller closes and unlinks it once the workers are done.
+
+    :param array: The array to share.
+    :type array: numpy.ndarray
+    :param blocks: Shared memory blocks created so far.
+    :type blocks: list of multiprocessing.shared_memory.SharedMemory
+    :return: A picklable description of the shared array (block name, dtype, shape) for :func:`from_shared`.
+    :rtype: tuple
+    """
+    array = np.ascontiguousarray(array)
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    blocks.append(block)
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return (block.name, array.dtype, array.shape)
+
+
+
+def _attach_shared(layout):
+    # runs once in each worker: attach to the shared blocks and keep array views on them
+    _shared.clear()
+    _shared_blocks.clear()
+    for name, (values, mask, attributes) in layout.items():
+        _shared[name] = (from_shared(values), None if mask is None else from_shared(mask), attributes)
+
+
+
+# -----------------------------------------------------------------------------
+def from_shared(description):
+    """
+    Attach to an array shared with :func:`to_shared` (in a worker process) and return a view on it.
+    """
+    block_name, dtype, shape = description
+    block = shared_memory.SharedMemory(name=block_name)
+    # keep a reference to the block so its buffer stays mapped for the life of the worker
+    _shared_blocks.append(block)
+    return np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+
+def _run_chunk(func, start, stop, kwargs):
+    # build a Table over the shared rows [start, stop) and run func on it
+    chunk = Table()
+    for name, (values, mask, attributes) in _shared.items():
+        if mask is None:
+            chunk[name] = Column(data=values[start:stop], copy=True, **attributes)
+        else:
+            chunk[name] = MaskedColumn(data=values[start:stop], mask=mask[start:stop], copy=True, **attributes)
+    input_names = set(chunk.colnames)
+    n_rows = len(chunk)
+    inputs = {name: chunk[name] for name in input_names}
+
+    func(chunk, **kwargs)
+
+    if len(chunk) != n_rows:
+        raise Exception('parallel.run_parallel: ' + getattr(func, '__name__', 'func') + ' changed the number of rows')
+
+    # return the columns func added or replaced, as plain arrays plus masks and attributes
+    results = {}
+    for name in chunk.colnames:
+        column = chunk[name]
+        if name in input_names and column is inputs[name]:
+            continue
+        mask = np.ma.getmaskarray(column) if isinstance(column, MaskedColumn) else None
+        attributes = {attribute: getattr(column, attribute) for attribute in COLUMN_ATTRIBUTES}
+        results[name] = (np.asarray(np.ma.getdata(column)), mask, attributes)
+    return results
@@ -0,0 +1,240 @@
+# PY SCRIPT TO RUN THE COMMON PROCESSING STAGES OUT-OF-CORE
+#
+# Reads an input catalog in row chunks, pushes each chunk through the same
+# `common` stages the notebooks use (set_bj_distance, get_distance, photometry,
+# get_cartesian, ...) and appends the result to the csv/speck/label outputs.
+# Peak memory is set by the chunk size instead of the size of the catalog, and
+# the files are byte-identical to running the stages on the whole table and
+# calling file_functions.to_csv/to_speck/to_label.
+#
+# VERSIONS:
+#  1.0  STREAMING PIPELINE MODE
+
+
+import sys
+from pathlib import Path
+
+import numpy as np
+from astropy.io import ascii
+from astropy.table import Table
+
+sys.path.insert(0, '..')
+from common import file_functions
+
+
+
+# rough multiple of a processed chunk's column bytes needed while writing it out
+# (the pandas copy plus the formatted text for each output)
+WRITE_OVERHEAD = 4
+
+# number of rows used to measure the processed row size when sizing chunks from a memory budget
+PROBE_ROWS = 1000
+
+
+
+# -----------------------------------------------------------------------------
+def iter_table_chunks(source, chunk_rows, units=None):
+    """
+    Yield consecutive row chunks of an input catalog as astropy Tables.
+
+    FITS files are memory-mapped and sliced, csv files are read with astropy's chunked fast reader
+    (so masks come out the same as with ``Table.read``), and an in-memory Table is sliced directly.
+    Any other iterable of Tables is passed through as is. Other file formats (e.g. VOTable) have no
+    chunked reader and are read whole, so convert those to FITS or csv first for bounded memory.
+
+    :param source: A path to the input file, an astropy Table, or an iterable of Tables.
+    :type source: str, pathlib.Path, Table or iterable
+    :param chunk_rows: Number of rows per chunk (approximate for csv input, which is chunked by bytes).
+    :type chunk_rows: int
+    :param units: Optional dictionary of column name to unit, applied to every chunk (csv files have no units).
+    :type units: dict
+    """
+    if isinstance(source, (str, Path)):
+        path = Path(source)
+        file_functions.test_input_file(path)
+        suffix = path.suffix.lower()
+
+        if suffix in ('.fits', '.fit'):
+            chunks = (_mask_invalid(chunk) for chunk in _slice_chunks(Table.read(path, memmap=True), chunk_rows))
+        elif suffix == '.csv':
+            chunks = _csv_chunks(path, chunk_rows)
+        else:
+            chunks = _slice_chunks(Table.read(path), chunk_rows)
+    elif isinstance(source, Table):
+        chunks = _slice_chunks(source, chunk_rows)
+    else:
+        chunks = iter(source)
+
+    for chunk in chunks:
+        if units is not None:
+            for name, unit in units.items():
+                chunk[name].unit = unit
+        yield chunk
+
+
+
+def _slice_chunks(table, chunk_rows):
+    for start in range(0, len(table), chunk_rows):
+        # copy so the stages add columns to this chunk only (and memory-mapped pages can be released)
+        yield Table(table[start:start + chunk_rows], copy=True)
+
+
+
+def _mask_invalid(table):
+    # astropy skips its NaN / empty string masking for memory-mapped FITS, so do it per chunk instead
+    # to get the same masks as Table.read(path)
+    for name in table.colnames:
+        column = table[name]
+        if column.dtype.kind == 'f':
+            invalid = np.isnan(column)
+        elif column.dtype.kind in 'SU':
+            invalid = column == column.dtype.type()
+        else:
+            continue
+        if np.any(invalid):
+            table[name] = table.MaskedColumn(column, mask=invalid | np.ma.getmaskarray(column), copy=False)
+    return table
+
+
+
+def _csv_chunks(path, chunk_rows):
+    # the fast reader chunks by bytes, so convert rows to bytes with the line length of the first rows
+    with open(path, 'rb') as f:
+        sample = f.read(1 << 20)
+    line_bytes = max(len(sample) / max(sample.count(b'\n'), 1), 1)
+    chunk_size = int(max(chunk_rows * line_bytes, 1 << 16))
+    return ascii.read(str(path), format='csv', guess=False,
+                      fast_reader={'chunk_size': chunk_size, 'chunk_generator': True})
+
+
+
+# -----------------------------------------------------------------------------
+def rows_for_memory(table, stages, max_memory_mb):
+    """
+    Choose a chunk size so that processing and writing one chunk stays within a memory budget.
+
+    A small probe of ``table`` is run through ``stages`` and the size of the processed rows is measured.
+
+    :param table: A Table (or the first chunk) of the input catalog.
+    :type table: Table
+    :param stages: The processing stages, as for :func:`stream_to_files`.
+    :type stages: list of callables
+    :param max_memory_mb: Memory budget in megabytes.
+    :type max_memory_mb: float
+    :return: Number of rows per chunk (at least 1).
+    :rtype: int
+    """
+    probe = Table(table[:PROBE_ROWS], copy=True)
+    run_stages(probe, stages)
+    row_bytes = max(sum(probe[name].nbytes for name in probe.colnames) / max(len(probe), 1), 1)
+    return max(int(max_memory_mb * 2**20 / (row_bytes * WRITE_OVERHEAD)), 1)
+
+
+
+# -----------------------------------------------------------------------------
+def run_stages(table, stages):
+    """
+    Run processing stages on a table.
+
+    Each stage is called with the table and should add or modify columns in place (like the functions in
+    ``calculations`` and ``gaia_functions``). A stage may instead return a new Table, e.g. to remove rows,
+    which is then passed on to the next stage.
+
+    :param table: An astropy table (usually one chunk of the data set).
+    :type table: Table
+    :param stages: Callables taking a Table; use ``functools.partial`` or a lambda to set arguments.
+    :type stages: list of callables
+    :return: The processed table.
+    :rtype: Table
+    """
+    for stage in stages:
+        result = stage(table)
+        if isinstance(result, Table):
+            table = result
+    return table
+
+
+
+# -----------------------------------------------------------------------------
+def stream_to_files(source, metadata, stages, columns, chunk_rows=None, max_memory_mb=1024, formats=('csv', 'speck', 'label'), units=None, compression=None):
+    """
+    Process a catalog in row chunks and append each chunk to the OpenSpace output files.
+
+    The same stages and columns used in a notebook produce the same .csv, .speck and .label files as
+    running the stages on the whole table and calling ``file_functions.to_csv``, ``to_speck`` and
+    ``to_label``, but only one chunk is held in memory at a time. For example::
+
+        stages = [gaia_functions.set_bj_distance,
+                  lambda t: calculations.get_distance(t, dist='bj_distance', use='distance'),
+                  lambda t: t[t['dist_pc'] > 0],
+                  gaia_functions.get_photometry,
+                  lambda t: calculations.get_cartesian(t, engine='numpy'),
+                  ...]
+        streaming.stream_to_files('raw_data/result.fits', metadata, stages, columns=[...], max_memory_mb=2048)
+
+    :param source: The input catalog, as for :func:`iter_table_chunks`.
+    :type source: str, pathlib.Path, Table or iterable
+    :param metadata: A dataframe with metadata about the data set.
+    :type metadata: DataFrame
+    :param stages: Processing stages, as for :func:`run_stages`.
+    :type stages: list of callables
+    :param columns: Names of the columns to write, in order (as passed to ``file_functions.get_metadata``).
+    :type columns: list of str
+    :param chunk_rows: Number of rows per chunk. If not given, it is chosen from ``max_memory_mb``.
+    :type chunk_rows: int
+    :param max_memory_mb: Memory budget in megabytes for one chunk, used when ``chunk_rows`` is not given.
+    :type max_memory_mb: float
+    :param formats: Which of 'csv', 'speck' and 'label' to write.
+    :type formats: tuple of str
+    :param units: Optional dictionary of column name to unit, applied to every input chunk.
+    :type units: dict
+    :param compression: Optionally compress the files on the fly: 'gzip' or 'zstd' (see ``file_functions.open_output``).
+    :type compression: str
+    :return: The column metadata (from ``file_functions.get_metadata``) of the written columns.
+    :rtype: DataFrame
+    """
+    if chunk_rows is None:
+        if isinstance(source, Table):
+            chunk_rows = rows_for_memory(source, stages, max_memory_mb)
+        else:
+            probe = next(iter_table_chunks(source, PROBE_ROWS, units=units))
+            chunk_rows = rows_for_memory(probe, stages, max_memory_mb)
+
+    writers = {'csv': (file_functions.write_csv_header, file_functions.write_csv_rows),
+               'speck': (file_functions.write_speck_header, file_functions.write_speck_rows),
+               'label': (None, None)}
+    for fmt in formats:
+        if fmt not in writers:
+            raise Exception('streaming.stream_to_files: format must be csv, speck or label, not \'' + fmt + '\'')
+
+    outs = {}
+    column_metadata = None
+    try:
+        for chunk in iter_table_chunks(source, chunk_rows, units=units):
+            chunk = run_stages(chunk, stages)
+
+            # headers are written from the first chunk, which has the same column metadata as every other one
+            if column_metadata is None:
+                column_metadata = file_functions.get_metadata(chunk, columns)
+                for fmt in formats:
+                    outs[fmt] = file_functions.open_output(metadata['fileroot'] + '.' + fmt, compression)
+                    if fmt == 'label':
+                        file_functions.write_header(metadata, outs[fmt])
+                    else:
+                        writers[fmt][0](metadata, column_metadata, outs[fmt])
+
+            df = Table.to_pandas(chunk)
+            for fmt in formats:
+                if fmt == 'label':
+                    file_functions.write_label_rows(df, outs[fmt])
+                else:
+                    writers[fmt][1](df, column_metadata, outs[fmt])
+
+        # Trailing newline, as in the in-memory writers
+        for out in outs.values():
+            out.write('\n')
+    finally:
+        for out in outs.values():
+            out.close()
+
+    return column_metadata
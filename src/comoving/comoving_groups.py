@@ -0,0 +1,171 @@
+# PY SCRIPT FOR A GROUP CATALOG OF THE COMOVING STAR CANDIDATES
+#
+# find_binaries_edr3.py keeps only the isolated pairs: a star with two
+# companions (a triple, a higher multiple or a small moving group) is thrown
+# away with all its pairs.  This module keeps them instead.  The candidate
+# pairs are the edges of a graph on the stars, and every connected component
+# of that graph is a group: an isolated binary is a group of 2, a triple a
+# group of 3, and so on.
+#
+# connected_components is a union-find over the edge list done with whole-
+# array operations: every round links the root of each edge's larger star to
+# the root of its smaller one and then halves the paths to the roots until
+# every star points at its root.  The number of rounds grows with the log of
+# the group size, so tens of millions of edges take a few passes over the
+# arrays.  group_catalog then sums the columns of each group with bincount.
+#
+# VERSIONS:
+#  1.0  UNION-FIND GROUP CATALOG
+
+
+import numpy as np
+from astropy.table import Table
+
+
+
+# km/s per (mas/yr) per (1/kpc) - the tangential velocity of a proper motion at a distance
+KMS_PER_MASYR_KPC = 4.74047
+
+
+
+# -----------------------------------------------------------------------------
+def connected_components(star1s, star2s, n_stars):
+    """
+    Group the stars joined by a chain of pairs, as the connected components of the pair graph.
+
+    Groups are numbered from 0 in the order of their smallest row. Stars in no pair have no group (-1).
+    For example::
+
+        group = comoving_groups.connected_components(star1s, star2s, len(tab))
+
+    :param star1s: Rows of star 1 of each pair.
+    :type star1s: numpy.ndarray
+    :param star2s: Rows of star 2 of each pair.
+    :type star2s: numpy.ndarray
+    :param n_stars: Number of rows the pairs index.
+    :type n_stars: int
+    :return: The group of each row, or -1.
+    :rtype: numpy.ndarray
+    """
+    star1s, star2s = np.asarray(star1s, dtype=np.int64), np.asarray(star2s, dtype=np.int64)
+    group = np.full(n_stars, -1, dtype=np.int64)
+    if len(star1s) == 0:
+        return group
+
+    # work on the stars that are in a pair, numbered 0 to n-1 in row order
+    rows, edges = np.unique(np.concatenate([star1s, star2s]), return_inverse=True)
+    first, second = edges[:len(star1s)], edges[len(star1s):]
+
+    parent = np.arange(len(rows), dtype=np.int64)
+    while True:
+        root1, root2 = parent[first], parent[second]
+        linked = root1 != root2
+        if not np.any(linked):
+            break
+        # link the larger root of every edge to the smaller one; a root always points at a smaller star,
+        # so no loop can form, and when several edges link the same root the smallest one wins
+        root1, root2 = root1[linked], root2[linked]
+        np.minimum.at(parent, np.maximum(root1, root2), np.minimum(root1, root2))
+        _compress(parent)
+        # edges within a group are done
+        first, second = first[linked], second[linked]
+
+    # number the groups by their smallest star, which is the root
+    roots, labels = np.unique(parent, return_inverse=True)
+    group[rows] = labels
+    return group
+
+
+
+def _compress(parent):
+    # point every star straight at its root by repeated path halving
+    while True:
+        grandparent = parent[parent]
+        if np.array_equal(grandparent, parent):
+            return
+        parent[:] = grandparent
+
+
+
+# -----------------------------------------------------------------------------
+def group_catalog(group, star1s, star2s, ra, dec, parallax, pmra, pmdec):
+    """
+    Size and centroid statistics of each group of :func:`connected_components`.
+
+    The centroid position is the direction of the mean unit vector of the stars, and the parallax and proper
+    motions are plain means. ``radius_pc`` is the rms projected distance of the stars from the centroid, and
+    ``dispersion_kms`` the rms plane-of-sky velocity about the mean proper motion, both at the mean parallax.
+
+    :param group: The group of each row, or -1.
+    :type group: numpy.ndarray
+    :param star1s: Rows of star 1 of each pair.
+    :type star1s: numpy.ndarray
+    :param star2s: Rows of star 2 of each pair.
+    :type star2s: numpy.ndarray
+    :param ra: Right ascension of each row (deg).
+    :type ra: numpy.ndarray
+    :param dec: Declination of each row (deg).
+    :type dec: numpy.ndarray
+    :param parallax: Parallax of each row (mas).
+    :type parallax: numpy.ndarray
+    :param pmra: Proper motion in RA of each row (mas/yr).
+    :type pmra: numpy.ndarray
+    :param pmdec: Proper motion in Dec of each row (mas/yr).
+    :type pmdec: numpy.ndarray
+    :return: One row per group: group_id, n_stars, n_pairs, ra, dec, parallax, pmra, pmdec, radius_pc, dispersion_kms.
+    :rtype: astropy.table.Table
+    """
+    rows = np.flatnonzero(group >= 0)
+    member = group[rows]
+    n_groups = int(member.max()) + 1 if len(member) else 0
+    n_stars = np.bincount(member, minlength=n_groups)
+
+    def mean(values):
+        return np.bincount(member, weights=values, minlength=n_groups)/np.maximum(n_stars, 1)
+
+    ra_rad, dec_rad = np.deg2rad(ra[rows]), np.deg2rad(dec[rows])
+    x, y, z = np.cos(dec_rad)*np.cos(ra_rad), np.cos(dec_rad)*np.sin(ra_rad), np.sin(dec_rad)
+    mean_x, mean_y, mean_z = mean(x), mean(y), mean(z)
+    norm = np.sqrt(mean_x**2 + mean_y**2 + mean_z**2)
+
+    mean_parallax, mean_pmra, mean_pmdec = mean(parallax[rows]), mean(pmra[rows]), mean(pmdec[rows])
+    # angle of each star from its group's centroid, from the chord to the centroid's direction
+    chord2 = (x - mean_x[member]/norm[member])**2 + (y - mean_y[member]/norm[member])**2 + (z - mean_z[member]/norm[member])**2
+    theta = 2*np.arcsin(np.minimum(np.sqrt(chord2)/2, 1))
+    dpm2 = (pmra[rows] - mean_pmra[member])**2 + (pmdec[rows] - mean_pmdec[member])**2
+
+    groups = Table()
+    groups['group_id'] = np.arange(n_groups, dtype=np.int64)
+    groups['n_stars'] = n_stars
+    groups['n_pairs'] = np.bincount(group[star1s], minlength=n_groups)
+    groups['ra'] = np.mod(np.rad2deg(np.arctan2(mean_y, mean_x)), 360)
+    groups['dec'] = np.rad2deg(np.arcsin(np.clip(mean_z/norm, -1, 1)))
+    groups['parallax'] = mean_parallax
+    groups['pmra'] = mean_pmra
+    groups['pmdec'] = mean_pmdec
+    groups['radius_pc'] = np.sqrt(mean(theta**2))*1000/mean_parallax
+    groups['dispersion_kms'] = np.sqrt(mean(dpm2))*KMS_PER_MASYR_KPC/mean_parallax
+    return groups
+
+
+
+def group_members(group, source_id):
+    """
+    The stars that are in a group: source_id, group_id and group_size of each.
+
+    :param group: The group of each row, or -1.
+    :type group: numpy.ndarray
+    :param source_id: source_id of each row.
+    :type source_id: numpy.ndarray
+    :return: One row per star in a group, in row order.
+    :rtype: astropy.table.Table
+    """
+    rows = np.flatnonzero(group >= 0)
+    member = group[rows]
+    sizes = np.bincount(member)
+
+    members = Table()
+    members['source_id'] = source_id[rows]
+    members['group_id'] = member
+    members['group_size'] = sizes[member]
+    return members
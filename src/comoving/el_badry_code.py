@@ -5,9 +5,16 @@
 
 
 from astropy.table import Table
-import multiprocessing, psutil
-from sklearn.neighbors import BallTree
+#sky-neighbor trees: a KD-tree of unit vectors finds the same neighbors as sklearn's haversine BallTree, faster
+import sky_tree
+tree_backend = 'unit_vector' # 'haversine' for the BallTree
 import numpy as np
+#pair cuts for a whole block of stars at once, instead of a python loop over the stars
+import pair_search
+#one neighbor list out to 5 pc, made by the num_neighbors code and filtered by the find_binaries code instead of building new trees
+import neighbor_cache
+#groups of comoving stars (binaries, triples, higher multiples, small moving groups) from the candidate pairs
+import comoving_groups
 
 #defining important functions
 
@@ -123,49 +130,25 @@ ra, dec, pmra, pmdec, parallax, parallax_error, pmra_error, pmdec_error, G = fet
 s_max_cluster = 206265*size_max_pc
 theta_max_radians = s_max_cluster/(1000/parallax)/3600 * np.pi/180
 coords = np.vstack([dec*np.pi/180, ra*np.pi/180,]).T
-tree = BallTree(coords[G < 18], leaf_size = 10, metric = 'haversine') # build tree of all stars brighter than 18
+# build a tree of all stars (not only those brighter than 18: find_binaries_edr3.py reuses the neighbor list for its fainter companions)
+tree = sky_tree.make_tree(coords, leaf_size = 10, backend = tree_backend)
 
-# data for stars brighter than G = 18
-ra_b, dec_b, pmra_b, pmdec_b, parallax_b, parallax_error_b, pmra_error_b, pmdec_error_b, G_b = ra[G < 18], dec[G < 18], pmra[G < 18], pmdec[G < 18], parallax[G < 18], parallax_error[G < 18], pmra_error[G < 18], pmdec_error[G < 18], G[G < 18]
+# astrometry columns of all stars, for the vectorized neighbor cuts
+stars = {'parallax': parallax, 'parallax_error': parallax_error, 'pmra': pmra, 'pmdec': pmdec, 'pmra_error': pmra_error, 'pmdec_error': pmdec_error}
 
-Nblock = 20000 # how many stars to process at once per core
-Nmax = len(coords)//Nblock + 1 
+Nblock = 20000 # most stars to process at once per core; blocks are cut smaller where the sky is dense, to even out their cost
+cache_dir = 'neighbor_cache_edr3' # the neighbor list is saved here; each finished block is kept until it is complete, so a rerun after a crash only computes the missing blocks
 sigma_cut = 2 # how many sigma tolerance 
-def query_this_j(j):
-    '''
-    function to pass to multiprocessing pool. deal with Nblock stars. 
-    '''
-    # see how far along we are and make sure we aren't running out of memory.
-    print(j, j*Nblock/len(coords),  psutil.virtual_memory().percent)
 
-    # find the stars in this block
-    msk = (np.arange(len(coords)) >= int(j*Nblock)) & (np.arange(len(coords)) < int((j+1)*Nblock))
-    
-    # find their companions and angular distances
-    these_inds, these_dists = tree.query_radius(coords[msk], r = theta_max_radians[msk], return_distance = True)      
-    
-    # copy astrometry of stars in this block  
-    parallax_, parallax_error_, pmra_, pmra_error_, pmdec_, pmdec_error_ = parallax[msk], parallax_error[msk], pmra[msk], pmra_error[msk], pmdec[msk], pmdec_error[msk] 
-
-    # for each star, see how many of the companions within 5 pc (projected) have consistent parallax and similar proper motion 
-    N_neighbors = np.zeros(len(parallax_))
-    for i, idxs in enumerate(these_inds):
-        thetas_arcsec = these_dists[i]*180/np.pi*3600
-        d_par_over_sigma = np.abs(parallax_[i] - parallax_b[idxs])/np.sqrt(parallax_error_[i]**2 + parallax_error_b[idxs]**2)
-        delta_mu, sigma_delta_mu = get_delta_mu_and_sigma(pmra1 = pmra_[i], pmdec1 = pmdec_[i], 
-            pmra2 = pmra_b[idxs], pmdec2 = pmdec_b[idxs], pmra_error1 = pmra_error_[i], 
-            pmdec_error1 = pmdec_error_[i], pmra_error2 = pmra_error_b[idxs], 
-            pmdec_error2 = pmdec_error_b[idxs])
-            
-        mu_max = 0.21095*dispersion_max_kms*parallax_[i]            
-        neighbors = (delta_mu < mu_max + sigma_cut*sigma_delta_mu) & (d_par_over_sigma < sigma_cut) & (thetas_arcsec > 1e-3) # theta > 1e-3 arcsec to make sure you don't count yourself as a neighbor
-        N_neighbors[i] = np.sum(neighbors) 
-    return N_neighbors
-
-pool = multiprocessing.Pool(multiprocessing.cpu_count())
-all_result = pool.map(query_this_j,  np.arange(Nmax))
-pool.close()
-N_neighbors = np.concatenate(all_result)
+# find every star within 5 pc (projected) of each star once, on workers that map the tree from shared memory, 
+# most expensive blocks of up to Nblock stars first (see neighbor_cache.build and pair_search.query_neighbors)
+cache = neighbor_cache.build(tree, coords, theta_max_radians, cache_dir, block_rows = Nblock)
+del tree
+
+# for each star, count how many of the companions brighter than 18 within 5 pc (projected) have consistent parallax and similar proper motion,
+# on workers that map the neighbor list, in blocks of up to Nblock stars cut by their number of neighbors (see neighbor_cache.count_neighbors)
+N_neighbors = neighbor_cache.count_neighbors(cache, theta_max_radians, stars, neighbor_mask = G < 18, block_rows = Nblock, 
+    sigma_cut = sigma_cut, dispersion_max_kms = dispersion_max_kms)
 
 # save these for later
 np.savez('neighbor_counts_edr3_all.npz', source_id = fetch_table_element('source_id', tab), N_neighbors = N_neighbors)
@@ -185,7 +168,7 @@ np.savez('neighbor_counts_edr3_all.npz', source_id = fetch_table_element('source
 
 #First run the ADQL query in the paper. Save the output to edr3_parallax_snr5_goodG.fits.gz. If you want to save space, you don't need to download all columns of the Gaia source catalog. You could download only the following columns, and query the remaining columns, for binary candidates only, at the end: source_id, ra, dec, parallax, parallax_error, pmra, pmdec, pmra_error, pmdec_error, phot_g_mean_mag
 
-#Then run num_neighbors_edr3.py to generate the file neighbor_counts_edr3_all.npz. You'll need the functions defined in the bottom half of this file to run it. 
+#Then run num_neighbors_edr3.py to generate the file neighbor_counts_edr3_all.npz (and the neighbor list in neighbor_cache_edr3/, which this file filters instead of building its own trees). You'll need the functions defined in the bottom half of this file to run it. 
 
 #Then import the helper functions in the bottom half of this file (e.g. fetch_table_element() and the functions below). Finally, run the top half of the file. On a 20-core node, it runs in about 20 minutes. 
 
@@ -199,77 +182,59 @@ tab = Table.read('raw_data/edr3_parallax_snr5_goodG.csv')  # 64407853 elements
 # remove stars that have too many neighbors, as defined in section 2.1 
 # if you want to look at the "initial candidates" sample, including clusters, comment this out. 
 tmp = np.load('neighbor_counts_edr3_all.npz')
-crowded = np.in1d(fetch_table_element('source_id', tab),  tmp['source_id'][tmp['N_neighbors'] > 30]); tmp.close()
-tab = tab[~crowded] # 57889221 stars survive 
-
+crowded = np.isin(fetch_table_element('source_id', tab),  tmp['source_id'][tmp['N_neighbors'] > 30]); tmp.close()
+uncrowded = np.flatnonzero(~crowded) # rows of the stars that survive in the full table (and the neighbor list)
 
+# the neighbor list is of the full table, so search it before the crowded stars are removed
 source_id, ra, dec, G, parallax, parallax_error, pmra, pmdec, pmra_error, pmdec_error  = fetch_table_element(['source_id', 'ra', 'dec', 'phot_g_mean_mag', 'parallax', 'parallax_error', 'pmra', 'pmdec', 'pmra_error', 'pmdec_error'], tab)
 
 s_max_au = 3600*180/np.pi # 206265 au = 1 pc
 theta_max_radians = s_max_au/(1000/parallax)/3600 * np.pi/180 # angular separation corresponding to s = 1 pc
 coords = np.vstack([ dec*np.pi/180, ra*np.pi/180]).T
-tree = BallTree(coords, leaf_size = 20, metric = 'haversine')
-print('built tree') 
+cache_dir = 'neighbor_cache_edr3' # made by num_neighbors_edr3.py, with every star within 5 pc of each star
+cache = neighbor_cache.load(cache_dir, coords)
+print('loaded neighbor list') 
 
+# astrometry columns of the full table for the vectorized pair cuts
+stars = {'parallax': parallax, 'parallax_error': parallax_error, 'pmra': pmra, 'pmdec': pmdec, 'pmra_error': pmra_error, 'pmdec_error': pmdec_error, 'phot_g_mean_mag': G}
 
-Nblock = 200000 # how many stars to process at once
-Nmax = (len(coords)-1)//Nblock + 1 # how many blocks total
-all_indices = np.arange(len(coords))
-def query_this_j(j):
-    '''
-    function to pass to multiprocessing pool. deal Nblock stars. 
-    '''
-    # see how far along we are and make sure we aren't running out of memory.
-    print(j, j*Nblock/len(coords),  psutil.virtual_memory().percent) 
-    
-    # find the stars in this block
-    msk = (all_indices >= int(j*Nblock)) & (all_indices < int((j+1)*Nblock))
-    these_nums = all_indices[msk]
-    
-    # find possible companions and their angular separations. 
-    these_inds, these_dists = tree.query_radius(coords[msk], r = theta_max_radians[msk], return_distance = True)
 
-    # astrometry for stars in this block 
-    parallax_block, parallax_error_block, pmra_block, pmra_error_block, pmdec_block, pmdec_error_block, G_block = parallax[msk], parallax_error[msk], pmra[msk], pmra_error[msk], pmdec[msk], pmdec_error[msk], G[msk]
-    
-    # loop through possible companions and see if they pass parallax and proper motion cuts. 
-    these_star1s, these_star2s = [], [] # to hold indices of pairs that do pass cuts. 
-    for i, idxs in enumerate(these_inds):
-        thetas_arcsec = these_dists[i]*180/np.pi*3600
-        brighter_parallax = np.copy(parallax[idxs]) 
-        brighter_parallax[G[idxs] > G_block[i]] = parallax_block[i] # parallax of the brighter component 
-    
-        d_par_over_sigma = np.abs(parallax_block[i] - parallax[idxs])/np.sqrt(parallax_error_block[i]**2 + parallax_error[idxs]**2)
-        delta_mu, sigma_delta_mu = get_delta_mu_and_sigma(pmra1 = pmra_block[i], pmdec1 = pmdec_block[i], 
-            pmra2 = pmra[idxs], pmdec2 = pmdec[idxs], pmra_error1 = pmra_error_block[i], 
-            pmdec_error1 = pmdec_error_block[i], pmra_error2 = pmra_error[idxs], pmdec_error2 = pmdec_error[idxs])
-        
-        # avoid divided-by-zero warnings when calculating delta_mu_orbit for theta = 0 (pairing star with itself)
-        delta_mu_orbit = np.zeros(len(thetas_arcsec))
-        mm = thetas_arcsec == 0
-        delta_mu_orbit[mm] = 1e9
-        delta_mu_orbit[~mm] = 0.44428*brighter_parallax[~mm]**(3/2)*thetas_arcsec[~mm]**(-1/2)
-        sep_AU = 1000/brighter_parallax * thetas_arcsec
-        
-        # b = 3 at theta > 4 arcsec; b = 6 at theta < 4 arcsec
-        max_parallax_diff = np.ones(len(thetas_arcsec))*parallax_sigma_limit
-        max_parallax_diff[thetas_arcsec < theta_arcsec_min] = 2*parallax_sigma_limit
-        
-        # Enforce the parllax and proper motion cuts. Theta > 0 means: don't get paired with yourself
-        m = (d_par_over_sigma < max_parallax_diff) & (delta_mu < delta_mu_orbit + 2*sigma_delta_mu) & (thetas_arcsec > 0.001) & (sep_AU < s_max_au) 
-        if np.sum(m):
-            for k in range(np.sum(m)):
-                these_star1s.append(these_nums[i])
-                these_star2s.append(idxs[m][k])
-    return these_star1s, these_star2s
-    
-# run on everything (takes ~15 minutes)
-pool = multiprocessing.Pool(multiprocessing.cpu_count())
-all_result = pool.map(query_this_j,  np.arange(Nmax)); pool.close()
+Nblock = 200000 # most stars to process at once per core
 
-star1s, star2s = np.concatenate(np.array(all_result).T[0]),  np.concatenate(np.array(all_result).T[1])
+# run on everything
+# the neighbors within 1 pc of each uncrowded star, among the uncrowded stars, that pass the parallax and proper motion cuts 
+# on workers that map the neighbor list, in blocks of up to Nblock stars cut by their number of neighbors (see neighbor_cache.find_pairs) 
+star1s, star2s = neighbor_cache.find_pairs(cache, theta_max_radians[uncrowded], stars, rows = uncrowded, neighbor_mask = ~crowded, block_rows = Nblock, 
+    parallax_sigma_limit = parallax_sigma_limit, theta_arcsec_min = theta_arcsec_min, s_max_au = s_max_au)
 print(f'total length of catalog is {len(star1s)}')
 
+# now remove the crowded stars, and number the pairs' stars by their rows in what is left
+tab = tab[~crowded] # 57889221 stars survive 
+star1s, star2s = np.searchsorted(uncrowded, star1s), np.searchsorted(uncrowded, star2s)
+source_id, ra, dec, G, parallax, parallax_error, pmra, pmdec, pmra_error, pmdec_error  = fetch_table_element(['source_id', 'ra', 'dec', 'phot_g_mean_mag', 'parallax', 'parallax_error', 'pmra', 'pmdec', 'pmra_error', 'pmdec_error'], tab)
+
+# remove duplicates (pairs where star 1 and star 2 are switched), on int64 keys of the row numbers instead of source_id strings
+unique = pair_search.unique_pairs(star1s, star2s, len(tab))
+star1s, star2s = star1s[unique], star2s[unique]
+print(f'after finding {np.sum(~unique)} exact duplicates, the new length is {len(star1s)}')
+
+# make the brighter star the star "1" and the fainter star "2"
+star1s, star2s = pair_search.brighter_first(star1s, star2s, G)
+
+# group every set of stars joined by a chain of candidate pairs, and write the groups (with their sizes and centroids)
+# and their members before the multiples are removed from the binary catalog
+group = comoving_groups.connected_components(star1s, star2s, len(tab))
+groups = comoving_groups.group_catalog(group, star1s, star2s, ra, dec, parallax, pmra, pmdec)
+print(f'the pairs make {len(groups)} groups, {np.sum(groups["n_stars"] > 2)} of them with more than 2 stars')
+groups.write('comoving_groups.fits', format='fits', overwrite=True)
+comoving_groups.group_members(group, source_id).write('comoving_group_members.fits', format='fits', overwrite=True)
+del group, groups
+
+# remove triples: pairs where star 1 or star 2 has another companion, or is a companion in another pair 
+isolated = pair_search.isolated_pairs(star1s, star2s)
+star1s, star2s = star1s[isolated], star2s[isolated]
+print(f'after removing triples, there are {len(star1s)} pairs')
+
 # make a new table. each row corresponds to a different pair.
 from astropy.table import Table
 new_cat = Table()    
@@ -277,38 +242,13 @@ for col in tab.colnames:
     new_cat[col+'1'] = tab[col][star1s]
     new_cat[col+'2'] = tab[col][star2s]
 
-# remove duplicates (pairs where star 1 and star 2 are switched)
-sid1, sid2 = fetch_table_element(['source_id1', 'source_id2'], new_cat)
-joint_ids = np.vstack([sid1, sid2]).T
-sorted_joint = np.sort(joint_ids, axis=1)
-joint_1d = np.core.defchararray.add( sorted_joint.T[0].astype(str),  sorted_joint.T[1].astype(str)  )
-dups = duplicates_msk(joint_1d)   
-new_cat = new_cat[~dups]
-print(f'after finding {np.sum(dups)} exact duplicates, the new length is {len(new_cat)}')
-
-# make the brighter star the star "1" and the fainter star "2"
-G1, G2 = fetch_table_element(['phot_g_mean_mag1', 'phot_g_mean_mag2'], new_cat)
-switch = G1 > G2
-colnames =  [ c[:-1] for c in new_cat.colnames if c[-1]=='1'] 
-for col in colnames:
-    new_cat[col+'1'][switch], new_cat[col+'2'][switch] = new_cat[col+'2'][switch], new_cat[col+'1'][switch]
-
-
 # calculate angular and physical separations. 
-ra1, dec1, ra2, dec2, parallax1, id1, id2 = fetch_table_element(['ra1', 'dec1', 'ra2', 'dec2', 'parallax1', 'source_id1', 'source_id2'], new_cat)
+ra1, dec1, ra2, dec2, parallax1 = fetch_table_element(['ra1', 'dec1', 'ra2', 'dec2', 'parallax1'], new_cat)
 theta_arcsec = get_distance_arcsec(ra1 = ra1, dec1 = dec1, ra2 = ra2, dec2 = dec2)
 new_cat['pairdistance'] = theta_arcsec/3600
 new_cat['sep_AU'] = 1000/parallax1 * theta_arcsec
 
 
-# remove triples. first get rid of cases where id1 or id2 have duplicates; i.e. one star with two companions 
-new_cat = new_cat[unique_value_msk(id1) & unique_value_msk(id2)]
-
-# now get cases where elements of id1 are in id2 or vice versa.
-id1, id2 = fetch_table_element(['source_id1', 'source_id2'], new_cat )
-new_cat = new_cat[~ (np.in1d(id1, id2) | np.in1d(id2, id1) )]
-print(f'after removing triples, there are {len(new_cat)} pairs')
-
 # remove clusters
 size_max_pc = 5 # count as a neighbor if projected separation within 5 pc
 sigma_cut = 2 # count as a neighbor if parallax consistent within 2 sigma
@@ -319,37 +259,14 @@ ra, dec, pmra, pmdec, parallax, parallax_error, pmra_error, pmdec_error = fetch_
 theta_max_radians_bin = size_max_pc*parallax/1000
 
 
-# use the same approach we used to find binary candidates. Now look for neighboring binaries. 
-coords_bin = np.vstack([dec*np.pi/180, ra*np.pi/180,]).T
-tree_bin = BallTree(coords_bin, leaf_size = 10, metric = 'haversine')
-
-Nblock = 20000
-Nmax = (len(coords_bin)-1)//Nblock + 1
-indices = np.arange(len(coords_bin))
-def query_this_j(j):
-    print(j, j*Nblock/len(coords_bin),  psutil.virtual_memory().percent)
-
-    msk = (indices >= int(j*Nblock)) & (indices < int((j+1)*Nblock))
-    these_inds, these_dists = tree_bin.query_radius(coords_bin[msk], r = theta_max_radians_bin[msk], 
-        return_distance = True)        
-    parallax_block, parallax_error_block, pmra_block, pmra_error_block, pmdec_block, pmdec_error_block = parallax[msk], parallax_error[msk], pmra[msk], pmra_error[msk], pmdec[msk], pmdec_error[msk] 
-
-    N_neighbors = np.zeros(len(parallax_block))
-    for i, idxs in enumerate(these_inds):
-        thetas_arcsec = these_dists[i]*180/np.pi*3600
-        d_par_over_sigma = np.abs(parallax_block[i] - parallax[idxs])/np.sqrt(parallax_error_block[i]**2 + parallax_error[idxs]**2)
-        delta_mu, sigma_delta_mu = get_delta_mu_and_sigma(pmra1 = pmra_block[i], pmdec1 = pmdec_block[i], 
-            pmra2 = pmra[idxs], pmdec2 = pmdec[idxs], pmra_error1 = pmra_error_block[i], 
-            pmdec_error1 = pmdec_error_block[i], pmra_error2 = pmra_error[idxs], pmdec_error2 = pmdec_error[idxs])
-            
-        mu_max = 0.21095*dispersion_max_kms*parallax_block[i]                
-        neighbors = (delta_mu < mu_max + sigma_cut*sigma_delta_mu) & (d_par_over_sigma < sigma_cut) & (thetas_arcsec > 1e-3)
-        N_neighbors[i] = np.sum(neighbors) 
-    return N_neighbors
-
-pool = multiprocessing.Pool(multiprocessing.cpu_count())
-all_result = pool.map(query_this_j,  np.arange(Nmax)); pool.close()
-N_neighbors = np.concatenate(all_result)
+# use the same approach we used to find binary candidates. Now look for neighboring binaries: the neighbors of each 
+# binary's star 1 within 5 pc among the other binaries' star 1, from the same neighbor list (rows of the full table)
+primaries = uncrowded[star1s]
+is_primary = np.zeros(len(crowded), dtype = bool)
+is_primary[primaries] = True
+
+N_neighbors = neighbor_cache.count_neighbors(cache, theta_max_radians_bin, stars, rows = primaries, neighbor_mask = is_primary, block_rows = Nblock, 
+    sigma_cut = sigma_cut, dispersion_max_kms = dispersion_max_kms)
 clean_cat = new_cat[N_neighbors < 2]
 
 # assign WD or MS designations. 
@@ -0,0 +1,262 @@
+# PY SCRIPT FOR ONE SHARED NEIGHBOR LIST OF THE COMOVING SEARCH
+#
+# num_neighbors_edr3.py queries a 5 pc projected radius around every star,
+# find_binaries_edr3.py then builds a second tree and queries 1 pc around the
+# same stars, and its cluster removal builds a third tree of the binaries and
+# queries 5 pc again.  Each of these is a search of the same sky.
+#
+# This module queries the sky once: build() finds the neighbors of every star
+# out to the widest radius any stage needs, over a tree of all the stars, and
+# saves them as a CSR neighbor list (indptr, neighbors, distances) of .npy
+# files that load() memory-maps.  Each stage then filters the list by its own
+# radius and by which stars it searches among (G < 18, the uncrowded stars,
+# the binaries) and applies its cuts with pair_search.binary_pairs or
+# pair_search.neighbor_counts, on pair_search's worker pool: each worker
+# memory-maps the list and filters blocks of rows planned on their exact
+# number of cached neighbors, so no further tree is built and the list is
+# never read into memory whole.
+#
+# Rows and neighbors are the rows of the catalog the cache was built on.  A
+# neighbor is kept if its distance is within the stage's radius, which can
+# differ from a fresh tree query only for a star exactly at the radius, to
+# rounding.
+#
+# VERSIONS:
+#  1.0  NEIGHBOR CACHE
+#  1.1  FILTERING ON THE PAIR_SEARCH WORKER POOL
+
+
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+sys.path.insert(0, '..')
+import pair_search
+
+
+
+ARRAYS = ['indptr', 'neighbors', 'distances', 'radii']
+META_FILE = 'cache.json'
+BLOCKS_DIRECTORY = 'blocks'
+
+
+
+# -----------------------------------------------------------------------------
+def build(tree, coords, radii, directory, block_rows=pair_search.PAIR_BLOCK_ROWS, block_cost=None, n_workers=None):
+    """
+    Find the neighbors of every star within its radius and save them in ``directory`` as a CSR neighbor list.
+
+    The query runs on ``pair_search.query_neighbors``, and its blocks are kept in ``directory/blocks`` until
+    the list is complete, so a build that is cut off resumes where it stopped. For example::
+
+        tree = sky_tree.make_tree(coords, leaf_size = 10)
+        cache = neighbor_cache.build(tree, coords, theta_max_radians, 'neighbor_cache_edr3')
+
+    :param tree: A tree of every star in ``coords``, in the same order.
+    :type tree: sky_tree.UnitVectorTree or sklearn.neighbors.BallTree
+    :param coords: (dec, ra) in radians of every star.
+    :type coords: numpy.ndarray
+    :param radii: The widest search radius of each star in radians.
+    :type radii: numpy.ndarray
+    :param directory: Directory of the cache.
+    :type directory: str
+    :param block_rows: Largest number of stars queried at once by a worker.
+    :type block_rows: int
+    :param block_cost: Estimated cost of a block (see ``pair_search.find_pairs``).
+    :type block_cost: float
+    :param n_workers: Number of worker processes. Defaults to the number of cores.
+    :type n_workers: int
+    :return: The cache, as :func:`load` returns it.
+    :rtype: dict of numpy.ndarray
+    """
+    os.makedirs(directory, exist_ok=True)
+    blocks_dir = os.path.join(directory, BLOCKS_DIRECTORY)
+    parts = pair_search.query_neighbors(tree, coords, radii, blocks_dir, block_rows=block_rows, block_cost=block_cost, n_workers=n_workers)
+
+    # copy the blocks, which are in row order, into one list
+    n_stars = len(coords)
+    n_neighbors = sum(len(part) for part in parts)
+    lengths = np.zeros(n_stars, dtype=np.int64)
+    neighbors = open_memmap(os.path.join(directory, 'neighbors.tmp.npy'), mode='w+', dtype=np.int64, shape=(n_neighbors,))
+    distances = open_memmap(os.path.join(directory, 'distances.tmp.npy'), mode='w+', dtype=np.float64, shape=(n_neighbors,))
+    done = 0
+    for part in parts:
+        if len(part):
+            rows = np.asarray(part['row'])
+            lengths[rows[0]:rows[-1] + 1] += np.bincount(rows - rows[0])
+        neighbors[done:done + len(part)] = part['neighbor']
+        distances[done:done + len(part)] = part['distance']
+        done += len(part)
+    neighbors.flush()
+    distances.flush()
+    del neighbors, distances, parts
+
+    indptr = np.zeros(n_stars + 1, dtype=np.int64)
+    np.cumsum(lengths, out=indptr[1:])
+    np.save(os.path.join(directory, 'indptr.tmp.npy'), indptr)
+    np.save(os.path.join(directory, 'radii.tmp.npy'), np.asarray(radii, dtype=np.float64))
+    with open(os.path.join(directory, META_FILE + '.tmp'), 'w') as out:
+        json.dump({'n_stars': n_stars, 'n_neighbors': int(n_neighbors), 'coords': pair_search.fingerprint(np.asarray(coords))}, out)
+
+    # the meta file goes last, so a cache is only complete with it
+    for name in ARRAYS:
+        os.replace(os.path.join(directory, name + '.tmp.npy'), os.path.join(directory, name + '.npy'))
+    os.replace(os.path.join(directory, META_FILE + '.tmp'), os.path.join(directory, META_FILE))
+    shutil.rmtree(blocks_dir)
+    print('neighbor_cache.build: ' + str(n_neighbors) + ' neighbors of ' + str(n_stars) + ' stars in ' + str(directory))
+    return load(directory)
+
+
+
+def load(directory, coords=None):
+    """
+    Memory-map a cache made by :func:`build`.
+
+    :param directory: Directory of the cache.
+    :type directory: str
+    :param coords: (dec, ra) in radians of the catalog, to check that the cache was built on it.
+    :type coords: numpy.ndarray
+    :raises Exception: Raised if the cache is incomplete or was built on other stars.
+    :return: ``indptr``, ``neighbors``, ``distances`` and ``radii`` (the radius of each star's list).
+    :rtype: dict of numpy.ndarray
+    """
+    if not os.path.exists(os.path.join(directory, META_FILE)):
+        raise Exception('neighbor_cache.load: no complete cache in ' + str(directory) + ', run neighbor_cache.build first')
+    with open(os.path.join(directory, META_FILE), 'r') as file:
+        meta = json.load(file)
+    if coords is not None and (len(coords) != meta['n_stars'] or pair_search.fingerprint(np.asarray(coords)) != meta['coords']):
+        raise Exception('neighbor_cache.load: the cache in ' + str(directory) + ' was built on other stars')
+    return {name: np.load(os.path.join(directory, name + '.npy'), mmap_mode='r') for name in ARRAYS}
+
+
+
+# -----------------------------------------------------------------------------
+def select(cache, rows, radii, neighbor_mask=None):
+    """
+    The cached neighbors of ``rows`` within ``radii`` that are in ``neighbor_mask``, as a CSR neighbor list.
+
+    :param cache: The cache, from :func:`load`.
+    :type cache: dict of numpy.ndarray
+    :param rows: Rows of the stars.
+    :type rows: numpy.ndarray
+    :param radii: Search radius of each of ``rows`` in radians, no wider than the cache's.
+    :type radii: numpy.ndarray
+    :param neighbor_mask: Which rows can be neighbors. Defaults to all.
+    :type neighbor_mask: numpy.ndarray
+    :raises Exception: Raised if a radius is wider than the cache's.
+    :return: ``indptr``, ``neighbors`` and ``distances``, as ``pair_search.query_csr`` returns them.
+    :rtype: (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    radii = np.broadcast_to(np.asarray(radii, dtype=np.float64), (len(rows),))
+    if np.any(radii > cache['radii'][rows]):
+        raise Exception('neighbor_cache.select: a radius is wider than the cached neighbors\' (rebuild the cache with wider radii)')
+
+    # positions of every cached neighbor of the rows
+    first, last = cache['indptr'][rows], cache['indptr'][rows + 1]
+    lengths = last - first
+    owner = np.repeat(np.arange(len(rows)), lengths)
+    if len(rows) and np.all(rows[1:] == rows[:-1] + 1):
+        # consecutive rows: one slice of the files
+        neighbors = np.array(cache['neighbors'][first[0]:last[-1]])
+        distances = np.array(cache['distances'][first[0]:last[-1]])
+    else:
+        positions = np.arange(len(owner), dtype=np.int64) + np.repeat(first - (np.cumsum(lengths) - lengths), lengths)
+        neighbors = cache['neighbors'][positions]
+        distances = cache['distances'][positions]
+
+    keep = distances <= radii[owner]
+    if neighbor_mask is not None:
+        keep &= neighbor_mask[neighbors]
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(owner[keep], minlength=len(rows)), out=indptr[1:])
+    return indptr, neighbors[keep], distances[keep]
+
+
+
+def find_pairs(cache, radii, stars, rows=None, neighbor_mask=None, block_rows=pair_search.PAIR_BLOCK_ROWS, block_cost=None, n_workers=None, run_dir=None, **cuts):
+    """
+    Binary candidates (``pair_search.binary_pairs``) of ``rows`` among the stars in ``neighbor_mask``, from the cache.
+
+    Same as ``pair_search.find_pairs`` with a tree of the stars in ``neighbor_mask``, but the pairs are rows of
+    the cache's catalog. The rows are cut into blocks by their number of cached neighbors and filtered on a
+    pool of workers, as in ``pair_search.find_pairs``.
+
+    :param cache: The cache, from :func:`load`.
+    :type cache: dict of numpy.ndarray
+    :param radii: Search radius of each of ``rows`` in radians.
+    :type radii: numpy.ndarray
+    :param stars: ``ASTROMETRY`` plus ``phot_g_mean_mag`` columns of every star of the catalog.
+    :type stars: dict of numpy.ndarray
+    :param rows: Rows of the stars to search around. Defaults to all.
+    :type rows: numpy.ndarray
+    :param neighbor_mask: Which rows can be companions. Defaults to all.
+    :type neighbor_mask: numpy.ndarray
+    :param block_rows: Largest number of stars filtered at once by a worker.
+    :type block_rows: int
+    :param block_cost: Cached neighbors plus stars of a block (see ``pair_search.find_pairs``).
+    :type block_cost: float
+    :param n_workers: Number of worker processes. Defaults to the number of cores.
+    :type n_workers: int
+    :param run_dir: Directory to save each block's result in as it completes (see ``pair_search.find_pairs``).
+    :type run_dir: str
+    :param cuts: Keyword arguments for ``pair_search.binary_pairs``.
+    :raises Exception: Raised if the cache was not memory-mapped by :func:`load`.
+    :return: Rows of star 1 and star 2 of each pair.
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    radii, shared = _pool_cache(cache, radii, rows, neighbor_mask)
+    results = pair_search._run_blocks('pairs', None, None, radii, stars, None, block_rows, block_cost, n_workers, run_dir, cuts, shared)
+    if not results:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate([result[0] for result in results]), np.concatenate([result[1] for result in results])
+
+
+
+def count_neighbors(cache, radii, stars, rows=None, neighbor_mask=None, block_rows=pair_search.COUNT_BLOCK_ROWS, block_cost=None, n_workers=None, run_dir=None, **cuts):
+    """
+    Comoving neighbor counts (``pair_search.neighbor_counts``) of ``rows`` among the stars in ``neighbor_mask``, from the cache.
+
+    :param cache: The cache, from :func:`load`.
+    :type cache: dict of numpy.ndarray
+    :param radii: Search radius of each of ``rows`` in radians.
+    :type radii: numpy.ndarray
+    :param stars: ``ASTROMETRY`` columns of every star of the catalog.
+    :type stars: dict of numpy.ndarray
+    :param rows: Rows of the stars to count the neighbors of. Defaults to all.
+    :type rows: numpy.ndarray
+    :param neighbor_mask: Which rows are counted as neighbors. Defaults to all.
+    :type neighbor_mask: numpy.ndarray
+    :param block_rows: Largest number of stars filtered at once by a worker.
+    :type block_rows: int
+    :param block_cost: Cached neighbors plus stars of a block (see ``pair_search.count_neighbors``).
+    :type block_cost: float
+    :param n_workers: Number of worker processes. Defaults to the number of cores.
+    :type n_workers: int
+    :param run_dir: Directory to save each block's result in as it completes (see ``pair_search.count_neighbors``).
+    :type run_dir: str
+    :param cuts: Keyword arguments for ``pair_search.neighbor_counts``.
+    :raises Exception: Raised if the cache was not memory-mapped by :func:`load`.
+    :return: The number of neighbors of each of ``rows``.
+    :rtype: numpy.ndarray
+    """
+    radii, shared = _pool_cache(cache, radii, rows, neighbor_mask)
+    return pair_search._run_blocks('counts', None, None, radii, stars, None, block_rows, block_cost, n_workers, run_dir, cuts, shared)
+
+
+
+def _pool_cache(cache, radii, rows, neighbor_mask):
+    # the radius of each row, and what the pair_search workers need to filter the cache: select, the
+    # cache's files (each worker maps its own), the neighbor_mask and the rows
+    if not all(isinstance(cache[name], np.memmap) for name in ARRAYS):
+        raise Exception('neighbor_cache: the cache must be memory-mapped by neighbor_cache.load, so the workers can map its files')
+    if rows is None:
+        rows = np.arange(len(cache['indptr']) - 1, dtype=np.int64)
+    rows = np.asarray(rows, dtype=np.int64)
+    radii = np.ascontiguousarray(np.broadcast_to(np.asarray(radii, dtype=np.float64), (len(rows),)))
+    files = {name: cache[name].filename for name in ARRAYS}
+    return radii, (select, files, None if neighbor_mask is None else np.asarray(neighbor_mask, dtype=bool), rows)
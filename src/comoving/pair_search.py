@@ -0,0 +1,721 @@
+# PY SCRIPT FOR THE VECTORIZED PAIR CUTS OF THE COMOVING STAR SEARCH
+#
+# num_neighbors_edr3.py and find_binaries_edr3.py query a BallTree for the
+# possible companions of a block of stars and then apply El-Badry's parallax,
+# proper motion, orbital motion and separation cuts.  Instead of looping over
+# the stars of a block in Python, the query results are flattened into one
+# CSR-style neighbor list (indptr, neighbors, distances) and every cut is one
+# array operation over all pairs of the block.  The arithmetic is the same as
+# in the per-star loop, so the pairs and neighbor counts are identical.
+#
+# find_pairs and count_neighbors run the blocks on a pool of worker processes.
+# The tree, the coordinates and the astrometry columns are copied once into
+# named shared memory that every worker maps, so memory does not grow with the
+# number of workers, and the results come back as int64 arrays (neighbor
+# counts are written straight into a shared output array).
+#
+# Given a run_dir, every block's result is also saved there as it completes,
+# under a fingerprint of the block's inputs (its rows, the tree and the cuts),
+# so a run that is killed part way can be restarted and only computes the
+# blocks that have no result yet.  The block boundaries are saved there too,
+# so a rerun with other workers or on another node cuts the same blocks.
+#
+# Blocks are not fixed numbers of rows: the cost of each star is estimated
+# from the density of tree stars around it (a coarse equal-area sky grid) and
+# its search radius, the rows are cut into contiguous blocks of about equal
+# cost (fewer rows per block in the Galactic plane and in clusters), and the
+# blocks are handed to the workers most expensive first, so the pool doesn't
+# wait on one dense block at the end.  Each block's time is printed next to
+# its estimated cost so the balance can be checked.
+#
+# VERSIONS:
+#  1.0  VECTORIZED PAIR CUTS
+#  1.1  SHARED-MEMORY WORKER POOL
+#  1.2  UNIT-VECTOR KD-TREE BACKEND (sky_tree)
+#  1.3  INTEGER PAIR KEYS FOR DUPLICATE AND TRIPLE REMOVAL
+#  1.4  CHECKPOINT AND RESUME OF THE BLOCK RUNS (run_dir)
+#  1.5  DENSITY-AWARE BLOCK SCHEDULING
+#  1.6  UNCUT NEIGHBOR QUERY FOR THE NEIGHBOR CACHE (neighbor_cache)
+#  1.7  BLOCKS OF THE NEIGHBOR CACHE ON THE WORKER POOL
+
+
+import hashlib
+import os
+import sys
+import time
+import multiprocessing
+
+import numpy as np
+import psutil
+
+sys.path.insert(0, '..')
+from common import parallel
+from sky_tree import UnitVectorTree
+
+
+
+# astrometry columns the cuts need, as keys of the ``stars`` mappings
+ASTROMETRY = ['parallax', 'parallax_error', 'pmra', 'pmdec', 'pmra_error', 'pmdec_error']
+
+# default largest number of stars queried at once by each worker
+PAIR_BLOCK_ROWS = 200000
+COUNT_BLOCK_ROWS = 20000
+
+# side in degrees of the sky grid cells the star density is estimated on
+DENSITY_CELL_DEG = 1
+
+# rough memory per neighbor of a block (the neighbor lists, both stars' astrometry and the cut temporaries)
+BYTES_PER_NEIGHBOR = 256
+
+# blocks per worker the rows are cut into at least, so the longest-first queue can balance them
+BLOCKS_PER_WORKER = 8
+
+# positions of the arrays in a BallTree's or KDTree's pickled state (data, idx_array, node_data, node_bounds)
+TREE_ARRAYS = [0, 1, 2, 3]
+
+# one neighbor of a star, as query_neighbors saves them
+NEIGHBOR_DTYPE = np.dtype([('row', '<i8'), ('neighbor', '<i8'), ('distance', '<f8')])
+
+# the tree, coordinates and columns mapped from shared memory, set in each worker by _attach_search
+_search = {}
+
+
+
+# -----------------------------------------------------------------------------
+def to_csr(inds, dists):
+    """
+    Flatten the per-star results of ``BallTree.query_radius`` into one CSR-style neighbor list.
+
+    The neighbors of star ``i`` are ``neighbors[indptr[i]:indptr[i+1]]``, in the order the tree returned them.
+
+    :param inds: Neighbor indices of each star, as returned by ``query_radius``.
+    :type inds: array of arrays
+    :param dists: Angular distances (radians) of each star's neighbors.
+    :type dists: array of arrays
+    :return: ``indptr`` (int64, one more than the number of stars), ``neighbors`` (int64) and ``distances`` (float64).
+    :rtype: (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+    """
+    indptr = np.zeros(len(inds) + 1, dtype=np.int64)
+    if len(inds) == 0:
+        return indptr, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+    np.cumsum([len(idxs) for idxs in inds], out=indptr[1:])
+    neighbors = np.concatenate(inds).astype(np.int64, copy=False)
+    distances = np.concatenate(dists).astype(np.float64, copy=False)
+    return indptr, neighbors, distances
+
+
+
+def query_csr(tree, coords, radii):
+    """
+    Query a tree for every star within its own angular radius and return the CSR neighbor list of :func:`to_csr`.
+
+    :param tree: A ``sky_tree`` tree, or a BallTree built with ``metric='haversine'`` on (dec, ra) in radians.
+    :type tree: sky_tree.UnitVectorTree or sklearn.neighbors.BallTree
+    :param coords: (dec, ra) in radians of the stars to query.
+    :type coords: numpy.ndarray
+    :param radii: Search radius of each star in radians.
+    :type radii: numpy.ndarray
+    :return: ``indptr``, ``neighbors`` and ``distances``.
+    :rtype: (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+    """
+    if isinstance(tree, UnitVectorTree):
+        return tree.query_csr(coords, radii)
+    if len(coords) == 0:
+        return to_csr([], [])
+    inds, dists = tree.query_radius(coords, r=radii, return_distance=True)
+    return to_csr(inds, dists)
+
+
+
+# -----------------------------------------------------------------------------
+def get_delta_mu_and_sigma(pmra1, pmdec1, pmra2, pmdec2, pmra_error1, pmdec_error1, pmra_error2, pmdec_error2):
+    """
+    Proper motion difference and its uncertainty (equations 4-5 of El-Badry et al. 2021) for arrays of pairs.
+
+    Same as ``find_binaries_edr3.get_delta_mu_and_sigma``, but star 1 is an array the length of star 2's
+    arrays rather than a single star.
+
+    :return: The proper motion difference and its uncertainty for each pair (mas/yr).
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    delt_alpha, delt_delta = (pmra1 - pmra2)**2, (pmdec1 - pmdec2)**2
+    delta_mu2 = delt_alpha + delt_delta
+
+    m = delta_mu2 == 0
+    sigma2_delta_mu = np.zeros(len(delta_mu2))
+    sigma2_delta_mu[m] = (pmra_error1[m]**2 + pmra_error2[m]**2) + (pmdec_error1[m]**2 + pmdec_error2[m]**2)
+    sigma2_delta_mu[~m] = ((pmra_error1[~m]**2 + pmra_error2[~m]**2) * (delt_alpha[~m]) + \
+        (pmdec_error1[~m]**2 + pmdec_error2[~m]**2)*delt_delta[~m])/delta_mu2[~m]
+
+    return np.sqrt(delta_mu2), np.sqrt(sigma2_delta_mu)
+
+
+
+def _pair_astrometry(rows, indptr, neighbors, stars1, stars2, names):
+    # the columns of both stars of every pair: star 1 repeated once per neighbor, star 2 the neighbor
+    first = np.repeat(np.asarray(rows, dtype=np.int64), np.diff(indptr))
+    return first, {name: (stars1[name][first], stars2[name][neighbors]) for name in names}
+
+
+
+# -----------------------------------------------------------------------------
+def binary_pairs(rows, indptr, neighbors, distances, stars1, stars2=None, parallax_sigma_limit=3, theta_arcsec_min=4, s_max_au=3600*180/np.pi):
+    """
+    Apply the binary candidate cuts of section 2.2 of El-Badry et al. 2021 to a CSR neighbor list.
+
+    A pair passes if the parallaxes agree within ``parallax_sigma_limit`` sigma (twice that below
+    ``theta_arcsec_min``), the proper motion difference is within a bound orbit plus 2 sigma, the
+    separation is above 1 mas and the projected separation (at the brighter star's parallax) is below
+    ``s_max_au``. Pairs come out in the order of the neighbor list, as the per-star loop appended them.
+
+    :param rows: Row of each queried star in ``stars1``.
+    :type rows: array of int
+    :param indptr: CSR offsets of each queried star's neighbors.
+    :type indptr: numpy.ndarray
+    :param neighbors: Neighbor rows in ``stars2``.
+    :type neighbors: numpy.ndarray
+    :param distances: Angular distances of the neighbors in radians.
+    :type distances: numpy.ndarray
+    :param stars1: Columns of the queried stars: ``ASTROMETRY`` plus ``phot_g_mean_mag``.
+    :type stars1: dict of numpy.ndarray
+    :param stars2: Columns of the tree's stars. Defaults to ``stars1``.
+    :type stars2: dict of numpy.ndarray
+    :param parallax_sigma_limit: Parallax consistency in sigma.
+    :type parallax_sigma_limit: float
+    :param theta_arcsec_min: Separation in arcsec below which twice the parallax tolerance is allowed.
+    :type theta_arcsec_min: float
+    :param s_max_au: Largest projected separation in AU.
+    :type s_max_au: float
+    :return: Rows of star 1 (in ``stars1``) and star 2 (in ``stars2``) of each pair.
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    if stars2 is None:
+        stars2 = stars1
+    first, pair = _pair_astrometry(rows, indptr, neighbors, stars1, stars2, ASTROMETRY + ['phot_g_mean_mag'])
+    (parallax1, parallax2), (parallax_error1, parallax_error2) = pair['parallax'], pair['parallax_error']
+    G1, G2 = pair['phot_g_mean_mag']
+
+    thetas_arcsec = distances*180/np.pi*3600
+    brighter_parallax = np.copy(parallax2)
+    fainter = G2 > G1
+    brighter_parallax[fainter] = parallax1[fainter] # parallax of the brighter component
+
+    d_par_over_sigma = np.abs(parallax1 - parallax2)/np.sqrt(parallax_error1**2 + parallax_error2**2)
+    delta_mu, sigma_delta_mu = get_delta_mu_and_sigma(pmra1=pair['pmra'][0], pmdec1=pair['pmdec'][0],
+        pmra2=pair['pmra'][1], pmdec2=pair['pmdec'][1], pmra_error1=pair['pmra_error'][0],
+        pmdec_error1=pair['pmdec_error'][0], pmra_error2=pair['pmra_error'][1], pmdec_error2=pair['pmdec_error'][1])
+
+    # a star paired with itself (theta = 0) never passes; keep it out of the orbital motion division
+    delta_mu_orbit = np.zeros(len(thetas_arcsec))
+    mm = thetas_arcsec == 0
+    delta_mu_orbit[mm] = 1e9
+    delta_mu_orbit[~mm] = 0.44428*brighter_parallax[~mm]**(3/2)*thetas_arcsec[~mm]**(-1/2)
+    sep_AU = 1000/brighter_parallax * thetas_arcsec
+
+    # b = 3 at theta > 4 arcsec; b = 6 at theta < 4 arcsec
+    max_parallax_diff = np.ones(len(thetas_arcsec))*parallax_sigma_limit
+    max_parallax_diff[thetas_arcsec < theta_arcsec_min] = 2*parallax_sigma_limit
+
+    m = (d_par_over_sigma < max_parallax_diff) & (delta_mu < delta_mu_orbit + 2*sigma_delta_mu) & (thetas_arcsec > 0.001) & (sep_AU < s_max_au)
+    return first[m], neighbors[m]
+
+
+
+# -----------------------------------------------------------------------------
+def neighbor_counts(rows, indptr, neighbors, distances, stars1, stars2=None, sigma_cut=2, dispersion_max_kms=5):
+    """
+    Count the comoving neighbors of each queried star (section 2.1 of El-Badry et al. 2021).
+
+    A neighbor counts if its parallax agrees within ``sigma_cut`` sigma, its proper motion differs by less
+    than ``dispersion_max_kms`` (at the queried star's parallax) plus ``sigma_cut`` sigma, and it is more
+    than 1 mas away (so a star does not count itself).
+
+    :param rows: Row of each queried star in ``stars1``.
+    :type rows: array of int
+    :param indptr: CSR offsets of each queried star's neighbors.
+    :type indptr: numpy.ndarray
+    :param neighbors: Neighbor rows in ``stars2``.
+    :type neighbors: numpy.ndarray
+    :param distances: Angular distances of the neighbors in radians.
+    :type distances: numpy.ndarray
+    :param stars1: ``ASTROMETRY`` columns of the queried stars.
+    :type stars1: dict of numpy.ndarray
+    :param stars2: ``ASTROMETRY`` columns of the tree's stars. Defaults to ``stars1``.
+    :type stars2: dict of numpy.ndarray
+    :param sigma_cut: Tolerance in sigma.
+    :type sigma_cut: float
+    :param dispersion_max_kms: Largest plane-of-sky velocity difference in km/s.
+    :type dispersion_max_kms: float
+    :return: The number of neighbors of each queried star.
+    :rtype: numpy.ndarray
+    """
+    if stars2 is None:
+        stars2 = stars1
+    _, pair = _pair_astrometry(rows, indptr, neighbors, stars1, stars2, ASTROMETRY)
+    (parallax1, parallax2), (parallax_error1, parallax_error2) = pair['parallax'], pair['parallax_error']
+
+    thetas_arcsec = distances*180/np.pi*3600
+    d_par_over_sigma = np.abs(parallax1 - parallax2)/np.sqrt(parallax_error1**2 + parallax_error2**2)
+    delta_mu, sigma_delta_mu = get_delta_mu_and_sigma(pmra1=pair['pmra'][0], pmdec1=pair['pmdec'][0],
+        pmra2=pair['pmra'][1], pmdec2=pair['pmdec'][1], pmra_error1=pair['pmra_error'][0],
+        pmdec_error1=pair['pmdec_error'][0], pmra_error2=pair['pmra_error'][1], pmdec_error2=pair['pmdec_error'][1])
+
+    mu_max = 0.21095*dispersion_max_kms*parallax1
+    neighbors_ = (delta_mu < mu_max + sigma_cut*sigma_delta_mu) & (d_par_over_sigma < sigma_cut) & (thetas_arcsec > 1e-3)
+
+    # each pair's position in the queried list, to count the pairs that pass per star
+    owner = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    return np.bincount(owner[neighbors_], minlength=len(indptr) - 1)
+
+
+
+# -----------------------------------------------------------------------------
+def find_pairs(tree, coords, radii, stars, block_rows=PAIR_BLOCK_ROWS, block_cost=None, n_workers=None, run_dir=None, **cuts):
+    """
+    Find the binary candidates of every star in ``coords`` on a pool of workers sharing the tree and columns.
+
+    Stars are queried in blocks of about equal estimated cost (see :func:`estimate_costs`) of at most
+    ``block_rows`` stars, and each block goes through :func:`binary_pairs`. The pairs are returned in row
+    order, so they are the same as querying the blocks one after the other.
+    For example::
+
+        star1s, star2s = pair_search.find_pairs(tree, coords, theta_max_radians, stars, parallax_sigma_limit = 3)
+
+    :param tree: A tree of the same stars as ``coords`` (``sky_tree.make_tree`` or a haversine BallTree).
+    :type tree: sky_tree.UnitVectorTree or sklearn.neighbors.BallTree
+    :param coords: (dec, ra) in radians of every star.
+    :type coords: numpy.ndarray
+    :param radii: Search radius of each star in radians.
+    :type radii: numpy.ndarray
+    :param stars: ``ASTROMETRY`` plus ``phot_g_mean_mag`` columns of every star.
+    :type stars: dict of numpy.ndarray
+    :param block_rows: Largest number of stars queried at once by a worker.
+    :type block_rows: int
+    :param block_cost: Estimated cost (neighbors plus stars) of a block. Defaults to what fits in memory, and to no more than an eighth of a worker's share of the total.
+    :type block_cost: float
+    :param n_workers: Number of worker processes. Defaults to the number of cores.
+    :type n_workers: int
+    :param run_dir: Directory to save each block's result in as it completes. A rerun with the same ``run_dir`` only computes the blocks whose inputs have no result there yet (the blocks are saved in ``run_dir`` too, so a rerun on another machine or with other ``n_workers`` reuses them).
+    :type run_dir: str
+    :param cuts: Keyword arguments for :func:`binary_pairs` (``parallax_sigma_limit``, ``theta_arcsec_min``, ``s_max_au``).
+    :return: Rows of star 1 and star 2 of each pair.
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    results = _run_blocks('pairs', tree, coords, radii, stars, None, block_rows, block_cost, n_workers, run_dir, cuts)
+    if not results:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate([result[0] for result in results]), np.concatenate([result[1] for result in results])
+
+
+
+# -----------------------------------------------------------------------------
+def count_neighbors(tree, coords, radii, stars, tree_stars=None, block_rows=COUNT_BLOCK_ROWS, block_cost=None, n_workers=None, run_dir=None, **cuts):
+    """
+    Count the comoving neighbors (:func:`neighbor_counts`) of every star in ``coords`` on a pool of workers sharing the tree and columns.
+
+    :param tree: A tree of the stars neighbors are counted among (``sky_tree.make_tree`` or a haversine BallTree).
+    :type tree: sky_tree.UnitVectorTree or sklearn.neighbors.BallTree
+    :param coords: (dec, ra) in radians of the stars to count the neighbors of.
+    :type coords: numpy.ndarray
+    :param radii: Search radius of each star in radians.
+    :type radii: numpy.ndarray
+    :param stars: ``ASTROMETRY`` columns of the stars in ``coords``.
+    :type stars: dict of numpy.ndarray
+    :param tree_stars: ``ASTROMETRY`` columns of the stars in the tree. Defaults to ``stars``.
+    :type tree_stars: dict of numpy.ndarray
+    :param block_rows: Largest number of stars queried at once by a worker.
+    :type block_rows: int
+    :param block_cost: Estimated cost (neighbors plus stars) of a block. Defaults to what fits in memory, and to no more than an eighth of a worker's share of the total.
+    :type block_cost: float
+    :param n_workers: Number of worker processes. Defaults to the number of cores.
+    :type n_workers: int
+    :param run_dir: Directory to save each block's result in as it completes. A rerun with the same ``run_dir`` only computes the blocks whose inputs have no result there yet (the blocks are saved in ``run_dir`` too, so a rerun on another machine or with other ``n_workers`` reuses them).
+    :type run_dir: str
+    :param cuts: Keyword arguments for :func:`neighbor_counts` (``sigma_cut``, ``dispersion_max_kms``).
+    :return: The number of neighbors of each star.
+    :rtype: numpy.ndarray
+    """
+    return _run_blocks('counts', tree, coords, radii, stars, tree_stars, block_rows, block_cost, n_workers, run_dir, cuts)
+
+
+
+def query_neighbors(tree, coords, radii, run_dir, block_rows=PAIR_BLOCK_ROWS, block_cost=None, n_workers=None):
+    """
+    Find every star of the tree within the radius of each star in ``coords``, with no cuts, on a pool of workers.
+
+    The neighbor lists can be far larger than memory, so each block is saved in ``run_dir`` (as for
+    :func:`find_pairs`) and returned memory-mapped (see ``neighbor_cache.build``).
+
+    :param run_dir: Directory to save each block's neighbors in.
+    :type run_dir: str
+    :return: One array per block, in row order, with the ``row``, ``neighbor`` and ``distance`` (radians) of every neighbor.
+    :rtype: list of numpy.ndarray
+    :raises Exception: Raised if ``run_dir`` is not given.
+    """
+    if run_dir is None:
+        raise Exception('pair_search.query_neighbors: the neighbors are saved in run_dir, which must be given')
+    return _run_blocks('neighbors', tree, coords, radii, {}, None, block_rows, block_cost, n_workers, run_dir, {})
+
+
+
+# -----------------------------------------------------------------------------
+def estimate_costs(tree_coords, coords, radii, cell_deg=DENSITY_CELL_DEG):
+    """
+    Estimated cost of querying each star: the expected number of tree stars within its radius, plus one.
+
+    The tree stars are counted on a grid of equal-area cells (equal steps in RA and in sin(dec)) about
+    ``cell_deg`` on a side, and each star's expected neighbors are its cell's density times the area of its
+    search cap.
+
+    :param tree_coords: (dec, ra) in radians of the tree's stars.
+    :type tree_coords: numpy.ndarray
+    :param coords: (dec, ra) in radians of the stars to query.
+    :type coords: numpy.ndarray
+    :param radii: Search radius of each star in radians.
+    :type radii: numpy.ndarray
+    :param cell_deg: Approximate side of the grid cells in degrees.
+    :type cell_deg: float
+    :return: The estimated cost of each star.
+    :rtype: numpy.ndarray
+    """
+    n_ra = max(int(round(360/cell_deg)), 1)
+    n_z = max(int(round(2/np.radians(cell_deg))), 1)
+    stars_per_cell = np.bincount(_density_cell(tree_coords, n_z, n_ra), minlength=n_z*n_ra)
+    density = stars_per_cell/(4*np.pi/(n_z*n_ra))
+    cap_area = 2*np.pi*(1 - np.cos(np.minimum(radii, np.pi)))
+    return 1 + density[_density_cell(coords, n_z, n_ra)]*cap_area
+
+
+
+def _density_cell(coords, n_z, n_ra):
+    # cell of each (dec, ra) on a grid of n_z steps in sin(dec) by n_ra steps in RA
+    z = np.minimum(((np.sin(coords[:, 0]) + 1)/2*n_z).astype(np.int64), n_z - 1)
+    ra = np.minimum((np.mod(coords[:, 1], 2*np.pi)/(2*np.pi)*n_ra).astype(np.int64), n_ra - 1)
+    return np.maximum(z, 0)*n_ra + ra
+
+
+
+def _plan_blocks(row_costs, block_rows, block_cost, n_workers, plan_file=None):
+    # cut the rows into contiguous blocks of about block_cost estimated cost and at most block_rows rows;
+    # returns the first and last + 1 row and the estimated cost of each block. The default block_cost depends
+    # on the machine, so with a plan_file the blocks are saved there and an earlier run's blocks are reused
+    cumulative = np.cumsum(row_costs, dtype=np.float64)
+    if len(cumulative) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    if plan_file is not None and os.path.exists(plan_file):
+        starts, stops = np.load(plan_file)
+        if stops[-1] == len(cumulative):
+            return starts, stops, _block_costs(cumulative, starts, stops)
+    if block_cost is None:
+        memory_cost = psutil.virtual_memory().total/(2*n_workers*BYTES_PER_NEIGHBOR)
+        block_cost = min(memory_cost, cumulative[-1]/(BLOCKS_PER_WORKER*n_workers))
+
+    starts, stops = [], []
+    start = 0
+    while start < len(cumulative):
+        done = cumulative[start - 1] if start else 0.0
+        stop = int(np.searchsorted(cumulative, done + block_cost, side='right'))
+        stop = min(max(stop, start + 1), start + block_rows, len(cumulative))
+        starts.append(start)
+        stops.append(stop)
+        start = stop
+    starts, stops = np.array(starts, dtype=np.int64), np.array(stops, dtype=np.int64)
+    if plan_file is not None:
+        tmp = plan_file[:-len('.npy')] + '.' + str(os.getpid()) + '.tmp.npy'
+        np.save(tmp, np.vstack([starts, stops]))
+        os.replace(tmp, plan_file)
+    return starts, stops, _block_costs(cumulative, starts, stops)
+
+
+
+def _block_costs(cumulative, starts, stops):
+    # the summed cost of the rows of each block
+    return cumulative[stops - 1] - np.where(starts > 0, cumulative[np.maximum(starts - 1, 0)], 0.0)
+
+
+
+# -----------------------------------------------------------------------------
+def pair_keys(star1s, star2s, n_stars):
+    """
+    One int64 key per pair that does not depend on the order of its stars: ``min(i, j)*n_stars + max(i, j)``.
+
+    :param star1s: Rows of star 1 of each pair.
+    :type star1s: numpy.ndarray
+    :param star2s: Rows of star 2 of each pair.
+    :type star2s: numpy.ndarray
+    :param n_stars: Number of rows the pairs index (one more than the largest row).
+    :type n_stars: int
+    :raises Exception: Raised if ``n_stars**2`` does not fit in an int64.
+    :return: The key of each pair.
+    :rtype: numpy.ndarray
+    """
+    if int(n_stars)**2 - 1 > np.iinfo(np.int64).max:
+        raise Exception('pair_search.pair_keys: ' + str(n_stars) + ' stars are too many for int64 pair keys')
+    star1s, star2s = np.asarray(star1s, dtype=np.int64), np.asarray(star2s, dtype=np.int64)
+    return np.minimum(star1s, star2s)*np.int64(n_stars) + np.maximum(star1s, star2s)
+
+
+
+def unique_pairs(star1s, star2s, n_stars):
+    """
+    Mask of the first occurrence of each pair, whichever way round its stars are (e.g. both (i, j) and (j, i) are found).
+
+    Same as ``duplicates_msk`` on the concatenated source_id strings of find_binaries_edr3.py, inverted, but on
+    int64 keys (see :func:`pair_keys`).
+
+    :return: True for the pairs to keep.
+    :rtype: numpy.ndarray
+    """
+    keep = np.zeros(len(star1s), dtype=bool)
+    keep[np.unique(pair_keys(star1s, star2s, n_stars), return_index=True)[1]] = True
+    return keep
+
+
+
+def brighter_first(star1s, star2s, G):
+    """
+    Swap the stars of the pairs whose star 1 is fainter than star 2 in ``G``, so that star 1 is the brighter one.
+
+    :return: Rows of star 1 and star 2 of each pair.
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    switch = G[star1s] > G[star2s]
+    return np.where(switch, star2s, star1s), np.where(switch, star1s, star2s)
+
+
+
+def isolated_pairs(star1s, star2s):
+    """
+    Mask of the pairs that share no star with another pair, i.e. without the triples and higher multiples.
+
+    As in find_binaries_edr3.py, the pairs whose star 1 or star 2 appears more than once in its column are
+    removed first, then the remaining pairs whose star 1 is a star 2 of another pair or vice versa.
+
+    :return: True for the isolated pairs.
+    :rtype: numpy.ndarray
+    """
+    keep = _appears_once(star1s) & _appears_once(star2s)
+    first, second = star1s[keep], star2s[keep]
+    keep[keep] = ~(_is_in(first, second) | _is_in(second, first))
+    return keep
+
+
+
+def _appears_once(values):
+    # whether each value appears only once in values
+    uniq, inverse, counts = np.unique(values, return_inverse=True, return_counts=True)
+    return counts[inverse] == 1
+
+
+
+def _is_in(values, others):
+    # whether each of values is one of others, by a binary search of the sorted others
+    others = np.sort(others)
+    if len(others) == 0:
+        return np.zeros(len(values), dtype=bool)
+    found = np.minimum(np.searchsorted(others, values), len(others) - 1)
+    return others[found] == values
+
+
+
+def _run_blocks(kind, tree, coords, radii, stars1, stars2, block_rows, block_cost, n_workers, run_dir, cuts, cache=None):
+    # shares the inputs, runs _search_block on every block (most expensive first) and returns the pair arrays
+    # of each block (in row order), the neighbor counts, or the saved neighbors of each block. With a cache
+    # (select, the files and the neighbor_mask of a neighbor_cache, and the rows searched, in place of tree and
+    # coords), the workers take each block's neighbors from the cache, and the blocks are planned on the exact
+    # number of cached neighbors of each row
+    if n_workers is None:
+        n_workers = os.cpu_count()
+    if cache is None:
+        queried = coords
+        row_costs = estimate_costs(_tree_coords(tree), coords, radii)
+        source = [type(tree).__name__, _tree_coords(tree)]
+    else:
+        select, cache_files, neighbor_mask, queried = cache
+        indptr = np.load(cache_files['indptr'], mmap_mode='r')
+        row_costs = np.diff(indptr)[queried] + 1
+        source = ['neighbor_cache', indptr, neighbor_mask]
+    plan_file = None
+    if run_dir is not None:
+        os.makedirs(run_dir, exist_ok=True)
+        plan_file = os.path.join(run_dir, kind + '_plan_' + fingerprint(len(queried), block_rows, block_cost) + '.npy')
+    starts, stops, costs = _plan_blocks(row_costs, block_rows, block_cost, n_workers, plan_file)
+    n_blocks = len(starts)
+
+    # with a run directory, each block's result is saved under a fingerprint of its inputs, and the blocks
+    # saved by an earlier run are loaded instead of computed
+    files = [None]*n_blocks
+    results = [None]*n_blocks
+    if run_dir is not None:
+        # the tree's stars are in every block's neighbors, so their columns go into the fingerprint of every block
+        run = fingerprint(kind, *source, _columns(stars1 if stars2 is None else stars2), sorted(cuts.items()))
+        for j, (start, stop) in enumerate(zip(starts, stops)):
+            block = fingerprint(run, int(start), int(stop), queried[start:stop], radii[start:stop], _columns(stars1, start, stop))
+            files[j] = os.path.join(run_dir, kind + '_' + str(j).zfill(5) + '_' + block + '.npy')
+            if os.path.exists(files[j]):
+                results[j] = np.load(files[j], mmap_mode='r' if kind == 'neighbors' else None)
+        print('pair_search: ' + str(sum(result is not None for result in results)) + ' of ' + str(n_blocks) + ' blocks already done in ' + str(run_dir))
+
+    blocks = []
+    try:
+        layout = {'tree': None if cache is not None else _share_tree(tree, blocks),
+                  'cache': None if cache is None else (select, cache_files, None if neighbor_mask is None else parallel.to_shared(neighbor_mask, blocks)),
+                  'coords': parallel.to_shared(queried, blocks),
+                  'radii': parallel.to_shared(radii, blocks),
+                  'stars1': {name: parallel.to_shared(values, blocks) for name, values in stars1.items()},
+                  'stars2': None if stars2 is None else {name: parallel.to_shared(values, blocks) for name, values in stars2.items()},
+                  'counts': None}
+        if kind == 'counts':
+            # the workers write the counts of their block straight into one shared output array
+            counts = np.zeros(len(queried), dtype=np.int64)
+            for j in range(n_blocks):
+                if results[j] is not None:
+                    counts[starts[j]:stops[j]] = results[j]
+            layout['counts'] = parallel.to_shared(counts, blocks)
+            counts_block = blocks[-1]
+            del counts
+
+        # the most expensive blocks first, one at a time to whichever worker is free
+        todo = [j for j in np.argsort(-costs, kind='stable') if results[j] is None]
+        tasks = [(kind, int(j), int(starts[j]), int(stops[j]), cuts, files[j]) for j in todo]
+        seconds = np.full(n_blocks, np.nan)
+        begin = time.perf_counter()
+        with multiprocessing.Pool(n_workers, initializer=_attach_search, initargs=(layout,)) as pool:
+            for done, (j, result, elapsed) in enumerate(pool.imap_unordered(_search_block, tasks)):
+                results[j], seconds[j] = result, elapsed
+                # see how far along we are and make sure we aren't running out of memory, and how long
+                # the block took for its rows and estimated cost
+                print(j, (done + 1)/len(tasks), psutil.virtual_memory().percent, stops[j] - starts[j], int(costs[j]), '%.2f' % seconds[j])
+        if todo:
+            _print_balance(costs[todo], seconds[todo], time.perf_counter() - begin, n_workers)
+
+        if kind == 'counts':
+            counts = np.ndarray(len(queried), dtype=np.int64, buffer=counts_block.buf)
+            results = np.array(counts)
+            del counts
+        elif kind == 'neighbors':
+            results = [np.load(filename, mmap_mode='r') for filename in files]
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    return results
+
+
+
+def _print_balance(costs, seconds, wall, n_workers):
+    # how evenly the blocks ran: their times, the time per unit of estimated cost, and the workers' busy fraction
+    rate = seconds/costs
+    print('pair_search: ' + str(len(seconds)) + ' blocks in ' + '%.1f' % wall + ' s, block times ' + '%.2f' % seconds.min() + ' / ' + '%.2f' % np.median(seconds) + ' / ' + '%.2f' % seconds.max() + ' s (min / median / max)')
+    print('pair_search: seconds per million cost ' + '%.3g' % (1e6*np.percentile(rate, 10)) + ' to ' + '%.3g' % (1e6*np.percentile(rate, 90)) + ' (10th to 90th percentile), workers busy ' + '%.0f' % (100*seconds.sum()/(wall*n_workers)) + ' % of the time')
+
+
+
+def _tree_coords(tree):
+    # the points a tree was built on
+    if isinstance(tree, UnitVectorTree):
+        return tree.coords
+    return np.asarray(tree.data)
+
+
+
+def _columns(stars, start=None, stop=None):
+    # the columns of a stars mapping (rows start to stop) in name order, for a fingerprint
+    return [(name, stars[name][start:stop]) for name in sorted(stars)]
+
+
+
+def fingerprint(*parts):
+    """
+    A short sha1 hash of arrays and other values (by their repr), nested in lists and tuples.
+    """
+    digest = hashlib.sha1()
+
+    def add(part):
+        if isinstance(part, np.ndarray):
+            digest.update(repr((part.dtype.str, part.shape)).encode())
+            digest.update(np.ascontiguousarray(part))
+        elif isinstance(part, (list, tuple)):
+            digest.update(b'(')
+            for item in part:
+                add(item)
+            digest.update(b')')
+        else:
+            digest.update(repr(part).encode())
+
+    add(parts)
+    return digest.hexdigest()[:16]
+
+
+
+def _share_tree(tree, blocks):
+    # the tree's pickled state with its arrays replaced by shared memory descriptions
+    if isinstance(tree, UnitVectorTree):
+        return UnitVectorTree, (_share_tree(tree.tree, blocks), parallel.to_shared(tree.coords, blocks))
+    state = list(tree.__getstate__())
+    for i in TREE_ARRAYS:
+        state[i] = parallel.to_shared(state[i], blocks)
+    return type(tree), state
+
+
+
+def _attach_tree(description):
+    # rebuild a tree shared by _share_tree on the shared arrays (the sklearn trees' __setstate__ keeps the
+    # arrays it is given, so the tree itself is not copied)
+    tree_type, state = description
+    if tree_type is UnitVectorTree:
+        return UnitVectorTree.from_parts(_attach_tree(state[0]), parallel.from_shared(state[1]))
+    state = list(state)
+    for i in TREE_ARRAYS:
+        state[i] = parallel.from_shared(state[i])
+    tree = tree_type.__new__(tree_type)
+    tree.__setstate__(tuple(state))
+    return tree
+
+
+
+def _attach_search(layout):
+    # runs once in each worker: map the shared inputs and the tree, or the neighbor cache's files
+    _search.clear()
+    _search['tree'] = None if layout['tree'] is None else _attach_tree(layout['tree'])
+    _search['cache'] = None
+    if layout['cache'] is not None:
+        select, cache_files, neighbor_mask = layout['cache']
+        _search['select'] = select
+        _search['cache'] = {name: np.load(filename, mmap_mode='r') for name, filename in cache_files.items()}
+        _search['neighbor_mask'] = None if neighbor_mask is None else parallel.from_shared(neighbor_mask)
+    _search['coords'] = parallel.from_shared(layout['coords'])
+    _search['radii'] = parallel.from_shared(layout['radii'])
+    _search['stars1'] = {name: parallel.from_shared(description) for name, description in layout['stars1'].items()}
+    _search['stars2'] = None if layout['stars2'] is None else {name: parallel.from_shared(description) for name, description in layout['stars2'].items()}
+    _search['counts'] = None if layout['counts'] is None else parallel.from_shared(layout['counts'])
+
+
+
+def _search_block(task):
+    # query the block of rows start to stop (or select their neighbors from the cache) and apply the cuts;
+    # pairs go back as int64 arrays, counts into the shared output. With a file name, the result is also saved
+    # there (written to a temporary file and renamed, so a block that is cut off leaves no result)
+    kind, j, start, stop, cuts, filename = task
+    begin = time.perf_counter()
+    if _search['cache'] is None:
+        indptr, neighbors, distances = query_csr(_search['tree'], _search['coords'][start:stop], _search['radii'][start:stop])
+        rows = np.arange(start, stop, dtype=np.int64)
+    else:
+        rows = np.array(_search['coords'][start:stop])
+        indptr, neighbors, distances = _search['select'](_search['cache'], rows, _search['radii'][start:stop], _search['neighbor_mask'])
+    if kind == 'pairs':
+        result = np.vstack(binary_pairs(rows, indptr, neighbors, distances, _search['stars1'], _search['stars2'], **cuts))
+    elif kind == 'neighbors':
+        result = np.empty(len(neighbors), dtype=NEIGHBOR_DTYPE)
+        result['row'] = np.repeat(rows, np.diff(indptr))
+        result['neighbor'] = neighbors
+        result['distance'] = distances
+    else:
+        result = neighbor_counts(rows, indptr, neighbors, distances, _search['stars1'], _search['stars2'], **cuts)
+        _search['counts'][start:stop] = result
+    if filename is not None:
+        tmp = filename[:-len('.npy')] + '.' + str(os.getpid()) + '.tmp.npy'
+        np.save(tmp, result)
+        os.replace(tmp, filename)
+    return j, (result if kind == 'pairs' else None), time.perf_counter() - begin
@@ -0,0 +1,507 @@
+# PY SCRIPT FOR A SKY-PARTITIONED, OUT-OF-CORE COMOVING STAR SEARCH
+#
+# find_binaries_edr3.py and num_neighbors_edr3.py hold the whole catalog and
+# one tree over it in memory.  For catalogs that don't fit on one node, this
+# module splits the sky into tiles of roughly equal area (iso-latitude bands,
+# each cut into RA sectors, like HEALPix rings) and searches one tile at a
+# time.  Each tile holds its own stars (the core) plus every star within the
+# largest search radius of its core stars (the halo), so the neighbors of each
+# core star are all in the tile and the pairs and counts are the same as
+# searching the whole sky at once.  Every star is the core of exactly one
+# tile, so the tile results merge without duplicates.
+#
+# The few very nearby stars have search radii of many degrees, and a halo that
+# wide would copy most of the sky into a tile.  These wide stars set no halo:
+# they are kept apart in wide/ and every tile searches them against its own
+# core stars, so each of their neighbors is found once, in its own tile.
+#
+# write_tiles streams the catalog into one directory per tile, search_tiles
+# runs the tiles on a pool of processes (or on several nodes sharing the
+# directory: a tile is claimed with a lock file and its result written
+# atomically), and merge_pairs / merge_counts put the results back together
+# in terms of the catalog's row numbers.  Memory per worker is set by the
+# tile size instead of the catalog size.
+#
+# healpy is not a dependency of this project, so the tiles are not HEALPix
+# pixels; the halos are exact for these band/sector tiles.
+#
+# VERSIONS:
+#  1.0  SKY-PARTITIONED SEARCH
+#  1.1  HALO OF EACH TILE FROM ITS OWN STARS, WIDE STARS SEARCHED APART
+#  1.2  TILES WRITTEN TO A PARTIAL DIRECTORY AND MOVED IN PLACE
+
+
+import json
+import os
+import shutil
+import socket
+import sys
+import multiprocessing
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, '..')
+from common import streaming
+import pair_search
+import sky_tree
+
+
+
+# columns copied into the tiles
+COLUMNS = ['ra', 'dec', 'parallax', 'parallax_error', 'pmra', 'pmdec', 'pmra_error', 'pmdec_error', 'phot_g_mean_mag']
+
+# approximate side of a tile in degrees
+TILE_DEG = 10
+
+CHUNK_ROWS = 1000000
+
+# stars of a tile queried at once
+BLOCK_ROWS = 200000
+
+MANIFEST_FILE = 'tiles.json'
+RESULTS_DIRECTORY = 'results'
+WIDE_DIRECTORY = 'wide'
+# copy of the catalog's columns while write_tiles runs
+CATALOG_DIRECTORY = 'catalog'
+
+# widening of the halo in radians, so rounding can't leave a neighbor out
+HALO_PADDING = 1e-9
+
+
+
+# -----------------------------------------------------------------------------
+def tile_layout(tile_deg=TILE_DEG):
+    """
+    Split the sky into bands of declination ``tile_deg`` wide, each cut into RA sectors about ``tile_deg`` wide at the band's center.
+
+    :param tile_deg: Approximate side of a tile in degrees.
+    :type tile_deg: float
+    :return: ``dec_edges`` (radians) of the bands and ``n_sectors`` of each band.
+    :rtype: dict
+    """
+    n_bands = max(int(round(180/tile_deg)), 1)
+    dec_edges = np.linspace(-np.pi/2, np.pi/2, n_bands + 1)
+    centers = 0.5*(dec_edges[:-1] + dec_edges[1:])
+    n_sectors = np.maximum(np.round(360*np.cos(centers)/tile_deg), 1).astype(int)
+    return {'dec_edges': dec_edges.tolist(), 'n_sectors': n_sectors.tolist()}
+
+
+
+def tile_of(dec, ra, layout):
+    """
+    Get the tile of each star (its core tile).
+
+    :param dec: Declinations in radians.
+    :type dec: numpy.ndarray
+    :param ra: Right ascensions in radians.
+    :type ra: numpy.ndarray
+    :param layout: The tiles, from :func:`tile_layout`.
+    :type layout: dict
+    :return: The tile number of each star.
+    :rtype: numpy.ndarray
+    """
+    dec_edges, n_sectors = np.asarray(layout['dec_edges']), np.asarray(layout['n_sectors'])
+    offsets = np.concatenate([[0], np.cumsum(n_sectors)])
+    band = np.clip(np.searchsorted(dec_edges, dec, side='right') - 1, 0, len(n_sectors) - 1)
+    sector = np.floor(np.mod(ra, 2*np.pi)/(2*np.pi)*n_sectors[band]).astype(np.int64)
+    return offsets[band] + np.minimum(sector, n_sectors[band] - 1)
+
+
+
+def halo_tiles(dec, ra, halo, layout):
+    """
+    Find the tiles other than its own that each star is within the halo of.
+
+    A star can be within ``halo`` of a tile only if its declination is within ``halo`` of the tile's band and
+    its RA is within asin(sin(halo) / cos(dec)) of the tile's sectors, for the band edge farthest from the
+    equator (every RA if the circle reaches a pole).
+
+    :param dec: Declinations in radians.
+    :type dec: numpy.ndarray
+    :param ra: Right ascensions in radians.
+    :type ra: numpy.ndarray
+    :param halo: Halo width in radians, of every tile or of each tile.
+    :type halo: float or numpy.ndarray
+    :param layout: The tiles, from :func:`tile_layout`.
+    :type layout: dict
+    :return: Index of the star and tile number of each (star, halo tile) pair.
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    dec_edges, n_sectors = np.asarray(layout['dec_edges']), np.asarray(layout['n_sectors'])
+    offsets = np.concatenate([[0], np.cumsum(n_sectors)])
+    ra = np.mod(ra, 2*np.pi)
+    halo = np.broadcast_to(np.asarray(halo, dtype=np.float64), (offsets[-1],)) + HALO_PADDING
+    own = tile_of(dec, ra, layout)
+
+    stars, tiles = [], []
+    for band in range(len(n_sectors)):
+        # the band's widest halo picks the candidates, then each tile keeps the ones in its own halo
+        low, high = dec_edges[band], dec_edges[band + 1]
+        band_halo = np.max(halo[offsets[band]:offsets[band + 1]])
+        near = np.nonzero((dec >= low - band_halo) & (dec <= high + band_halo))[0]
+        if len(near) == 0:
+            continue
+        n = n_sectors[band]
+        width = _halo_width(band_halo, low, high)
+
+        if n == 1 or width >= np.pi:
+            first = np.zeros(len(near), dtype=np.int64)
+            count = np.full(len(near), n, dtype=np.int64)
+        else:
+            sector_width = 2*np.pi/n
+            first = np.floor((ra[near] - width)/sector_width).astype(np.int64)
+            count = np.minimum(np.floor((ra[near] + width)/sector_width).astype(np.int64) - first + 1, n)
+        star = np.repeat(near, count)
+        step = np.arange(len(star)) - np.repeat(np.cumsum(count) - count, count)
+        sector = np.mod(np.repeat(first, count) + step, n)
+        tile = offsets[band] + sector
+        keep = (tile != own[star]) & _in_halo(dec[star], ra[star], halo[tile], low, high, sector, n)
+        stars.append(star[keep])
+        tiles.append(tile[keep])
+
+    if not stars:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(stars), np.concatenate(tiles)
+
+
+
+def _halo_width(halo, low, high):
+    # RA half-width of a band's tiles widened by halo, pi if the circles reach a pole
+    dec_far = np.maximum(abs(low), abs(high))
+    everywhere = (dec_far + halo >= np.pi/2) | (np.sin(halo) >= np.cos(dec_far))
+    return np.where(everywhere, np.pi, np.arcsin(np.minimum(np.sin(halo)/np.cos(dec_far), 1)) + HALO_PADDING)
+
+
+
+def _in_halo(dec, ra, halo, low, high, sector, n):
+    # whether each star is within its halo of a sector of the band, by the bounds of halo_tiles
+    inside = (dec >= low - halo) & (dec <= high + halo)
+    if n == 1:
+        return inside
+    sector_width = 2*np.pi/n
+    past = np.mod(ra - sector*sector_width, 2*np.pi)
+    gap = np.where(past <= sector_width, 0, np.minimum(past - sector_width, 2*np.pi - past))
+    return inside & (gap <= _halo_width(halo, low, high))
+
+
+
+# -----------------------------------------------------------------------------
+def write_tiles(source, directory, s_max_au=3600*180/np.pi, tile_deg=TILE_DEG, wide_deg=None, columns=COLUMNS, chunk_rows=CHUNK_ROWS, overwrite=False):
+    """
+    Stream a catalog into sky tiles with halos, one directory of column files per tile.
+
+    The search radius of each star is ``s_max_au`` projected at its parallax, computed as in the comoving
+    scripts (``s_max_au/(1000/parallax)/3600 * np.pi/180``). A first pass over ``source`` sets the halo of each
+    tile to the largest radius of its core stars, leaving out the wide stars (radius over ``wide_deg``), which
+    are copied to ``wide/`` instead and searched by every tile. ``source`` is read once (so it can be a
+    generator): the first pass also copies ``columns`` to disk, and the tiles are written from that copy,
+    which is removed when they are done. Rows are numbered in the order of ``source``, so the merged results
+    index the same rows.
+
+    :param source: The catalog: a Table, a FITS or csv file, or an iterable of Tables (see ``streaming.iter_table_chunks``).
+    :type source: Table, str, pathlib.Path or iterable
+    :param directory: Directory of the tiles (shared between nodes to run tiles on several nodes).
+    :type directory: str or pathlib.Path
+    :param s_max_au: Largest projected separation in AU (206265 for the 1 pc binary search, 5 times that for the neighbor counts).
+    :type s_max_au: float
+    :param tile_deg: Approximate side of a tile in degrees.
+    :type tile_deg: float
+    :param wide_deg: Search radius in degrees above which a star is searched apart from the tiles. Defaults to ``tile_deg/2``.
+    :type wide_deg: float
+    :param columns: Columns copied into the tiles (ra and dec in degrees, parallax, and the columns the cuts need).
+    :type columns: list of str
+    :param chunk_rows: Number of rows read at a time.
+    :type chunk_rows: int
+    :param overwrite: Replace existing tiles in ``directory``.
+    :type overwrite: bool
+    :raises Exception: Raised if ``directory`` already holds tiles and ``overwrite`` is not set, or holds other files.
+    :return: The manifest of the tiles (also written to ``tiles.json``).
+    :rtype: dict
+    """
+    directory = Path(directory)
+    if (directory / MANIFEST_FILE).exists():
+        if not overwrite:
+            raise Exception('sky_tiles.write_tiles: ' + str(directory) + ' already holds tiles, set overwrite=True to replace them')
+    elif directory.exists() and any(directory.iterdir()):
+        raise Exception('sky_tiles.write_tiles: ' + str(directory) + ' is not empty and holds no complete tiles, remove it first')
+
+    # the tiles go to an empty directory that is moved in place when they are complete, so a run that was
+    # cut off starts over instead of appending to its files
+    partial = directory.with_name(directory.name + '.partial')
+    if partial.exists():
+        shutil.rmtree(partial)
+    partial.mkdir(parents=True)
+
+    layout = tile_layout(tile_deg)
+    n_tiles = int(np.sum(layout['n_sectors']))
+    wide_radius = (tile_deg/2 if wide_deg is None else wide_deg)*np.pi/180
+
+    # first pass: the halo of each tile, the wide stars, and a copy of the columns for the second pass
+    halos = np.zeros(n_tiles)
+    wide_directory = partial / WIDE_DIRECTORY
+    wide_directory.mkdir(exist_ok=True)
+    catalog_directory = partial / CATALOG_DIRECTORY
+    catalog_directory.mkdir(exist_ok=True)
+    n_rows, n_wide = 0, 0
+    for chunk in streaming.iter_table_chunks(source, chunk_rows):
+        values = {name: np.asarray(np.ma.getdata(chunk[name]), dtype=np.float64) for name in columns}
+        dec, ra = values['dec']*np.pi/180, values['ra']*np.pi/180
+        radii = _radii(s_max_au, values['parallax'])
+        wide = radii > wide_radius
+        np.fmax.at(halos, tile_of(dec[~wide], ra[~wide], layout), radii[~wide])
+        _append(wide_directory / 'rows.bin', n_rows + np.nonzero(wide)[0].astype(np.int64))
+        for name in columns:
+            _append(wide_directory / (name + '.bin'), values[name][wide])
+            _append(catalog_directory / (name + '.bin'), values[name])
+        n_rows += len(dec)
+        n_wide += int(np.sum(wide))
+
+    n_core = np.zeros(n_tiles, dtype=np.int64)
+    n_halo = np.zeros(n_tiles, dtype=np.int64)
+    catalog = {name: np.memmap(catalog_directory / (name + '.bin'), dtype=np.float64, mode='r') if n_rows else np.zeros(0)
+               for name in columns}
+    for start in range(0, n_rows, chunk_rows):
+        values = {name: np.array(catalog[name][start:start + chunk_rows]) for name in columns}
+        dec, ra = values['dec']*np.pi/180, values['ra']*np.pi/180
+
+        # every star once in its own tile, and again in the tiles it is in the halo of
+        own = tile_of(dec, ra, layout)
+        star, tile = halo_tiles(dec, ra, halos, layout)
+        star = np.concatenate([np.arange(len(own)), star])
+        tile = np.concatenate([own, tile])
+        core = np.arange(len(star)) < len(own)
+
+        order = np.argsort(tile, kind='stable')
+        star, tile, core = star[order], tile[order], core[order]
+        bounds = np.searchsorted(tile, np.arange(n_tiles + 1))
+        for t in np.nonzero(np.diff(bounds))[0]:
+            members = slice(bounds[t], bounds[t + 1])
+            these = star[members]
+            tile_directory = _tile_dir(partial, t)
+            tile_directory.mkdir(exist_ok=True)
+            _append(tile_directory / 'rows.bin', (start + these).astype(np.int64))
+            _append(tile_directory / 'core.bin', core[members])
+            for name in columns:
+                _append(tile_directory / (name + '.bin'), values[name][these])
+            n_core[t] += np.sum(core[members])
+            n_halo[t] += np.sum(~core[members])
+    del catalog
+    shutil.rmtree(catalog_directory)
+
+    manifest = dict(layout, tile_deg=tile_deg, s_max_au=s_max_au, halos=halos.tolist(), wide_radius=wide_radius, n_wide=n_wide,
+                    columns=list(columns), n_rows=n_rows, n_core=n_core.tolist(), n_halo=n_halo.tolist())
+    with open(partial / MANIFEST_FILE, 'w') as out:
+        json.dump(manifest, out, indent=1)
+    if directory.exists():
+        shutil.rmtree(directory)
+    os.replace(partial, directory)
+    print('sky_tiles.write_tiles: ' + str(n_rows) + ' stars in ' + str(np.sum(n_core > 0)) + ' tiles, with ' + str(int(np.sum(n_halo))) + ' halo copies and ' + str(n_wide) + ' wide stars')
+    return manifest
+
+
+
+def _radii(s_max_au, parallax):
+    # search radius of each star in radians, as in the comoving scripts
+    return s_max_au/(1000/parallax)/3600 * np.pi/180
+
+
+
+def _tile_dir(directory, tile):
+    return Path(directory) / ('tile_' + str(tile).zfill(5))
+
+
+
+def _append(filename, array):
+    with open(filename, 'ab') as out:
+        out.write(np.ascontiguousarray(array).tobytes())
+
+
+
+def read_manifest(directory):
+    """
+    Read the manifest written by :func:`write_tiles`.
+    """
+    with open(Path(directory) / MANIFEST_FILE, 'r') as file:
+        return json.load(file)
+
+
+
+def _read_tile(directory, tile, manifest):
+    # the rows, core flags and columns of a tile
+    data = _read_stars(_tile_dir(directory, tile), manifest)
+    data['core'] = np.fromfile(_tile_dir(directory, tile) / 'core.bin', dtype=bool)
+    return data
+
+
+
+def _read_stars(stars_directory, manifest):
+    # the rows and columns in a directory of column files
+    data = {'rows': np.fromfile(Path(stars_directory) / 'rows.bin', dtype=np.int64)}
+    for name in manifest['columns']:
+        data[name] = np.fromfile(Path(stars_directory) / (name + '.bin'), dtype=np.float64)
+    return data
+
+
+
+# -----------------------------------------------------------------------------
+def search_tiles(directory, kind='pairs', n_workers=None, leaf_size=20, backend='unit_vector', tree_max_mag=None, block_rows=BLOCK_ROWS, **cuts):
+    """
+    Search the tiles written by :func:`write_tiles`, largest first, one tile per worker process.
+
+    Each tile's core stars are searched against its core and halo stars with ``pair_search.binary_pairs``
+    (``kind='pairs'``) or ``pair_search.neighbor_counts`` (``kind='counts'``), the wide stars against its
+    core stars, and the result is written to ``results/`` in ``directory``. Tiles with a result are skipped and tiles being searched elsewhere
+    are locked, so the same call can run on several nodes sharing ``directory`` (or be rerun after a crash;
+    remove the ``.lock`` files a crashed run left behind).
+
+    :param directory: Directory of the tiles.
+    :type directory: str or pathlib.Path
+    :param kind: ``pairs`` for binary candidates, ``counts`` for neighbor counts.
+    :type kind: str
+    :param n_workers: Number of worker processes. Defaults to the number of cores.
+    :type n_workers: int
+    :param leaf_size: Leaf size of the tile trees.
+    :type leaf_size: int
+    :param backend: Tree backend, see ``sky_tree.make_tree``.
+    :type backend: str
+    :param tree_max_mag: Only put stars brighter than this G magnitude in the trees (18 for the neighbor counts).
+    :type tree_max_mag: float
+    :param block_rows: Number of core stars queried at once.
+    :type block_rows: int
+    :param cuts: Keyword arguments for ``pair_search.binary_pairs`` or ``pair_search.neighbor_counts``.
+    :raises Exception: Raised if ``kind`` is not pairs or counts.
+    :return: The tiles that are still missing a result (searched elsewhere, or locked by a crashed run).
+    :rtype: list of int
+    """
+    if kind not in ('pairs', 'counts'):
+        raise Exception('sky_tiles.search_tiles: kind must be pairs or counts')
+    directory = Path(directory)
+    manifest = read_manifest(directory)
+    (directory / RESULTS_DIRECTORY).mkdir(exist_ok=True)
+    if n_workers is None:
+        n_workers = os.cpu_count()
+
+    # largest tiles first, so the long ones don't hold up the end of the run
+    n_stars = np.asarray(manifest['n_core']) + np.asarray(manifest['n_halo'])
+    tiles = [int(t) for t in np.argsort(-n_stars, kind='stable') if manifest['n_core'][t] > 0]
+    tasks = [(str(directory), tile, kind, leaf_size, backend, tree_max_mag, block_rows, cuts) for tile in tiles]
+    with multiprocessing.Pool(n_workers) as pool:
+        for done, (tile, status) in enumerate(pool.imap_unordered(_search_tile, tasks)):
+            print(tile, (done + 1)/len(tasks), status)
+
+    return [tile for tile in tiles if not _result_file(directory, kind, tile).exists()]
+
+
+
+def _result_file(directory, kind, tile):
+    return Path(directory) / RESULTS_DIRECTORY / (kind + '_' + str(tile).zfill(5) + '.npy')
+
+
+
+def _search_tile(task):
+    directory, tile, kind, leaf_size, backend, tree_max_mag, block_rows, cuts = task
+    result = _result_file(directory, kind, tile)
+    if result.exists():
+        return tile, 'done'
+    lock = result.with_suffix('.lock')
+    try:
+        os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        return tile, 'locked'
+
+    try:
+        with open(lock, 'w') as out:
+            out.write(socket.gethostname() + ' ' + str(os.getpid()) + '\n')
+        manifest = read_manifest(directory)
+        data = _read_tile(directory, tile, manifest)
+        stars = {name: data[name] for name in manifest['columns']}
+        coords = np.vstack([data['dec']*np.pi/180, data['ra']*np.pi/180]).T
+
+        # the tree holds the tile's core and halo stars (only the bright ones for the neighbor counts)
+        in_tree = np.arange(len(coords)) if tree_max_mag is None else np.nonzero(data['phot_g_mean_mag'] < tree_max_mag)[0]
+        tree = sky_tree.make_tree(coords[in_tree], leaf_size=leaf_size, backend=backend)
+        tree_stars = {name: values[in_tree] for name, values in stars.items()}
+
+        # only the core stars that are not wide are searched, each within its own radius
+        radii = _radii(manifest['s_max_au'], data['parallax'])
+        core = np.nonzero(data['core'] & ~(radii > manifest['wide_radius']))[0]
+        parts = _search_rows(tree, coords, radii, core, stars, tree_stars, data['rows'], data['rows'][in_tree], kind, block_rows, cuts)
+
+        # the wide stars against the core stars of the tree, so each of their neighbors is found in one tile
+        if manifest['n_wide'] > 0:
+            wide = _read_stars(Path(directory) / WIDE_DIRECTORY, manifest)
+            wide_coords = np.vstack([wide['dec']*np.pi/180, wide['ra']*np.pi/180]).T
+            in_core = in_tree[data['core'][in_tree]]
+            core_tree = sky_tree.make_tree(coords[in_core], leaf_size=leaf_size, backend=backend)
+            core_stars = {name: values[in_core] for name, values in stars.items()}
+            parts += _search_rows(core_tree, wide_coords, _radii(manifest['s_max_au'], wide['parallax']), np.arange(len(wide_coords)),
+                                  wide, core_stars, wide['rows'], data['rows'][in_core], kind, block_rows, cuts)
+
+        # write the result under a temporary name, then move it in place
+        tmp = result.with_name(result.stem + '.' + socket.gethostname() + '-' + str(os.getpid()) + '.tmp.npy')
+        np.save(tmp, np.hstack(parts) if parts else np.zeros((2, 0), dtype=np.int64))
+        os.replace(tmp, result)
+    finally:
+        os.remove(lock)
+    return tile, 'searched'
+
+
+
+def _search_rows(tree, coords, radii, rows, stars, tree_stars, catalog_rows, tree_catalog_rows, kind, block_rows, cuts):
+    # pairs or counts of rows against the tree, in catalog rows, block_rows rows at a time
+    parts = []
+    for start in range(0, len(rows), block_rows):
+        block = rows[start:start + block_rows]
+        indptr, neighbors, distances = pair_search.query_csr(tree, coords[block], radii[block])
+        if kind == 'pairs':
+            star1s, star2s = pair_search.binary_pairs(block, indptr, neighbors, distances, stars, tree_stars, **cuts)
+            parts.append(np.vstack([catalog_rows[star1s], tree_catalog_rows[star2s]]))
+        else:
+            counts = pair_search.neighbor_counts(block, indptr, neighbors, distances, stars, tree_stars, **cuts)
+            parts.append(np.vstack([catalog_rows[block], counts]))
+    return parts
+
+
+
+# -----------------------------------------------------------------------------
+def merge_pairs(directory):
+    """
+    Merge the pairs of every tile, in catalog row order of star 1 (as the whole-sky search returns them).
+
+    :param directory: Directory of the tiles.
+    :type directory: str or pathlib.Path
+    :raises Exception: Raised if a tile has no result yet.
+    :return: Catalog rows of star 1 and star 2 of each pair.
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    pairs = np.hstack([np.zeros((2, 0), dtype=np.int64)] + _load_results(directory, 'pairs'))
+    order = np.argsort(pairs[0], kind='stable')
+    return pairs[0][order], pairs[1][order]
+
+
+
+def merge_counts(directory):
+    """
+    Merge the neighbor counts of every tile into one count per catalog row (a wide star's counts are summed over the tiles).
+
+    :param directory: Directory of the tiles.
+    :type directory: str or pathlib.Path
+    :raises Exception: Raised if a tile has no result yet.
+    :return: The number of neighbors of each star.
+    :rtype: numpy.ndarray
+    """
+    counts = np.zeros(read_manifest(directory)['n_rows'], dtype=np.int64)
+    for result in _load_results(directory, 'counts'):
+        np.add.at(counts, result[0], result[1])
+    return counts
+
+
+
+def _load_results(directory, kind):
+    manifest = read_manifest(directory)
+    tiles = [t for t, n in enumerate(manifest['n_core']) if n > 0]
+    missing = [t for t in tiles if not _result_file(directory, kind, t).exists()]
+    if missing:
+        raise Exception('sky_tiles.merge_' + kind + ': no result yet for tiles ' + ', '.join(str(t) for t in missing))
+    return [np.load(_result_file(directory, kind, t)) for t in tiles]
@@ -0,0 +1,221 @@
+# PY SCRIPT FOR THE SKY-NEIGHBOR TREES OF THE COMOVING STAR SEARCH
+#
+# The comoving search finds every star within an angular radius of each star.
+# sklearn's BallTree with the haversine metric does this on (dec, ra), but it
+# evaluates trig functions at every distance and its ball bounds are loose on
+# the sphere, so it is slow to build and query on tens of millions of stars.
+#
+# UnitVectorTree indexes the stars as 3D unit vectors in a Euclidean KD-tree
+# instead.  An angle theta on the sky is a chord 2 sin(theta/2) between unit
+# vectors, so each angular radius becomes a chord length.  The candidates the
+# KD-tree finds are then tested and measured with the same haversine formula
+# as the BallTree (the chord radius is padded slightly so rounding can't drop
+# a star), which makes the neighbor sets the same as the BallTree's.  The
+# angular distances agree to rounding (numpy's arcsin can differ from the
+# libm asin sklearn uses in the last bit), and the order of each star's
+# neighbors differs.
+#
+# make_tree picks the backend, and benchmark compares the two on a random sky.
+#
+# VERSIONS:
+#  1.0  UNIT-VECTOR KD-TREE BACKEND
+
+
+import time
+
+import numpy as np
+from sklearn.neighbors import BallTree, KDTree
+
+
+
+BACKENDS = ['unit_vector', 'haversine']
+
+# relative and absolute padding of the chord radius, to keep candidates that rounding puts just outside it
+CHORD_PADDING = 1e-9
+
+# relative and absolute tolerance the benchmark compares the backends' distances to
+DISTANCE_RTOL = 1e-12
+DISTANCE_ATOL = 1e-15
+
+
+
+# -----------------------------------------------------------------------------
+def make_tree(coords, leaf_size=20, backend='unit_vector'):
+    """
+    Build a sky-neighbor tree over (dec, ra) in radians.
+
+    Both backends have the ``query_radius`` of ``sklearn.neighbors.BallTree`` and give the same neighbors, with
+    angular distances that agree to rounding. For example::
+
+        tree = sky_tree.make_tree(np.vstack([dec*np.pi/180, ra*np.pi/180]).T, leaf_size = 20)
+
+    :param coords: (dec, ra) in radians of the stars.
+    :type coords: numpy.ndarray
+    :param leaf_size: Leaf size of the tree.
+    :type leaf_size: int
+    :param backend: ``unit_vector`` for a :class:`UnitVectorTree`, ``haversine`` for a haversine BallTree.
+    :type backend: str
+    :raises Exception: Raised if the backend is unknown.
+    :return: The tree.
+    :rtype: UnitVectorTree or sklearn.neighbors.BallTree
+    """
+    if backend == 'unit_vector':
+        return UnitVectorTree(coords, leaf_size=leaf_size)
+    if backend == 'haversine':
+        return BallTree(coords, leaf_size=leaf_size, metric='haversine')
+    raise Exception('sky_tree.make_tree: unknown backend \'' + str(backend) + '\', use one of ' + ', '.join(BACKENDS))
+
+
+
+# -----------------------------------------------------------------------------
+def unit_vectors(coords):
+    """
+    Convert (dec, ra) in radians to 3D unit vectors.
+
+    :param coords: (dec, ra) in radians.
+    :type coords: numpy.ndarray
+    :return: The (x, y, z) unit vectors.
+    :rtype: numpy.ndarray
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    cos_dec = np.cos(coords[:, 0])
+    return np.stack([cos_dec*np.cos(coords[:, 1]), cos_dec*np.sin(coords[:, 1]), np.sin(coords[:, 0])], axis=1)
+
+
+
+def haversine_rdist(coords1, coords2):
+    """
+    Reduced haversine distance sin^2(theta/2) between pairs of (dec, ra), computed as sklearn's haversine metric does.
+    """
+    sin_0 = np.sin(0.5*(coords1[:, 0] - coords2[:, 0]))
+    sin_1 = np.sin(0.5*(coords1[:, 1] - coords2[:, 1]))
+    return sin_0*sin_0 + np.cos(coords1[:, 0])*np.cos(coords2[:, 0])*sin_1*sin_1
+
+
+
+# -----------------------------------------------------------------------------
+class UnitVectorTree:
+    """
+    Angular neighbor search on a Euclidean KD-tree of unit vectors, in place of ``BallTree(coords, metric='haversine')``.
+
+    :param coords: (dec, ra) in radians of the stars.
+    :type coords: numpy.ndarray
+    :param leaf_size: Leaf size of the KD-tree.
+    :type leaf_size: int
+    """
+
+    def __init__(self, coords, leaf_size=20):
+        self.coords = np.ascontiguousarray(coords, dtype=np.float64)
+        self.tree = KDTree(unit_vectors(self.coords), leaf_size=leaf_size)
+
+
+    @classmethod
+    def from_parts(cls, tree, coords):
+        """
+        Make a UnitVectorTree from an existing KD-tree of unit vectors and the (dec, ra) it was built from (e.g. arrays in shared memory).
+        """
+        self = cls.__new__(cls)
+        self.tree = tree
+        self.coords = coords
+        return self
+
+
+    def query_csr(self, coords, radii):
+        """
+        Find the stars within ``radii`` (radians) of each of ``coords``, as a CSR neighbor list.
+
+        :return: ``indptr``, ``neighbors`` and ``distances`` (radians), as ``pair_search.to_csr`` returns them.
+        :rtype: (numpy.ndarray, numpy.ndarray, numpy.ndarray)
+        """
+        coords = np.asarray(coords, dtype=np.float64)
+        radii = np.broadcast_to(np.asarray(radii, dtype=np.float64), (len(coords),))
+        indptr = np.zeros(len(coords) + 1, dtype=np.int64)
+        if len(coords) == 0:
+            return indptr, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+
+        # candidates within the padded chord of each radius (a radius past pi reaches the whole sphere)
+        radii = np.minimum(radii, np.pi)
+        chords = 2*np.sin(0.5*radii)
+        candidates = self.tree.query_radius(unit_vectors(coords), r=chords*(1 + CHORD_PADDING) + CHORD_PADDING)
+        owner = np.repeat(np.arange(len(coords)), [len(idxs) for idxs in candidates])
+        neighbors = np.concatenate(candidates).astype(np.int64, copy=False)
+
+        # the BallTree's test: reduced haversine distance within sin^2(r/2)
+        rdist = haversine_rdist(coords[owner], self.coords[neighbors])
+        max_rdist = np.sin(0.5*radii)
+        max_rdist = max_rdist*max_rdist
+        keep = rdist <= max_rdist[owner]
+        owner, neighbors, rdist = owner[keep], neighbors[keep], rdist[keep]
+
+        np.cumsum(np.bincount(owner, minlength=len(coords)), out=indptr[1:])
+        distances = 2*np.arcsin(np.sqrt(rdist))
+        return indptr, neighbors, distances
+
+
+    def query_radius(self, X, r, return_distance=False):
+        """
+        Same as ``BallTree.query_radius`` on (dec, ra): the neighbor indices (and distances) of each point, as object arrays.
+        """
+        indptr, neighbors, distances = self.query_csr(X, r)
+        inds = np.empty(len(indptr) - 1, dtype=object)
+        inds[:] = np.split(neighbors, indptr[1:-1])
+        if not return_distance:
+            return inds
+        dists = np.empty(len(indptr) - 1, dtype=object)
+        dists[:] = np.split(distances, indptr[1:-1])
+        return inds, dists
+
+
+
+# -----------------------------------------------------------------------------
+def benchmark(n_stars=(10000000, 64000000), n_queries=200000, leaf_size=20, size_max_pc=1, seed=0):
+    """
+    Compare the build and query times of the backends on a random sky and check they find the same neighbors
+    (with distances equal within ``DISTANCE_RTOL`` and ``DISTANCE_ATOL``).
+
+    Stars are uniform on the sky with parallaxes between 1 and 10 mas distributed as in a uniform volume, and
+    each of ``n_queries`` stars is searched within ``size_max_pc`` projected parsecs, as in the binary search.
+
+    :param n_stars: Numbers of stars to benchmark.
+    :type n_stars: list of int
+    :param n_queries: Number of stars queried.
+    :type n_queries: int
+    :param leaf_size: Leaf size of the trees.
+    :type leaf_size: int
+    :param size_max_pc: Search radius in projected parsecs.
+    :type size_max_pc: float
+    :param seed: Seed of the random sky.
+    :type seed: int
+    :return: One row per number of stars and backend, with the build and query times in seconds and the number of neighbors found.
+    :rtype: list of dict
+    """
+    rng = np.random.default_rng(seed)
+    rows = []
+    for n in n_stars:
+        coords = np.vstack([np.arcsin(rng.uniform(-1, 1, n)), rng.uniform(0, 2*np.pi, n)]).T
+        parallax = 1/rng.uniform(0.001, 1, n)**(1/3)
+        radii = size_max_pc*parallax/1000
+        queries = slice(0, min(n_queries, n))
+
+        found = {}
+        for backend in BACKENDS:
+            start = time.perf_counter()
+            tree = make_tree(coords, leaf_size=leaf_size, backend=backend)
+            build = time.perf_counter() - start
+            start = time.perf_counter()
+            inds, dists = tree.query_radius(coords[queries], r=radii[queries], return_distance=True)
+            query = time.perf_counter() - start
+            del tree
+
+            pairs = np.concatenate([np.full(len(idxs), i, dtype=np.int64) for i, idxs in enumerate(inds)]), np.concatenate(inds), np.concatenate(dists)
+            order = np.lexsort(pairs[:2][::-1])
+            found[backend] = [pair[order] for pair in pairs]
+            rows.append({'n_stars': n, 'backend': backend, 'build_s': build, 'query_s': query, 'neighbors': len(order)})
+            print('sky_tree.benchmark: ' + str(n) + ' stars, ' + backend + ': build ' + '%.2f' % build + ' s, ' + str(len(order)) + ' neighbors of ' + str(queries.stop) + ' stars in ' + '%.2f' % query + ' s')
+
+        (rows1, inds1, dists1), (rows2, inds2, dists2) = found['unit_vector'], found['haversine']
+        same = np.array_equal(rows1, rows2) and np.array_equal(inds1, inds2)
+        close = same and np.allclose(dists1, dists2, rtol=DISTANCE_RTOL, atol=DISTANCE_ATOL)
+        print('sky_tree.benchmark: ' + str(n) + ' stars, same neighbors: ' + str(same) + ', distances within tolerance: ' + str(close))
+        del coords, parallax, radii, found
+    return rows